@@ -13,31 +13,59 @@ The generated prompt includes the following information:
 * Constraints on the optimization (e.g. no overlaps, maintain original duration)
 
 The generated output is a JSON string that includes the optimized schedule,
-with each event including its new start and end times.
+with each event including its new start and end times. Both backends stream
+their output, and `predict_stream` yields each event as soon as the model has
+finished generating it.
+
+Instead of the free-text questionnaire, callers can pass the user's
+`energy_profile.EnergyProfile`, which states the same information as an
+hourly curve in far fewer tokens, and reads the same on every call.
+
+`predict_stream` can hedge one backend with the other: if the primary has
+not produced a valid event within a delay, or fails, the secondary starts
+as well. The first backend to produce a valid event wins and the other is
+cancelled, so a slow API only costs a second generation on the slow path.
 
 The class also includes methods for loading the model, creating the prompt,
 and generating the output.
 
+`llama_cpp`, `lmformatenforcer` and `anthropic` are imported where they are
+first used, so importing this module is cheap; the cost is paid when the
+model is loaded, which callers can do in the background.
+
+The LLaMA model comes from the process-wide registry in `model_registry`,
+so `RAGAgent` shares the same weights. It is borrowed for each generation.
+
 """
 
-import json
+import contextvars
 import logging
+import queue
+import threading
+import time
 
-from typing import Optional
+from typing import TYPE_CHECKING, Iterator, Optional
 from dataclasses import dataclass
 
-import torch
-from llama_cpp import Llama, LogitsProcessorList
 from pydantic import BaseModel
-from lmformatenforcer import JsonSchemaParser
-from lmformatenforcer.integrations.llamacpp import (
-    build_llamacpp_logits_processor,
-    build_token_enforcer_tokenizer_data,
-)
-import anthropic
 from dotenv import load_dotenv
 import os
 
+from energy_profile import EnergyProfile
+from json_stream import EventStreamParser
+from metrics import observe_stage, timed
+from model_registry import MODELS, SharedLlama
+from outbound import ANTHROPIC
+
+if TYPE_CHECKING:
+    import anthropic
+    from llama_cpp import Llama
+
+logger = logging.getLogger(__name__)
+
+# The fields an event returned by the model must have to be written back.
+REQUIRED_EVENT_FIELDS = ("id", "calendar_id", "summary", "start", "end")
+
 
 @dataclass
 class GenerationParams:
@@ -84,17 +112,17 @@ class DateTime:
     timeZone: str
 
 
-@dataclass
 class CalendarEvent(BaseModel):
     """
-    CalendarEvent is a dataclass that contains information about a calendar event.
+    CalendarEvent is a model that contains information about a calendar event.
 
     Attributes:
         id (str): The ID of the event.
+        calendar_id (str): The ID of the calendar the event belongs to.
         summary (str): The title of the event.
         description (str): The description of the event.
-        start (DateTime): The start time of the event in YYYY-MM-DDTHH:MM:SSZ format.
-        end (DateTime): The end time of the event in  in YYYY-MM-DDTHH:MM:SSZ format.
+        start (str): The start time of the event in YYYY-MM-DDTHH:MM:SSZ format.
+        end (str): The end time of the event in YYYY-MM-DDTHH:MM:SSZ format.
     """
 
     id: str
@@ -105,7 +133,6 @@ class CalendarEvent(BaseModel):
     end: str
 
 
-@dataclass
 class CalendarEvents(BaseModel):
     events: list[CalendarEvent]
 
@@ -127,6 +154,8 @@ class AICalendarProcessor:
         model_id: str = "lmstudio-community/Meta-Llama-3.1-8B-Instruct-GGUF",
         gen_params: GenerationParams = GenerationParams(),
         verbose: bool = False,
+        client: Optional["anthropic.Anthropic"] = None,
+        model: Optional["Llama"] = None,
         **kwargs,
     ):
         """
@@ -136,89 +165,314 @@ class AICalendarProcessor:
             model_id (str): The ID of the LLaMA model to use.
             gen_params (GenerationParams): The parameters for generating text.
             verbose (bool): Whether to print verbose output.
+            client (Optional[anthropic.Anthropic]): The Anthropic client to use.
+                Defaults to a new client per request.
+            model (Optional[Llama]): A preloaded LLaMA model, used without
+                constrained decoding. If not given, the model is borrowed
+                from the shared registry, loading it from `model_id` if
+                needed.
             **kwargs: Additional keyword arguments.
         """
         self.model_id = model_id
 
         self.verbose = verbose
-        self.tokenizer = None
         self.gen_params = gen_params
+        self.client = client
 
-        self._load_model()
-        self.schema = CalendarEvents.schema()
-
-    def predict_claude(self, prompt):
-        load_dotenv()
-
-        # Send request to Claude API
-        response = anthropic.Anthropic().messages.create(
-            model="claude-3-5-sonnet-20240620",
-            max_tokens=1024,
-            messages=[{"role": "user", "content": prompt}],  # Add prompt herepost(
-        )
-
-        content = json.loads(response.json())["content"][-1]["text"]
-
-        # Extract the JSON part of the response
-        try:
-            json_start = content.index("{")
-            json_end = content.rindex("}") + 1
-            json_content = content[json_start:json_end]
-            optimized_data = json.loads(json_content)
-        except (ValueError, json.JSONDecodeError):
-            print("Failed to parse JSON from Claude's response. Raw response:")
-            print(content)
-            return None
-
-        return optimized_data
+        # Constrained decoding needs tokenizer data built from a real model.
+        self.constrained = model is None
+        if model is None:
+            self._load_model()
+        else:
+            self.model = SharedLlama.wrap(model)
+        self.schema = CalendarEvents.model_json_schema()
 
     def predict(
-        self, events: CalendarEvents, questionnaire: Optional[str] = None
-    ) -> str:
+        self,
+        events: CalendarEvents,
+        questionnaire: Optional[str] = None,
+        profile: Optional[EnergyProfile] = None,
+    ) -> list[dict]:
         """
         Predicts an optimized schedule based on the input data.
 
         Args:
             events (CalendarEvents): The input data in CalendarEvents format.
             questionnaire (Optional[str]): The user's energy levels throughout the day.
+            profile (Optional[EnergyProfile]): The user's parsed energy
+                profile, sent instead of `questionnaire` if given.
 
         Returns:
-            str: The optimized schedule in JSON format.
+            list[dict]: The optimized events.
         """
+        return list(
+            self.predict_stream(events, questionnaire=questionnaire, profile=profile)
+        )
 
-        # If the questionnaire is provided, add it to the prompt
-        if questionnaire:
-            data = (
-                str(events)
-                + "\n Here are some details about the user: "
-                + str(questionnaire)
-            )
+    def predict_stream(
+        self,
+        events: CalendarEvents,
+        questionnaire: Optional[str] = None,
+        backend: str = "claude",
+        hedge_backend: Optional[str] = None,
+        hedge_delay: float = 5.0,
+        profile: Optional[EnergyProfile] = None,
+    ) -> Iterator[dict]:
+        """
+        Predicts an optimized schedule, yielding each event as soon as the
+        model has generated it.
+
+        Events missing any of `REQUIRED_EVENT_FIELDS` are logged and skipped.
+
+        Args:
+            events (CalendarEvents): The input data in CalendarEvents format.
+            questionnaire (Optional[str]): The user's energy levels throughout the day.
+            backend (str): "claude" for the Claude API, or "local" for the
+                LLaMA model with constrained decoding.
+            hedge_backend (Optional[str]): A second backend to race against
+                `backend` if it is slow or fails. None disables hedging.
+            hedge_delay (float): Seconds to wait for the first valid event
+                from `backend` before starting `hedge_backend`.
+            profile (Optional[EnergyProfile]): The user's parsed energy
+                profile, sent instead of `questionnaire` if given.
+
+        Yields:
+            dict: The optimized events, in the order they were generated.
+
+        Raises:
+            ValueError: If the model produced no valid events for a non-empty
+                schedule.
+        """
+        prompt = self._build_prompt(events, questionnaire, profile)
+        if hedge_backend is None or hedge_backend == backend:
+            items = self._stream_events(prompt, backend)
         else:
-            data = str(events)
+            items = self._hedged_events(prompt, backend, hedge_backend, hedge_delay)
 
-        # Create the prompt based on the input data
-        prompt = self._create_prompt(data)
+        start = time.perf_counter()
+        produced = 0
+        try:
+            for item in items:
+                if produced == 0:
+                    observe_stage("llm_first_event", time.perf_counter() - start)
+                produced += 1
+                yield item
+        finally:
+            items.close()
+            observe_stage("llm_call", time.perf_counter() - start)
+
+        if produced == 0 and events:
+            raise ValueError("The model did not return any valid events")
+
+    def _stream_events(
+        self, prompt: str, backend: str, cancelled: Optional[threading.Event] = None
+    ) -> Iterator[dict]:
+        """
+        Streams the valid events of one backend's answer to `prompt`.
 
-        return self.predict_claude(prompt)["events"]
+        Stops between two chunks once `cancelled` is set, which closes the
+        backend's stream.
+        """
+        if backend == "claude":
+            chunks = self._stream_claude(prompt)
+        elif backend == "local":
+            chunks = self._stream_local(prompt)
+        else:
+            raise ValueError(f"Unknown backend: {backend}")
 
-        # # Generate the optimized schedule
-        # output = self._generate(data)
+        parser = EventStreamParser()
+        parse_seconds = 0.0
+        try:
+            for chunk in chunks:
+                if cancelled is not None and cancelled.is_set():
+                    return
+                parse_start = time.perf_counter()
+                items = parser.feed(chunk)
+                parse_seconds += time.perf_counter() - parse_start
+                for item in items:
+                    if not self._is_valid_event(item):
+                        logger.warning(
+                            "Skipping invalid event from the model: %s", item
+                        )
+                        continue
+                    yield item
+        finally:
+            chunks.close()
+            observe_stage("json_parse", parse_seconds)
+
+    def _hedged_events(
+        self, prompt: str, primary: str, secondary: str, delay: float
+    ) -> Iterator[dict]:
+        """
+        Streams the valid events of whichever of two backends produces one
+        first.
+
+        `primary` starts right away and `secondary` once `primary` has gone
+        `delay` seconds without a valid event, or has failed. Each backend
+        runs on its own thread. Once one of them produces a valid event, the
+        other is cancelled and only the winner's events are yielded; errors
+        of the winner after that point are raised as usual.
+        """
+        results = queue.Queue()
+        cancelled = {primary: threading.Event(), secondary: threading.Event()}
+
+        def run(backend: str):
+            try:
+                for item in self._stream_events(prompt, backend, cancelled[backend]):
+                    results.put((backend, item, None))
+            except Exception as exc:
+                results.put((backend, None, exc))
+            else:
+                results.put((backend, None, None))
+
+        def begin(backend: str):
+            # Copy the context so stage timings reach the caller's metrics.
+            context = contextvars.copy_context()
+            threading.Thread(
+                target=context.run, args=(run, backend), daemon=True
+            ).start()
+            started.add(backend)
+            running.add(backend)
+
+        started, running = set(), set()
+        begin(primary)
+        deadline = time.perf_counter() + delay
+        winner, error = None, None
+        try:
+            while True:
+                timeout = None
+                if winner is None and secondary not in started:
+                    timeout = max(0.0, deadline - time.perf_counter())
+                try:
+                    backend, item, exc = results.get(timeout=timeout)
+                except queue.Empty:
+                    logger.info(
+                        "No event from %s after %.1fs, hedging with %s",
+                        primary,
+                        delay,
+                        secondary,
+                    )
+                    begin(secondary)
+                    continue
+
+                if winner is None:
+                    if item is None:
+                        # Finished or failed without a single valid event.
+                        logger.warning(
+                            "The %s backend produced no valid events: %s",
+                            backend,
+                            exc,
+                        )
+                        error = exc or error
+                        running.discard(backend)
+                        if secondary not in started:
+                            begin(secondary)
+                        elif not running:
+                            if error is not None:
+                                raise error
+                            return
+                        continue
+                    winner = backend
+                    for other, flag in cancelled.items():
+                        if other != winner:
+                            flag.set()
+                    logger.debug("The %s backend won the hedged request", winner)
+
+                if backend != winner:
+                    continue
+                if item is not None:
+                    yield item
+                elif exc is not None:
+                    raise exc
+                else:
+                    return
+        finally:
+            for flag in cancelled.values():
+                flag.set()
+
+    def _build_prompt(
+        self,
+        events: CalendarEvents,
+        questionnaire: Optional[str] = None,
+        profile: Optional[EnergyProfile] = None,
+    ) -> str:
+        """
+        Builds the prompt for a list of events and an optional questionnaire
+        or energy profile.
+        """
+        with timed("prompt_build"):
+            if profile is not None:
+                data = (
+                    str(events)
+                    + "\n Here are some details about the user: "
+                    + profile.describe()
+                )
+            # If the questionnaire is provided, add it to the prompt
+            elif questionnaire:
+                data = (
+                    str(events)
+                    + "\n Here are some details about the user: "
+                    + str(questionnaire)
+                )
+            else:
+                data = str(events)
+
+            # Create the prompt based on the input data
+            return self._create_prompt(data)
+
+    def _stream_claude(self, prompt: str) -> Iterator[str]:
+        """
+        Streams the text of the Claude API's answer to `prompt`.
+        """
+        load_dotenv()
+
+        client = self._claude_client()
+        with ANTHROPIC.stream(
+            lambda: client.messages.stream(
+                model="claude-3-5-sonnet-20240620",
+                max_tokens=1024,
+                messages=[{"role": "user", "content": prompt}],
+            )
+        ) as stream:
+            yield from stream.text_stream
 
-        # # Return the optimized schedule
-        # return output
+    def _stream_local(self, prompt: str) -> Iterator[str]:
+        """
+        Streams the text of the LLaMA model's answer to `prompt`.
+        """
+        with self.model.borrow():
+            llama, conversation, logits_processors = self._local_conversation(prompt)
+            for chunk in llama.create_chat_completion(
+                conversation,
+                logits_processor=logits_processors,
+                max_tokens=self.gen_params.max_tokens,
+                temperature=0.8,
+                top_p=0.9,
+                stream=True,
+            ):
+                content = chunk["choices"][0]["delta"].get("content")
+                if content:
+                    yield content
+
+    def _claude_client(self) -> "anthropic.Anthropic":
+        """
+        Returns the injected Anthropic client, or a new one.
+        """
+        if self.client is not None:
+            return self.client
+        import anthropic
+
+        # Retries are left to `ANTHROPIC`, which backs off across all callers.
+        return anthropic.Anthropic(max_retries=0)
+
+    def _is_valid_event(self, event: dict) -> bool:
+        return all(isinstance(event.get(field), str) for field in REQUIRED_EVENT_FIELDS)
 
     def _load_model(self):
         """
-        Loads the LLaMA model.
+        Gets the LLaMA model from the shared registry.
         """
-        self.model = Llama.from_pretrained(
-            repo_id=self.model_id,
-            filename="*Q8_0.gguf",
-            n_ctx=self.gen_params.context_tokens,
-            n_gpu_layers=-1,
-            verbose=True,
-        )
-        self.tokenizer = build_token_enforcer_tokenizer_data(self.model)
+        self.model = MODELS.get(self.model_id, "*Q8_0.gguf")
 
     def _create_prompt(self, data) -> str:
         """
@@ -286,17 +540,28 @@ class AICalendarProcessor:
             str: The optimized schedule in JSON format.
         """
         prompt = self._create_prompt(data)
-        logits_processors = None
 
-        if self.schema:
-            logits_processors = LogitsProcessorList(
-                [
-                    build_llamacpp_logits_processor(
-                        self.tokenizer, JsonSchemaParser(self.schema)
-                    )
-                ]
+        with timed("llm_call"), self.model.borrow():
+            llama, conversation, logits_processors = self._local_conversation(prompt)
+            output = llama.create_chat_completion(
+                conversation,
+                logits_processor=logits_processors,
+                max_tokens=self.gen_params.max_tokens,
+                temperature=0.8,
+                top_p=0.9,
             )
+        generated_content = output["choices"][-1]["message"]["content"]
+
+        return self._parse_output(generated_content)
 
+    def _local_conversation(self, prompt: str) -> tuple["Llama", list, Optional[list]]:
+        """
+        Builds the chat messages and the schema-enforcing logits processors
+        for the LLaMA model, and returns them with the model sized for them.
+        Call it while borrowing the model.
+        """
+        constrained = bool(self.schema) and self.constrained
+        if constrained:
             prompt += f"You MUST answer using the following JSON schema: {self.schema}"
 
         conversation = [
@@ -306,17 +571,31 @@ class AICalendarProcessor:
                 "content": prompt,
             },
         ]
+        # Resize first: the logits processors hold on to the model they are
+        # built for.
+        text = "".join(message["content"] for message in conversation)
+        llama = self.model.fit(text, self.gen_params.max_tokens)
 
-        output = self.model.create_chat_completion(
-            conversation,
-            logits_processor=logits_processors,
-            max_tokens=self.gen_params.max_tokens,
-            temperature=0.8,
-            top_p=0.9,
-        )
-        generated_content = output["choices"][-1]["message"]["content"]
+        logits_processors = None
+        if constrained:
+            from llama_cpp import LogitsProcessorList
+            from lmformatenforcer import JsonSchemaParser
+            from lmformatenforcer.integrations.llamacpp import (
+                build_llamacpp_logits_processor,
+                build_token_enforcer_tokenizer_data,
+            )
 
-        return self._parse_output(generated_content)
+            tokenizer = self.model.derived(
+                "token_enforcer", build_token_enforcer_tokenizer_data
+            )
+            logits_processors = LogitsProcessorList(
+                [
+                    build_llamacpp_logits_processor(
+                        tokenizer, JsonSchemaParser(self.schema)
+                    )
+                ]
+            )
+        return llama, conversation, logits_processors
 
     def _parse_output(self, output):
         return output
@@ -12,33 +12,66 @@ new documents, and querying the index with user input.
 The class also has methods for generating text based on the output of the
 query engine.
 
+The default LLM and embedding backends (`llama_cpp` and the HuggingFace
+embeddings, which pull in `torch`) are imported only when no LLM or
+embedding model is passed in. With `embed_backend="onnx"`, the embeddings
+run on an int8 ONNX export of the same model instead (see the
+`onnx_embedding` module), falling back to the HuggingFace embeddings if it
+cannot be loaded.
+
+Documents are read through a `doc_cache.DocumentCache`, so each file is
+parsed once, in parallel with the others, rather than every time an index
+is created or refreshed.
+
+Each agent's index is loaded when the agent is first queried, not at
+startup. The loaded indices are kept within a memory budget, evicting the
+least recently used, and loaded again when needed.
+
+The default LLM is borrowed from the process-wide registry in
+`model_registry`, so the chatbot shares its weights with
+`AICalendarProcessor` instead of loading a second copy.
+
 """
 
 import os
 import hashlib
 import json
+import logging
 import re
+import threading
+from collections import OrderedDict
+from typing import Any, Optional
 
 from llama_index.core import (
     VectorStoreIndex,
-    SimpleDirectoryReader,
     Settings,
     StorageContext,
     load_index_from_storage,
     set_global_tokenizer,
 )
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.llms import (
+    LLM,
+    CompletionResponse,
+    CompletionResponseGen,
+    CustomLLM,
+    LLMMetadata,
+)
+from llama_index.core.llms.callbacks import llm_completion_callback
 from llama_index.core.retrievers import VectorIndexRetriever
 from llama_index.core.query_engine import RetrieverQueryEngine
-from llama_index.llms.llama_cpp import LlamaCPP
-from llama_index.llms.llama_cpp.llama_utils import (
-    messages_to_prompt,
-    completion_to_prompt,
-)
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
 from llama_index.core.memory import ChatMemoryBuffer
-from transformers import AutoTokenizer
 from dataclasses import dataclass
 
+from doc_cache import DocumentCache, indexed_pages, stale_documents
+from metrics import timed
+from model_registry import MODELS, SharedLlama, parse_model_url
+
+logger = logging.getLogger(__name__)
+
+EMBED_MODEL = "BAAI/bge-small-en-v1.5"
+
 
 @dataclass
 class Reference:
@@ -47,15 +80,139 @@ class Reference:
     title: str
 
 
+class SharedLlamaLLM(CustomLLM):
+    """
+    A llama_index LLM that borrows a model from `model_registry` for each
+    completion.
+
+    Attributes:
+        context_window (int): The tokens llama_index may pack into a prompt,
+            retrieved context included. The model's context grows to what
+            the prompts actually use.
+        num_output (int): The maximum number of tokens to generate.
+        temperature (float): The sampling temperature.
+        stop (list[str]): Strings that end the completion.
+    """
+
+    context_window: int = 16384
+    num_output: int = 1000
+    temperature: float = 0.4
+    stop: list[str] = []
+    _model: Any = PrivateAttr()
+
+    def __init__(self, model: SharedLlama, **kwargs):
+        super().__init__(**kwargs)
+        self._model = model
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(
+            context_window=self.context_window,
+            num_output=self.num_output,
+            model_name=self._model.filename or "llama",
+        )
+
+    @llm_completion_callback()
+    def complete(
+        self, prompt: str, formatted: bool = False, **kwargs
+    ) -> CompletionResponse:
+        if not formatted:
+            prompt = self.completion_to_prompt(prompt)
+        with self._model.borrow():
+            llama = self._model.fit(prompt, self.num_output)
+            response = llama(
+                prompt,
+                max_tokens=self.num_output,
+                temperature=self.temperature,
+                stop=self.stop,
+            )
+        return CompletionResponse(text=response["choices"][0]["text"], raw=response)
+
+    @llm_completion_callback()
+    def stream_complete(
+        self, prompt: str, formatted: bool = False, **kwargs
+    ) -> CompletionResponseGen:
+        if not formatted:
+            prompt = self.completion_to_prompt(prompt)
+
+        def generate() -> CompletionResponseGen:
+            # The model stays borrowed until the stream is consumed or closed.
+            with self._model.borrow():
+                llama = self._model.fit(prompt, self.num_output)
+                text = ""
+                for chunk in llama(
+                    prompt,
+                    max_tokens=self.num_output,
+                    temperature=self.temperature,
+                    stop=self.stop,
+                    stream=True,
+                ):
+                    delta = chunk["choices"][0]["text"]
+                    text += delta
+                    yield CompletionResponse(text=text, delta=delta)
+
+        return generate()
+
+
+def load_embed_model(backend: str = "huggingface") -> BaseEmbedding:
+    """
+    Loads the embedding model of the chatbot.
+
+    Args:
+        backend (str): "huggingface" for PyTorch inference, or "onnx" for
+            the int8 ONNX Runtime export. If the latter cannot be loaded,
+            e.g. because `onnxruntime` is not installed, the HuggingFace
+            model is used.
+
+    Returns:
+        BaseEmbedding: The embedding model.
+    """
+    if backend == "onnx":
+        try:
+            from onnx_embedding import OnnxEmbedding
+
+            return OnnxEmbedding(model_name=EMBED_MODEL)
+        except (ImportError, OSError) as e:
+            logger.warning("Falling back to the HuggingFace embeddings: %s", e)
+    elif backend != "huggingface":
+        raise ValueError(f"Invalid embedding backend: {backend}")
+
+    from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+
+    return HuggingFaceEmbedding(model_name=EMBED_MODEL)
+
+
+def index_size(persist_dir: str) -> int:
+    """
+    Estimates the memory an index takes from the size of its persisted
+    files, which hold the same vectors, nodes and metadata.
+    """
+    total = 0
+    for root, _, files in os.walk(persist_dir):
+        for file in files:
+            total += os.path.getsize(os.path.join(root, file))
+    return total
+
+
 class RAGAgent:
     """
     Initialize the RAGAgent class.
 
     Args:
-        llm_url (str): The URL of the LLaMA model.
+        llm_url (str): The Hugging Face download URL of the LLaMA model.
         directory (str): The directory containing the text files to index.
         agent_types (list[str]): The types of agents to support. Defaults to
             ["philosopher", "lawyer", "monk", "productivity"].
+        storage_dir (str): The directory the indices are persisted to.
+        llm (Optional[LLM]): An LLM to use instead of loading `llm_url`.
+        embed_model (Optional[BaseEmbedding]): An embedding model to use
+            instead of loading one for `embed_backend`.
+        embed_backend (str): The embedding backend, "huggingface" or "onnx".
+        documents (Optional[DocumentCache]): The cache to read documents
+            through. Defaults to one stored in `storage_dir`.
+        memory_budget (Optional[int]): The bytes the loaded indices may take,
+            see `index_size`. The least recently used are evicted beyond it.
+            None for no limit.
     """
 
     def __init__(
@@ -63,48 +220,120 @@ class RAGAgent:
         llm_url: str = "https://huggingface.co/lmstudio-community/Meta-Llama-3.1-8B-Instruct-GGUF/resolve/main/Meta-Llama-3.1-8B-Instruct-Q8_0.gguf",
         directory: str = "../holy_texts",
         agent_types: list[str] = ["monk", "lawyer", "philosopher", "productivity"],
+        storage_dir: str = "storage",
+        llm: Optional[LLM] = None,
+        embed_model: Optional[BaseEmbedding] = None,
+        embed_backend: str = "huggingface",
+        documents: Optional[DocumentCache] = None,
+        memory_budget: Optional[int] = None,
     ):
-        # Load the LLaMA model
-        self.llm = LlamaCPP(
-            model_url=llm_url,
-            temperature=0.4,
-            max_new_tokens=1000,
-            context_window=64000,
-            model_kwargs={"n_gpu_layers": -1},  # Set to at least 1 to use GPU
-            messages_to_prompt=messages_to_prompt,
-            completion_to_prompt=completion_to_prompt,
-            generate_kwargs={
-                "stop": ["/SYS", "[/INST]", "</INST>", "[[INST]]"]
-            },  # Add this line
-            verbose=True,
-        )
+        # Borrow the LLaMA model from the shared registry
+        if llm is None:
+            from llama_index.llms.llama_cpp.llama_utils import (
+                messages_to_prompt,
+                completion_to_prompt,
+            )
+
+            model = MODELS.get(*parse_model_url(llm_url))
+            llm = SharedLlamaLLM(
+                model,
+                temperature=0.4,
+                num_output=1000,
+                messages_to_prompt=messages_to_prompt,
+                completion_to_prompt=completion_to_prompt,
+                stop=["/SYS", "[/INST]", "</INST>", "[[INST]]"],
+            )
+            # Count tokens with the model's own vocabulary. `tokenize` does
+            # not wait for generations holding the model.
+            set_global_tokenizer(model.tokenize)
+        self.llm = llm
         Settings.llm = self.llm
-        set_global_tokenizer(
-            AutoTokenizer.from_pretrained(
-                "meta-llama/Meta-Llama-3.1-8B-Instruct"
-            ).encode
-        )
 
         # Load the agent types
         self.agent_types = agent_types
 
         # Set the embedding model
-        Settings.embed_model = HuggingFaceEmbedding(model_name="BAAI/bge-small-en-v1.5")
+        if embed_model is None:
+            embed_model = load_embed_model(embed_backend)
+        Settings.embed_model = embed_model
 
-        # Initialize the index
-        self.indices = {}
-        for agent in agent_types:
-            self.indices[agent], previous_hashes = self._load_or_create_index(
-                directory + f"/{agent}", f"storage/{agent}"
-            )
-            self.indices[agent] = self._update_index(
-                self.indices[agent],
-                directory + f"/{agent}",
-                previous_hashes,
-                f"storage/{agent}",
-            )
+        # Parsed documents are shared by the agents
+        self.documents = documents or DocumentCache(
+            os.path.join(storage_dir, "documents.sqlite3")
+        )
+
+        # The indices are loaded on first use, see `get_index`
+        self.directory = directory
+        self.storage_dir = storage_dir
+        self.memory_budget = memory_budget
+        # The loaded indices, least recently used first
+        self.indices: OrderedDict[str, VectorStoreIndex] = OrderedDict()
+        self._index_sizes: dict[str, int] = {}
+        # The agents whose documents were checked for changes
+        self._updated: set[str] = set()
+        self._indices_lock = threading.Lock()
+        self._load_locks = {agent: threading.Lock() for agent in agent_types}
         self.memory = ChatMemoryBuffer.from_defaults(token_limit=1500)
 
+    def get_index(self, agent_type: str) -> VectorStoreIndex:
+        """
+        Returns the index of an agent, loading it if needed.
+
+        The first load of an agent's index in the process also brings it up
+        to date with its documents. Loading an index may evict others, see
+        `memory_budget`.
+
+        Args:
+            agent_type (str): The type of agent.
+
+        Returns:
+            VectorStoreIndex: The agent's index.
+        """
+        with self._indices_lock:
+            if agent_type in self.indices:
+                self.indices.move_to_end(agent_type)
+                return self.indices[agent_type]
+
+        # Queries for the same agent wait for one load.
+        with self._load_locks[agent_type]:
+            with self._indices_lock:
+                if agent_type in self.indices:
+                    self.indices.move_to_end(agent_type)
+                    return self.indices[agent_type]
+
+            directory = f"{self.directory}/{agent_type}"
+            persist_dir = f"{self.storage_dir}/{agent_type}"
+            with timed("index_load"):
+                index, previous_hashes = self._load_or_create_index(
+                    directory, persist_dir
+                )
+                if agent_type not in self._updated:
+                    index = self._update_index(
+                        index, directory, previous_hashes, persist_dir
+                    )
+                    self._updated.add(agent_type)
+
+            with self._indices_lock:
+                self.indices[agent_type] = index
+                self._index_sizes[agent_type] = index_size(persist_dir)
+                self._evict()
+            return index
+
+    def _evict(self):
+        """
+        Evicts the least recently used indices until the loaded ones fit in
+        `memory_budget`, always keeping the most recent.
+        """
+        if self.memory_budget is None:
+            return
+        while (
+            len(self.indices) > 1
+            and sum(self._index_sizes.values()) > self.memory_budget
+        ):
+            agent_type, _ = self.indices.popitem(last=False)
+            size = self._index_sizes.pop(agent_type)
+            logger.info("Evicted the %s index (%d bytes)", agent_type, size)
+
     def _get_document_hashes(self, directory):
         """
         Get the document hashes for a given directory.
@@ -150,12 +379,12 @@ class RAGAgent:
                 previous_hashes = json.load(f)
         else:
             print("Creating new index...")
-            documents = SimpleDirectoryReader(directory, recursive=True).load_data()
+            previous_hashes = self._get_document_hashes(directory)
+            documents = self.documents.load_directory(directory, previous_hashes)
             index = VectorStoreIndex.from_documents(documents, show_progress=True)
 
             os.makedirs(persist_dir)
             # Save the initial document hashes
-            previous_hashes = self._get_document_hashes(directory)
             with open(os.path.join(persist_dir, "document_hashes.json"), "w") as f:
                 json.dump(previous_hashes, f)
 
@@ -185,21 +414,30 @@ class RAGAgent:
         current_hashes = self._get_document_hashes(directory)
 
         # Check for new or modified documents
-        updated_docs = []
+        updated_files = []
         for file_path, current_hash in current_hashes.items():
             if (
                 file_path not in previous_hashes
                 or previous_hashes[file_path] != current_hash
             ):
                 print(f"Updating document: {file_path}")
-                doc = SimpleDirectoryReader(input_files=[file_path]).load_data()[0]
-                updated_docs.append(doc)
+                updated_files.append(file_path)
+        updated_docs = self.documents.load(updated_files, current_hashes)
 
         # Check for deleted documents
+        removed_files = []
         for file_path in previous_hashes:
             if file_path not in current_hashes:
                 print(f"Removing document: {file_path}")
-                index.delete(file_path)
+                removed_files.append(file_path)
+
+        # Delete every page of a removed file, and the pages a changed file
+        # no longer has
+        stale = stale_documents(
+            indexed_pages(index), updated_docs, updated_files + removed_files
+        )
+        for doc_id in stale:
+            index.delete_ref_doc(doc_id, delete_from_docstore=True)
 
         # Update the index with new or modified documents
         if updated_docs:
@@ -228,7 +466,7 @@ class RAGAgent:
 
         # Set up advanced retrieval
         vector_retriever = VectorIndexRetriever(
-            index=self.indices[agent_type], similarity_top_k=10
+            index=self.get_index(agent_type), similarity_top_k=10
         )
 
         # Create the query engine
@@ -246,8 +484,8 @@ class RAGAgent:
         for node in response.source_nodes:
             r = {
                 "text": node.node.text[:200].lstrip("0123456789"),
-                "page": node.node.metadata["page_label"],
-                "title": node.node.metadata["file_name"],
+                "page": node.node.metadata.get("page_label"),
+                "title": node.node.metadata.get("file_name"),
             }
 
             references.append(r)
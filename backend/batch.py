@@ -0,0 +1,572 @@
+"""
+Offline batch optimization of many users' calendars.
+
+The nightly "plan tomorrow" job used to call `/process_calendar_events`
+once per user over HTTP, one user after the other. This module runs the
+same fetch, optimize and validate steps in process, for every user listed
+in a JSONL file, as a pipeline of three stages:
+
+* fetch: syncs the user's calendars through the event store;
+* optimize: builds the user's energy profile, has the LLM optimize each day
+  and validates the schedules with a `ScheduleValidator`;
+* write-back: writes the events that moved to the calendar.
+
+Each stage has its own pool of workers, connected by bounded queues, so
+one user's events are fetched while another's are optimized and a third's
+are written back, and a slow stage holds back the ones before it rather
+than piling up fetched events in memory. The stages run in threads: their
+work is waiting on Google Calendar and the LLM, and the outbound rate
+limits of the `outbound` module are per process, so more processes would
+only exceed them.
+
+Progress is checkpointed in a SQLite database (`BatchCheckpoint`). A user's
+validated plan is stored before it is written back, and the user is marked
+done once it is. A batch run again with the same checkpoint skips the
+users that are done, and writes back the stored plans without optimizing
+again. Writing a plan twice moves the same events to the same slots, so a
+user with writes that failed is marked failed rather than done, and the
+next run writes its plan back again. A user whose calendars, questionnaire or dates changed since the checkpoint
+starts over.
+
+Each line of the input file is an object with the `user_id`, the
+`calendar_ids` and the `questionnaire` of a user, and optionally a `date`,
+or a `start_date` and an `end_date`. Users without dates take the ones
+given on the command line, tomorrow by default.
+
+The batch is configured with the same environment variables as the API,
+see `divine.Settings`. Usage (from the `backend` directory):
+
+    python batch.py users.jsonl [--date YYYY-MM-DD]
+        [--start-date YYYY-MM-DD --end-date YYYY-MM-DD]
+        [--checkpoint PATH] [--restart]
+        [--fetchers N] [--optimizers N] [--writers N]
+"""
+
+import argparse
+import asyncio
+import contextvars
+import json
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date as Date, timedelta
+from typing import Callable, Optional
+
+from fastapi import HTTPException
+
+from calapi import update_or_create_event
+from divine import (
+    check_dates,
+    event_cache,
+    event_store,
+    fetch_days,
+    get_calendar_processor,
+    get_calendar_service,
+    profile_store,
+    settings,
+)
+from ai_calendar_processor import AICalendarProcessor
+from metrics import timed
+from schedule_validator import ScheduleValidator
+from singleflight import normalize_text, request_key
+from sqlite_store import SQLiteStore
+
+logger = logging.getLogger(__name__)
+
+OPTIMIZED = "optimized"
+DONE = "done"
+FAILED = "failed"
+
+
+class BatchCheckpoint(SQLiteStore):
+    """
+    The progress of batches stored in a SQLite database.
+
+    A user has one row: the `key` of the input it was run with (see
+    `user_key`), its status, and its plan, result or error.
+
+    Attributes:
+        path (str): The path of the database file.
+    """
+
+    SCHEMA = (
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id TEXT PRIMARY KEY,
+            key TEXT NOT NULL,
+            status TEXT NOT NULL,
+            plan TEXT,
+            result TEXT,
+            error TEXT,
+            updated REAL NOT NULL
+        )
+        """,
+    )
+    ROW_FACTORY = sqlite3.Row
+
+    def __init__(self, path: str = "batch.sqlite3"):
+        super().__init__(path)
+
+    def get(self, user_id: str, key: str) -> Optional[dict]:
+        """
+        Returns the progress of a user, or None if there is none for the
+        input identified by `key`.
+        """
+        row = (
+            self._connection()
+            .execute(
+                "SELECT * FROM users WHERE user_id = ? AND key = ?", (user_id, key)
+            )
+            .fetchone()
+        )
+        if row is None:
+            return None
+        progress = dict(row)
+        for field in ("plan", "result"):
+            if progress[field] is not None:
+                progress[field] = json.loads(progress[field])
+        return progress
+
+    def _save(
+        self,
+        user_id: str,
+        key: str,
+        status: str,
+        plan: Optional[dict] = None,
+        result: Optional[dict] = None,
+        error: Optional[str] = None,
+    ):
+        self._connection().execute(
+            "INSERT OR REPLACE INTO users VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                user_id,
+                key,
+                status,
+                None if plan is None else json.dumps(plan),
+                None if result is None else json.dumps(result),
+                error,
+                time.time(),
+            ),
+        )
+
+    def optimized(self, user_id: str, key: str, plan: dict):
+        """
+        Records the validated plan of a user, before it is written back.
+        """
+        self._save(user_id, key, OPTIMIZED, plan=plan)
+
+    def done(self, user_id: str, key: str, result: dict):
+        """
+        Records that a user's plan was written back.
+        """
+        self._save(user_id, key, DONE, result=result)
+
+    def failed(self, user_id: str, key: str, error: str, plan: Optional[dict]):
+        """
+        Records that a user failed. The user is tried again by the next run,
+        from its plan if it was optimized.
+        """
+        self._save(user_id, key, FAILED, plan=plan, error=error)
+
+    def clear(self):
+        """
+        Forgets the progress of every user.
+        """
+        self._connection().execute("DELETE FROM users")
+
+
+def read_users(
+    path: str,
+    date: Optional[str] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+) -> list[dict]:
+    """
+    Reads the users of a batch from a JSONL file.
+
+    Args:
+        path (str): The input file.
+        date (Optional[str]): The date of users that give no dates.
+        start_date (Optional[str]): The first date of users that give no
+            dates, if `date` is not given.
+        end_date (Optional[str]): The last date of users that give no dates,
+            if `date` is not given.
+
+    Returns:
+        list[dict]: The users, each with its `date`, `start_date` and
+            `end_date`.
+
+    Raises:
+        ValueError: If a line is not a valid user.
+    """
+    users, seen = [], set()
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                user = json.loads(line)
+                user_id = user["user_id"]
+                calendar_ids, questionnaire = (
+                    user["calendar_ids"],
+                    user["questionnaire"],
+                )
+            except (json.JSONDecodeError, KeyError, TypeError) as exc:
+                raise ValueError(f"{path}:{number}: invalid user: {exc}") from exc
+            if user_id in seen:
+                raise ValueError(f"{path}:{number}: duplicate user {user_id!r}")
+            seen.add(user_id)
+
+            if not any(user.get(field) for field in ("date", "start_date")):
+                user = {
+                    **user,
+                    "date": date,
+                    "start_date": start_date,
+                    "end_date": end_date,
+                }
+            try:
+                check_dates(
+                    user.get("date"), user.get("start_date"), user.get("end_date")
+                )
+            except HTTPException as exc:
+                raise ValueError(f"{path}:{number}: {exc.detail}") from exc
+            users.append(
+                {
+                    "user_id": user_id,
+                    "calendar_ids": calendar_ids,
+                    "questionnaire": questionnaire,
+                    "date": user.get("date"),
+                    "start_date": user.get("start_date"),
+                    "end_date": user.get("end_date"),
+                }
+            )
+    return users
+
+
+def user_key(user: dict) -> str:
+    """
+    Returns the key of a user's input, which changes if anything that
+    affects its plan does.
+    """
+    return request_key(
+        "batch",
+        user["user_id"],
+        sorted(set(user["calendar_ids"])),
+        normalize_text(user["questionnaire"]),
+        user["date"],
+        user["start_date"],
+        user["end_date"],
+    )
+
+
+def fetch(user: dict, service) -> dict[str, list]:
+    """
+    Returns the events of a user per day, like `divine.optimize_calendar`.
+    """
+    return fetch_days(
+        service,
+        user["user_id"],
+        user["calendar_ids"],
+        user["date"] or user["start_date"],
+        user["date"] or user["end_date"],
+    )
+
+
+def optimize(user: dict, days: dict[str, list], processor: AICalendarProcessor) -> dict:
+    """
+    Optimizes and validates each day of a user, without writing anything.
+
+    Returns:
+        dict: The plan: the events to write in `writes`, the number of
+            events optimized per day in `days`, and the error message of
+            each day that failed in `errors`.
+    """
+    profile = profile_store.get(user["user_id"], user["questionnaire"])
+    plan = {"writes": [], "days": {}, "errors": {}}
+    for day, day_events in sorted(days.items()):
+        if not day_events:
+            continue
+        try:
+            validator = ScheduleValidator(day_events, mode=settings.schedule_validation)
+            valid = []
+            for event in processor.predict_stream(
+                day_events,
+                profile=profile,
+                backend=settings.llm_backend,
+                hedge_backend=settings.llm_hedge_backend,
+                hedge_delay=settings.llm_hedge_delay,
+            ):
+                with timed("validate"):
+                    valid.extend(validator.submit(event))
+            with timed("validate"):
+                valid.extend(validator.finish())
+        except Exception as exc:
+            logger.error(
+                "Failed to optimize %s for %s", day, user["user_id"], exc_info=exc
+            )
+            plan["errors"][day] = str(exc)
+            continue
+        plan["writes"].extend(valid)
+        plan["days"][day] = len(valid) + len(validator.unchanged)
+    if plan["errors"] and not plan["days"]:
+        raise RuntimeError(json.dumps(plan["errors"]))
+    return plan
+
+
+def write_back(user: dict, plan: dict, service) -> dict:
+    """
+    Writes a user's plan to the calendar.
+
+    Returns:
+        dict: The result of the user: the `days` and `errors` of the plan,
+            and the number of events `written` and that `failed` to write.
+    """
+    failed = 0
+    try:
+        for event in plan["writes"]:
+            with timed("write_back"):
+                if update_or_create_event(service, event_data=event) is None:
+                    failed += 1
+    finally:
+        event_cache.invalidate_user(user["user_id"])
+        event_store.mark_stale(user["user_id"])
+    return {
+        "days": plan["days"],
+        "errors": plan["errors"],
+        "written": len(plan["writes"]) - failed,
+        "failed": failed,
+    }
+
+
+class Batch:
+    """
+    A pipelined run over the users of a batch.
+
+    Attributes:
+        users (list[dict]): The users, see `read_users`.
+        checkpoint (BatchCheckpoint): Where progress is recorded.
+        processor (AICalendarProcessor): The processor to optimize with.
+        service: The Google Calendar service to read and write events with.
+        fetchers (int): The users fetched at the same time.
+        optimizers (int): The users optimized at the same time.
+        writers (int): The users written back at the same time.
+        stats (dict[str, int]): The number of users `done`, `failed` and
+            `skipped` because a previous run finished them.
+    """
+
+    def __init__(
+        self,
+        users: list[dict],
+        checkpoint: BatchCheckpoint,
+        processor: AICalendarProcessor,
+        service,
+        fetchers: int = 4,
+        optimizers: int = 4,
+        writers: int = 4,
+    ):
+        self.users = users
+        self.checkpoint = checkpoint
+        self.processor = processor
+        self.service = service
+        self.fetchers = fetchers
+        self.optimizers = optimizers
+        self.writers = writers
+        self.stats = {DONE: 0, FAILED: 0, "skipped": 0}
+        self._executor = ThreadPoolExecutor(
+            max_workers=fetchers + optimizers + writers, thread_name_prefix="batch"
+        )
+        self._started = None
+
+    def throughput(self) -> float:
+        """
+        Returns the users finished per minute since the run started.
+        """
+        if self._started is None:
+            return 0.0
+        elapsed = time.monotonic() - self._started
+        return 60.0 * (self.stats[DONE] + self.stats[FAILED]) / max(elapsed, 1e-9)
+
+    async def _call(self, func: Callable, *args):
+        # Copy the context so stage timings are recorded like in a request.
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, context.run, func, *args
+        )
+
+    def _fail(self, item: dict, exc: Exception):
+        logger.error("Failed user %s", item["user"]["user_id"], exc_info=exc)
+        self.checkpoint.failed(
+            item["user"]["user_id"], item["key"], str(exc), item["plan"]
+        )
+        self.stats[FAILED] += 1
+
+    async def _fetch(self, item: dict) -> dict:
+        if item["plan"] is None:
+            item["days"] = await self._call(fetch, item["user"], self.service)
+        return item
+
+    async def _optimize(self, item: dict) -> dict:
+        if item["plan"] is None:
+            item["plan"] = await self._call(
+                optimize, item["user"], item.pop("days"), self.processor
+            )
+            self.checkpoint.optimized(
+                item["user"]["user_id"], item["key"], item["plan"]
+            )
+        return item
+
+    async def _write(self, item: dict):
+        result = await self._call(write_back, item["user"], item["plan"], self.service)
+        if result["failed"]:
+            # Fails the user, so the next run writes the plan back again.
+            raise RuntimeError(
+                f"{result['failed']} of {len(item['plan']['writes'])} writes failed"
+            )
+        self.checkpoint.done(item["user"]["user_id"], item["key"], result)
+        self.stats[DONE] += 1
+
+    async def _stage(
+        self,
+        work: Callable,
+        workers: int,
+        inbox: asyncio.Queue,
+        outbox: Optional[asyncio.Queue],
+        downstream: int,
+    ):
+        """
+        Runs `workers` workers applying `work` to the items of `inbox` and
+        passing the results to `outbox`, until each gets None. Then sends
+        None to each of the `downstream` workers of `outbox`.
+        """
+
+        async def worker():
+            while (item := await inbox.get()) is not None:
+                try:
+                    result = await work(item)
+                except Exception as exc:
+                    self._fail(item, exc)
+                    continue
+                if outbox is not None:
+                    await outbox.put(result)
+
+        await asyncio.gather(*(worker() for _ in range(workers)))
+        for _ in range(downstream):
+            await outbox.put(None)
+
+    async def _report(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            logger.info(
+                "%d/%d users done, %d failed, %.1f users/min",
+                self.stats[DONE] + self.stats["skipped"],
+                len(self.users),
+                self.stats[FAILED],
+                self.throughput(),
+            )
+
+    async def run(self, report_interval: float = 30.0) -> dict:
+        """
+        Runs the batch.
+
+        Args:
+            report_interval (float): Seconds between progress logs.
+
+        Returns:
+            dict: The `stats`, the `seconds` the run took and its throughput
+                in `users_per_minute`.
+        """
+        fetch_queue = asyncio.Queue()
+        optimize_queue = asyncio.Queue(maxsize=2 * self.optimizers)
+        write_queue = asyncio.Queue(maxsize=2 * self.writers)
+        for user in self.users:
+            key = user_key(user)
+            progress = self.checkpoint.get(user["user_id"], key)
+            if progress is not None and progress["status"] == DONE:
+                self.stats["skipped"] += 1
+                continue
+            plan = progress["plan"] if progress is not None else None
+            fetch_queue.put_nowait({"user": user, "key": key, "plan": plan})
+        for _ in range(self.fetchers):
+            fetch_queue.put_nowait(None)
+        logger.info(
+            "Running %d users, %d already done",
+            fetch_queue.qsize() - self.fetchers,
+            self.stats["skipped"],
+        )
+
+        self._started = time.monotonic()
+        reporter = asyncio.create_task(self._report(report_interval))
+        try:
+            await asyncio.gather(
+                self._stage(
+                    self._fetch,
+                    self.fetchers,
+                    fetch_queue,
+                    optimize_queue,
+                    self.optimizers,
+                ),
+                self._stage(
+                    self._optimize,
+                    self.optimizers,
+                    optimize_queue,
+                    write_queue,
+                    self.writers,
+                ),
+                self._stage(self._write, self.writers, write_queue, None, 0),
+            )
+        finally:
+            reporter.cancel()
+            self._executor.shutdown(wait=False)
+        return {
+            **self.stats,
+            "seconds": time.monotonic() - self._started,
+            "users_per_minute": self.throughput(),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("users", help="A JSONL file with one user per line")
+    parser.add_argument("--date", help="The date of users that give none")
+    parser.add_argument("--start-date", help="The first date of users that give none")
+    parser.add_argument("--end-date", help="The last date of users that give none")
+    parser.add_argument("--checkpoint", default="batch.sqlite3")
+    parser.add_argument(
+        "--restart", action="store_true", help="Forget the progress of past runs"
+    )
+    parser.add_argument("--fetchers", type=int, default=4)
+    parser.add_argument("--optimizers", type=int, default=settings.max_concurrent_days)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--report-interval", type=float, default=30.0)
+    args = parser.parse_args()
+
+    date = args.date
+    if date is None and not (args.start_date or args.end_date):
+        date = (Date.today() + timedelta(days=1)).isoformat()
+    users = read_users(args.users, date, args.start_date, args.end_date)
+
+    checkpoint = BatchCheckpoint(args.checkpoint)
+    if args.restart:
+        checkpoint.clear()
+    batch = Batch(
+        users,
+        checkpoint,
+        get_calendar_processor(),
+        get_calendar_service(),
+        fetchers=args.fetchers,
+        optimizers=args.optimizers,
+        writers=args.writers,
+    )
+    stats = asyncio.run(batch.run(args.report_interval))
+    print(
+        f"{stats[DONE]} users done, {stats[FAILED]} failed, "
+        f"{stats['skipped']} skipped in {stats['seconds']:.1f}s "
+        f"({stats['users_per_minute']:.1f} users/min)"
+    )
+    if stats[FAILED]:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,12 @@
+"""
+Offline benchmarks for the Divine Calendar backend.
+
+The benchmarks run against local stand-ins for Google Calendar and the LLM
+backends (see `benchmarks.fakes`), so they need no credentials or network
+access and produce results that can be compared across commits.
+
+Run them from the `backend` directory:
+
+    python -m benchmarks.run --output benchmarks/results/head.json
+    python -m benchmarks.run --compare benchmarks/results/base.json
+"""
@@ -0,0 +1,456 @@
+"""
+Local stand-ins for Google Calendar and the LLM backends.
+
+`FakeCalendarService` mimics the subset of the `googleapiclient` Calendar v3
+service used by `calapi` (`events().list/update/insert(...).execute()`),
+including paging with `maxResults`/`nextPageToken` and change queries with
+`updatedMin`.
+
+`FakeAnthropic` mimics `anthropic.Anthropic().messages.create/stream` and
+`FakeLlama` mimics `llama_cpp.Llama.create_chat_completion`, with and without
+`stream=True`. Both answer with a
+deterministic "optimized" schedule built from the events embedded in the
+prompt, so every stage downstream of the LLM call does real work.
+
+All fakes can simulate network latency with a fixed delay per call, and the
+LLM fakes a generation speed per output character.
+"""
+
+import ast
+import copy
+import json
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+
+DEFAULT_PAGE_SIZE = 250
+STREAM_CHUNK_CHARS = 16
+
+
+def _parse_time(value: str) -> datetime:
+    if "T" not in value:
+        value += "T00:00:00+00:00"
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def make_event(
+    calendar_id: str,
+    index: int,
+    start: datetime,
+    duration: timedelta = timedelta(hours=1),
+) -> dict:
+    """
+    Builds a Google-Calendar-shaped event resource.
+
+    Args:
+        calendar_id (str): The calendar the event belongs to.
+        index (int): A number used to derive the event ID and title.
+        start (datetime): The timezone-aware start of the event.
+        duration (timedelta): The length of the event.
+
+    Returns:
+        dict: The event resource, as returned by `events().list`.
+    """
+    end = start + duration
+    return {
+        "kind": "calendar#event",
+        "etag": f'"{3000000000000000 + index}"',
+        "id": f"evt{index:06d}",
+        "status": "confirmed",
+        "htmlLink": f"https://www.google.com/calendar/event?eid=evt{index:06d}",
+        "created": "2024-10-01T12:00:00.000Z",
+        "updated": "2024-10-01T12:00:00.000Z",
+        "summary": f"Event {index}",
+        "description": f"Details for event {index}",
+        "creator": {"email": calendar_id},
+        "organizer": {"email": calendar_id, "displayName": "Benchmark"},
+        "start": {"dateTime": start.isoformat(), "timeZone": "America/Los_Angeles"},
+        "end": {"dateTime": end.isoformat(), "timeZone": "America/Los_Angeles"},
+        "iCalUID": f"evt{index:06d}@google.com",
+        "sequence": 0,
+        "reminders": {"useDefault": True},
+        "eventType": "default",
+    }
+
+
+class FakeRequest:
+    """
+    A request object whose `execute` returns a canned response.
+    """
+
+    def __init__(self, func, latency: float = 0.0):
+        self._func = func
+        self._latency = latency
+
+    def execute(self, *args, **kwargs):
+        if self._latency:
+            time.sleep(self._latency)
+        return self._func()
+
+
+class FakeEventsResource:
+    """
+    The `events()` collection of `FakeCalendarService`.
+    """
+
+    def __init__(self, service: "FakeCalendarService"):
+        self._service = service
+
+    def list(
+        self,
+        calendarId: str,
+        timeMin: Optional[str] = None,
+        timeMax: Optional[str] = None,
+        pageToken: Optional[str] = None,
+        maxResults: Optional[int] = None,
+        updatedMin: Optional[str] = None,
+        **kwargs,
+    ) -> FakeRequest:
+        def run():
+            items = self._service.events_in_range(calendarId, timeMin, timeMax)
+            if updatedMin:
+                # Timestamps are all UTC "Z" strings, so they sort as text.
+                items = [e for e in items if e.get("updated", "") >= updatedMin]
+            offset = int(pageToken or 0)
+            page_size = min(maxResults or DEFAULT_PAGE_SIZE, 2500)
+            page = items[offset : offset + page_size]
+            response = {"kind": "calendar#events", "items": copy.deepcopy(page)}
+            if offset + page_size < len(items):
+                response["nextPageToken"] = str(offset + page_size)
+            return response
+
+        self._service.calls["list"] += 1
+        return FakeRequest(run, self._service.latency)
+
+    def update(self, calendarId: str, eventId: str, body: dict, **kwargs):
+        def run():
+            event = self._service.find(calendarId, eventId)
+            if event is None:
+                raise _not_found()
+            event.update(copy.deepcopy(body))
+            event["updated"] = _now()
+            self._service.invalidate(calendarId)
+            return copy.deepcopy(event)
+
+        self._service.calls["update"] += 1
+        return FakeRequest(run, self._service.latency)
+
+    def insert(self, calendarId: str, body: dict, **kwargs):
+        def run():
+            event = copy.deepcopy(body)
+            event.setdefault("id", uuid.uuid4().hex)
+            if self._service.find(calendarId, event["id"]) is not None:
+                raise _http_error(409, b"Conflict")
+            event.setdefault("status", "confirmed")
+            event.setdefault("organizer", {"email": calendarId})
+            event["updated"] = _now()
+            self._service.add(calendarId, event)
+            return copy.deepcopy(event)
+
+        self._service.calls["insert"] += 1
+        return FakeRequest(run, self._service.latency)
+
+
+def _now() -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime())
+
+
+def _not_found():
+    return _http_error(404, b"Not Found")
+
+
+def _http_error(status: int, content: bytes):
+    from googleapiclient.errors import HttpError
+    from httplib2 import Response
+
+    return HttpError(Response({"status": status}), content)
+
+
+class FakeCalendarService:
+    """
+    An in-memory stand-in for the Google Calendar v3 service.
+
+    Lookups by ID are constant time and the parsed start and end times are
+    cached per calendar, so the fake itself adds no super-linear cost to the
+    code paths being measured.
+
+    Attributes:
+        calendars (dict[str, list[dict]]): The event resources per calendar ID.
+        latency (float): Seconds to sleep on every `execute` call.
+        calls (dict[str, int]): The number of requests made per method.
+    """
+
+    def __init__(self, calendars: Optional[dict] = None, latency: float = 0.0):
+        self.calendars = calendars or {}
+        self.latency = latency
+        self.calls = {"list": 0, "update": 0, "insert": 0}
+        self._by_id = {
+            (cid, event["id"]): event
+            for cid, events in self.calendars.items()
+            for event in events
+        }
+        self._timeline = {}
+
+    @classmethod
+    def with_events(
+        cls,
+        calendar_ids: list[str],
+        date: str,
+        events_per_calendar: int,
+        latency: float = 0.0,
+    ) -> "FakeCalendarService":
+        """
+        Builds a service with back-to-back one-hour events on a single day.
+
+        Args:
+            calendar_ids (list[str]): The calendars to populate.
+            date (str): The day to put the events on, in YYYY-MM-DD format.
+            events_per_calendar (int): The number of events per calendar.
+            latency (float): Seconds to sleep on every `execute` call.
+
+        Returns:
+            FakeCalendarService: The populated service.
+        """
+        day_start = datetime.fromisoformat(f"{date}T08:00:00-07:00")
+        step = timedelta(minutes=max(1, 14 * 60 // max(1, events_per_calendar)))
+        calendars = {}
+        index = 0
+        for cid in calendar_ids:
+            calendars[cid] = []
+            for i in range(events_per_calendar):
+                calendars[cid].append(
+                    make_event(cid, index, day_start + i * step, step)
+                )
+                index += 1
+        return cls(calendars, latency=latency)
+
+    def events(self) -> FakeEventsResource:
+        return FakeEventsResource(self)
+
+    def events_in_range(
+        self, calendar_id: str, time_min: Optional[str], time_max: Optional[str]
+    ) -> list[dict]:
+        lower = _parse_time(time_min) if time_min else None
+        upper = _parse_time(time_max) if time_max else None
+        return [
+            event
+            for start, end, event in self._sorted(calendar_id)
+            if (lower is None or end > lower) and (upper is None or start < upper)
+        ]
+
+    def _sorted(self, calendar_id: str) -> list[tuple]:
+        timeline = self._timeline.get(calendar_id)
+        if timeline is None:
+            timeline = []
+            for event in self.calendars.get(calendar_id, []):
+                start = event["start"].get("dateTime", event["start"].get("date"))
+                end = event["end"].get("dateTime", event["end"].get("date"))
+                timeline.append((_parse_time(start), _parse_time(end), event))
+            timeline.sort(key=lambda item: item[0])
+            self._timeline[calendar_id] = timeline
+        return timeline
+
+    def invalidate(self, calendar_id: str):
+        self._timeline.pop(calendar_id, None)
+
+    def add(self, calendar_id: str, event: dict):
+        self.calendars.setdefault(calendar_id, []).append(event)
+        self._by_id[(calendar_id, event["id"])] = event
+        self.invalidate(calendar_id)
+
+    def find(self, calendar_id: str, event_id: str) -> Optional[dict]:
+        return self._by_id.get((calendar_id, event_id))
+
+
+def _events_from_prompt(prompt: str) -> list[dict]:
+    """
+    Recovers the events list that `AICalendarProcessor.predict` embeds in the
+    prompt as a Python literal.
+    """
+    marker = "Here are the events in GCal API form:"
+    if marker not in prompt:
+        return []
+    line = prompt.split(marker, 1)[1].strip().splitlines()[0]
+    try:
+        events = ast.literal_eval(line)
+    except (ValueError, SyntaxError):
+        return []
+    return events if isinstance(events, list) else []
+
+
+def optimized_schedule(prompt: str) -> dict:
+    """
+    Builds a deterministic schedule by reversing the order of the time slots
+    of the events in the prompt. Durations are preserved by reassigning the
+    slots back to back from the first event's start.
+
+    Args:
+        prompt (str): The prompt sent to the LLM.
+
+    Returns:
+        dict: The schedule in the `CalendarEvents` schema.
+    """
+    events = _events_from_prompt(prompt)
+    if not events:
+        return {"events": []}
+
+    ordered = sorted(events, key=lambda event: event["start"])
+    cursor = _parse_time(ordered[0]["start"])
+    output = []
+    for event in reversed(ordered):
+        duration = _parse_time(event["end"]) - _parse_time(event["start"])
+        output.append(
+            {
+                "id": event["id"],
+                "calendar_id": event["calendar_id"],
+                "summary": event["summary"],
+                "description": event.get("description", ""),
+                "start": cursor.isoformat(),
+                "end": (cursor + duration).isoformat(),
+            }
+        )
+        cursor += duration
+    return {"events": output}
+
+
+class _FakeContent:
+    def __init__(self, text: str):
+        self.type = "text"
+        self.text = text
+
+
+class FakeMessage:
+    """
+    A stand-in for `anthropic.types.Message`.
+    """
+
+    def __init__(self, text: str):
+        self.content = [_FakeContent(text)]
+
+    def json(self) -> str:
+        return json.dumps({"content": [{"type": "text", "text": self.content[0].text}]})
+
+
+def _chunks(text: str, latency: float, seconds_per_char: float):
+    """
+    Splits `text` into stream chunks, sleeping to emulate generation.
+    """
+    if latency:
+        time.sleep(latency)
+    for i in range(0, len(text), STREAM_CHUNK_CHARS):
+        chunk = text[i : i + STREAM_CHUNK_CHARS]
+        if seconds_per_char:
+            time.sleep(seconds_per_char * len(chunk))
+        yield chunk
+
+
+class _FakeStream:
+    def __init__(self, text_stream):
+        self.text_stream = text_stream
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.text_stream.close()
+        return False
+
+
+class _FakeMessages:
+    def __init__(self, client: "FakeAnthropic"):
+        self._client = client
+
+    def create(self, model: str, max_tokens: int, messages: list, **kwargs):
+        self._client.calls += 1
+        prompt = messages[-1]["content"]
+        text = self._client.render(prompt)
+        self._client.sleep(text)
+        return FakeMessage(text)
+
+    def stream(self, model: str, max_tokens: int, messages: list, **kwargs):
+        self._client.calls += 1
+        text = self._client.render(messages[-1]["content"])
+        return _FakeStream(
+            _chunks(text, self._client.latency, self._client.seconds_per_char)
+        )
+
+
+class FakeAnthropic:
+    """
+    A stand-in for `anthropic.Anthropic`.
+
+    Attributes:
+        latency (float): Seconds to sleep before answering.
+        seconds_per_char (float): Additional seconds per output character, to
+            emulate generation speed.
+        responder (Optional[Callable[[str], str]]): Builds the response text
+            from the prompt. Defaults to `optimized_schedule`.
+        calls (int): The number of completions requested.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        seconds_per_char: float = 0.0,
+        responder: Optional[Callable[[str], str]] = None,
+    ):
+        self.latency = latency
+        self.seconds_per_char = seconds_per_char
+        self.responder = responder
+        self.calls = 0
+        self.messages = _FakeMessages(self)
+
+    def render(self, prompt: str) -> str:
+        if self.responder is not None:
+            return self.responder(prompt)
+        schedule = optimized_schedule(prompt)
+        return "Here is the optimized schedule:\n" + json.dumps(schedule)
+
+    def sleep(self, text: str):
+        delay = self.latency + self.seconds_per_char * len(text)
+        if delay:
+            time.sleep(delay)
+
+
+class FakeLlama:
+    """
+    A stand-in for `llama_cpp.Llama`.
+
+    Attributes:
+        latency (float): Seconds to sleep before answering.
+        seconds_per_char (float): Additional seconds per output character.
+        calls (int): The number of completions requested.
+    """
+
+    def __init__(self, latency: float = 0.0, seconds_per_char: float = 0.0):
+        self.latency = latency
+        self.seconds_per_char = seconds_per_char
+        self.calls = 0
+
+    def create_chat_completion(self, messages: list, stream: bool = False, **kwargs):
+        self.calls += 1
+        text = json.dumps(optimized_schedule(messages[-1]["content"]))
+        if stream:
+            return self._stream(text)
+        delay = self.latency + self.seconds_per_char * len(text)
+        if delay:
+            time.sleep(delay)
+        return {"choices": [{"message": {"role": "assistant", "content": text}}]}
+
+    def _stream(self, text: str):
+        yield {"choices": [{"delta": {"role": "assistant"}}]}
+        for chunk in _chunks(text, self.latency, self.seconds_per_char):
+            yield {"choices": [{"delta": {"content": chunk}}]}
+
+
+def lift_rate_limits():
+    """
+    Lifts the outbound rate and concurrency limits of `outbound`, which are
+    sized for the real APIs, so benchmarks against the fakes measure the
+    code rather than the quotas.
+    """
+    from outbound import ANTHROPIC, GOOGLE_CALENDAR
+
+    for service in (GOOGLE_CALENDAR, ANTHROPIC):
+        service.configure(rate=1e9, max_concurrency=1024)
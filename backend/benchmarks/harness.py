@@ -0,0 +1,232 @@
+"""
+Timing helpers and machine-readable result files for the benchmarks.
+
+Every benchmark produces a `Result` with latency percentiles and, where it
+makes sense, a throughput figure. `write_results` stores them as JSON
+together with the commit they were measured at, and `compare_results`
+prints the relative change against an earlier file.
+"""
+
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Awaitable, Callable, Optional
+
+
+@dataclass
+class Result:
+    """
+    The summary of one benchmark.
+
+    Attributes:
+        name (str): The name of the benchmark.
+        samples (int): The number of timed iterations.
+        mean_ms (float): The mean latency in milliseconds.
+        p50_ms (float): The median latency in milliseconds.
+        p95_ms (float): The 95th percentile latency in milliseconds.
+        p99_ms (float): The 99th percentile latency in milliseconds.
+        min_ms (float): The fastest iteration in milliseconds.
+        max_ms (float): The slowest iteration in milliseconds.
+        throughput (Optional[float]): Units of work per second, if measured.
+        unit (str): What `throughput` counts, e.g. "events" or "requests".
+        params (dict): The parameters the benchmark ran with.
+    """
+
+    name: str
+    samples: int
+    mean_ms: float
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    min_ms: float
+    max_ms: float
+    throughput: Optional[float] = None
+    unit: str = ""
+    params: dict = field(default_factory=dict)
+
+
+def percentile(values: list[float], q: float) -> float:
+    """
+    Returns the `q`-th percentile of `values` using linear interpolation.
+    """
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    rank = (len(ordered) - 1) * q / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize(
+    name: str,
+    seconds: list[float],
+    work_per_sample: int = 0,
+    unit: str = "",
+    wall_seconds: Optional[float] = None,
+    params: Optional[dict] = None,
+) -> Result:
+    """
+    Builds a `Result` from per-iteration timings.
+
+    Args:
+        name (str): The name of the benchmark.
+        seconds (list[float]): The duration of each iteration in seconds.
+        work_per_sample (int): Units of work done per iteration, used to
+            compute throughput.
+        unit (str): What the units of work are.
+        wall_seconds (Optional[float]): The total wall time, for concurrent
+            benchmarks where iterations overlap. Defaults to the sum of
+            `seconds`.
+        params (Optional[dict]): The parameters the benchmark ran with.
+
+    Returns:
+        Result: The summary.
+    """
+    ms = [s * 1000 for s in seconds]
+    total = wall_seconds if wall_seconds is not None else sum(seconds)
+    throughput = None
+    if work_per_sample and total > 0:
+        throughput = work_per_sample * len(seconds) / total
+    return Result(
+        name=name,
+        samples=len(ms),
+        mean_ms=statistics.fmean(ms),
+        p50_ms=percentile(ms, 50),
+        p95_ms=percentile(ms, 95),
+        p99_ms=percentile(ms, 99),
+        min_ms=min(ms),
+        max_ms=max(ms),
+        throughput=throughput,
+        unit=unit,
+        params=params or {},
+    )
+
+
+def measure(func: Callable[[], object], repeat: int, warmup: int = 1) -> list[float]:
+    """
+    Times `repeat` calls of `func` after `warmup` untimed calls.
+
+    Returns:
+        list[float]: The duration of each timed call in seconds.
+    """
+    for _ in range(warmup):
+        func()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+async def measure_concurrent(
+    func: Callable[[], Awaitable[object]], requests: int, concurrency: int
+) -> tuple[list[float], float]:
+    """
+    Runs `requests` calls of `func` with at most `concurrency` in flight.
+
+    Returns:
+        tuple[list[float], float]: The latency of each call and the total
+            wall time, both in seconds.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    timings = []
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            await func()
+            timings.append(time.perf_counter() - start)
+
+    wall_start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    return timings, time.perf_counter() - wall_start
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL
+            )
+            .decode()
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(
+    results: list[Result], path: str, extra: Optional[dict] = None
+) -> dict:
+    """
+    Writes `results` to `path` as JSON, together with environment metadata.
+
+    Args:
+        results (list[Result]): The benchmark results.
+        path (str): The file to write.
+        extra (Optional[dict]): Additional top-level entries for the document.
+
+    Returns:
+        dict: The document that was written.
+    """
+    document = {
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "results": {result.name: asdict(result) for result in results},
+    }
+    document.update(extra or {})
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(document, f, indent=2)
+    return document
+
+
+def compare_results(current: dict, baseline_path: str) -> None:
+    """
+    Prints the change in p50/p95 latency and throughput of `current` against
+    the results stored at `baseline_path`.
+    """
+    with open(baseline_path, "r") as f:
+        baseline = json.load(f)
+
+    print(f"Comparing against {baseline.get('commit')} ({baseline_path})")
+    for name, result in current["results"].items():
+        before = baseline["results"].get(name)
+        if before is None:
+            print(f"  {name}: new")
+            continue
+        changes = []
+        for key in ("p50_ms", "p95_ms", "throughput"):
+            if before.get(key) and result.get(key) is not None:
+                delta = (result[key] - before[key]) / before[key] * 100
+                changes.append(
+                    f"{key} {before[key]:.2f} -> {result[key]:.2f} ({delta:+.1f}%)"
+                )
+        print(f"  {name}: " + ", ".join(changes))
+
+
+def print_results(results: list[Result]) -> None:
+    """
+    Prints a one-line summary per result.
+    """
+    for result in results:
+        line = (
+            f"{result.name:<40} n={result.samples:<5} "
+            f"p50={result.p50_ms:9.3f}ms p95={result.p95_ms:9.3f}ms "
+            f"p99={result.p99_ms:9.3f}ms"
+        )
+        if result.throughput is not None:
+            line += f" {result.throughput:12.1f} {result.unit}/s"
+        print(line)
@@ -0,0 +1,439 @@
+"""
+Runs the offline benchmark suites and writes the results as JSON.
+
+Suites:
+
+* `extract`: `calapi.extract_calendar_events` throughput.
+* `prompt`: prompt construction in `AICalendarProcessor._build_prompt`, with
+  the questionnaire and with the parsed energy profile.
+* `rag`: `RAGAgent` index build, startup, index load and query latency.
+* `endpoints`: `/process_calendar_events` and `/query_chat_bot` latency under
+  concurrent load.
+* `embed`: index and query embedding speed of the HuggingFace and ONNX
+  embedding backends, and how closely the ONNX backend's retrieval agrees
+  with the HuggingFace one. It downloads both models, so it only runs when
+  asked for.
+
+Usage (from the `backend` directory):
+
+    python -m benchmarks.run [--suite extract --suite prompt ...]
+        [--output PATH] [--compare PATH]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.fakes import (
+    FakeAnthropic,
+    FakeCalendarService,
+    FakeLlama,
+    lift_rate_limits,
+)
+from benchmarks.harness import (
+    Result,
+    compare_results,
+    measure,
+    measure_concurrent,
+    print_results,
+    summarize,
+    write_results,
+)
+
+DATE = "2024-10-14"
+QUESTIONNAIRE = (
+    "I am a morning person and do my best focused work before lunch. "
+    "My energy dips after 2pm and I prefer meetings in the late afternoon."
+)
+DEFAULT_SUITES = ["extract", "prompt", "rag", "endpoints"]
+SUITES = DEFAULT_SUITES + ["embed"]
+
+
+def calendar_ids(count: int) -> list[str]:
+    return [f"calendar{i}@group.calendar.google.com" for i in range(count)]
+
+
+def make_processor(latency: float = 0.0):
+    """
+    Builds an `AICalendarProcessor` backed by the fake LLM backends.
+    """
+    from ai_calendar_processor import AICalendarProcessor
+
+    return AICalendarProcessor(
+        client=FakeAnthropic(latency=latency), model=FakeLlama(latency=latency)
+    )
+
+
+def bench_extract(args) -> list[Result]:
+    from calapi import extract_calendar_events
+
+    results = []
+    for events_per_calendar in (10, 100, 1000):
+        ids = calendar_ids(args.calendars)
+        service = FakeCalendarService.with_events(ids, DATE, events_per_calendar)
+
+        def extract():
+            return extract_calendar_events(
+                service, calendar_ids=ids, start_date=DATE, end_date=DATE
+            )
+
+        extracted = len(extract())
+        timings = measure(extract, repeat=args.repeat)
+        results.append(
+            summarize(
+                f"extract_calendar_events[{events_per_calendar}x{args.calendars}]",
+                timings,
+                work_per_sample=extracted,
+                unit="events",
+                params={
+                    "calendars": args.calendars,
+                    "events_per_calendar": events_per_calendar,
+                    "events_returned": extracted,
+                },
+            )
+        )
+    return results
+
+
+def bench_prompt(args) -> list[Result]:
+    from calapi import extract_calendar_events
+    from energy_profile import parse_questionnaire
+
+    processor = make_processor()
+    profile = parse_questionnaire(QUESTIONNAIRE)
+    results = []
+    for events_per_calendar in (10, 100):
+        ids = calendar_ids(args.calendars)
+        service = FakeCalendarService.with_events(ids, DATE, events_per_calendar)
+        events = extract_calendar_events(
+            service, calendar_ids=ids, start_date=DATE, end_date=DATE
+        )
+
+        # The questionnaire as sent before, and the parsed profile sent now.
+        for name, kwargs in (
+            ("questionnaire", {"questionnaire": QUESTIONNAIRE}),
+            ("profile", {"profile": profile}),
+        ):
+
+            def build():
+                return processor._build_prompt(events, **kwargs)
+
+            timings = measure(build, repeat=args.repeat)
+            results.append(
+                summarize(
+                    f"create_prompt[{len(events)}].{name}",
+                    timings,
+                    work_per_sample=1,
+                    unit="prompts",
+                    params={"events": len(events), "prompt_chars": len(build())},
+                )
+            )
+    return results
+
+
+def _passages(count: int, words: int, seed: int = 0) -> list[str]:
+    rng = random.Random(seed)
+    vocabulary = (
+        "duty virtue time attention justice mind practice law work rest habit "
+        "truth compassion order reason morning evening meeting focus energy "
+        "calm anger patience court contract silence prayer goal deadline "
+        "friend family sleep walk study desire fear courage"
+    ).split()
+    return [
+        " ".join(rng.choice(vocabulary) for _ in range(rng.randint(words // 4, words)))
+        for _ in range(count)
+    ]
+
+
+def bench_embed(args) -> list[Result]:
+    import numpy as np
+
+    from ai_enlightened_chatbot import load_embed_model
+
+    passages = _passages(args.embed_texts, 200)
+    queries = _passages(args.repeat, 12, seed=1)
+    results, embeddings = [], {}
+    for backend in ("huggingface", "onnx"):
+        model = load_embed_model(backend)
+        if backend == "onnx" and type(model).__name__ != "OnnxEmbedding":
+            print("The ONNX embedding backend is not available, skipping it")
+            break
+
+        start = time.perf_counter()
+        texts = np.array(model.get_text_embedding_batch(passages))
+        results.append(
+            summarize(
+                f"embed.{backend}.index",
+                [time.perf_counter() - start],
+                work_per_sample=len(passages),
+                unit="texts",
+                params={"texts": len(passages)},
+            )
+        )
+
+        vectors, timings = [], []
+        for query in queries:
+            start = time.perf_counter()
+            vectors.append(model.get_query_embedding(query))
+            timings.append(time.perf_counter() - start)
+        results.append(
+            summarize(
+                f"embed.{backend}.query", timings, work_per_sample=1, unit="queries"
+            )
+        )
+        embeddings[backend] = texts, np.array(vectors)
+
+    if len(embeddings) == 2:
+        k = args.embed_top_k
+        (hf_texts, hf_queries), (onnx_texts, onnx_queries) = (
+            embeddings["huggingface"],
+            embeddings["onnx"],
+        )
+        hf_top = np.argsort(-hf_queries @ hf_texts.T, axis=1)[:, :k]
+        onnx_top = np.argsort(-onnx_queries @ onnx_texts.T, axis=1)[:, :k]
+        recall = float(
+            np.mean([len(set(a) & set(b)) / k for a, b in zip(hf_top, onnx_top)])
+        )
+        cosine = float(np.mean(np.sum(hf_texts * onnx_texts, axis=1)))
+        within = recall >= args.embed_tolerance
+        results[-1].params.update(
+            {
+                f"recall_at_{k}": round(recall, 4),
+                "mean_cosine": round(cosine, 4),
+                "tolerance": args.embed_tolerance,
+                "within_tolerance": within,
+            }
+        )
+        print(
+            f"ONNX top-{k} agreement with HuggingFace: {recall:.3f}, "
+            f"mean cosine {cosine:.4f} "
+            f"({'within' if within else 'BELOW'} tolerance {args.embed_tolerance})"
+        )
+    return results
+
+
+def _write_corpus(directory: str, agent_types: list[str], files: int, seed: int = 0):
+    rng = random.Random(seed)
+    words = (
+        "duty virtue time attention justice mind practice law work rest habit "
+        "truth compassion order reason"
+    ).split()
+    for agent in agent_types:
+        os.makedirs(os.path.join(directory, agent), exist_ok=True)
+        for i in range(files):
+            paragraphs = [
+                " ".join(rng.choice(words) for _ in range(120)) for _ in range(20)
+            ]
+            with open(os.path.join(directory, agent, f"text{i}.txt"), "w") as f:
+                f.write("\n\n".join(paragraphs))
+
+
+def bench_rag(args) -> list[Result]:
+    from llama_index.core import MockEmbedding
+    from llama_index.core.llms import MockLLM
+
+    from ai_enlightened_chatbot import RAGAgent
+
+    agent_types = ["monk", "lawyer", "philosopher", "productivity"]
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        corpus = os.path.join(tmp, "corpus")
+        storage = os.path.join(tmp, "storage")
+        _write_corpus(corpus, agent_types, files=args.rag_files)
+
+        def build_agent():
+            return RAGAgent(
+                directory=corpus,
+                agent_types=agent_types,
+                storage_dir=storage,
+                llm=MockLLM(max_tokens=64),
+                embed_model=MockEmbedding(embed_dim=384),
+            )
+
+        def load_agent():
+            agent = build_agent()
+            for agent_type in agent_types:
+                agent.get_index(agent_type)
+            return agent
+
+        start = time.perf_counter()
+        load_agent()
+        results.append(
+            summarize(
+                "rag.index_build",
+                [time.perf_counter() - start],
+                params={"agents": len(agent_types), "files": args.rag_files},
+            )
+        )
+
+        # Indices are loaded on first use, so this is what startup costs.
+        results.append(
+            summarize(
+                "rag.startup",
+                measure(build_agent, repeat=max(1, args.repeat // 10)),
+                params={"agents": len(agent_types), "files": args.rag_files},
+            )
+        )
+
+        loads = []
+        agent = None
+        for _ in range(max(1, args.repeat // 10)):
+            start = time.perf_counter()
+            agent = load_agent()
+            loads.append(time.perf_counter() - start)
+        results.append(
+            summarize(
+                "rag.index_load",
+                loads,
+                params={"agents": len(agent_types), "files": args.rag_files},
+            )
+        )
+
+        timings = measure(
+            lambda: agent.query("How should I spend my morning?", "monk"),
+            repeat=args.repeat,
+        )
+        results.append(
+            summarize("rag.query", timings, work_per_sample=1, unit="queries")
+        )
+    return results
+
+
+class _FakeChatBot:
+    """
+    A `RAGAgent` stand-in for the endpoint benchmark, so that it measures the
+    request path rather than retrieval.
+    """
+
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def query(self, query: str, agent_type: str) -> dict:
+        time.sleep(self.latency)
+        return {"response": f"Answered {len(query)} characters", "references": []}
+
+
+def bench_endpoints(args) -> list[Result]:
+    import httpx
+
+    import divine
+    from energy_profile import ProfileStore
+    from event_store import EventStore
+
+    # Importing divine configures the outbound limits from its settings.
+    lift_rate_limits()
+    # Start from an empty event store rather than one left by an earlier run.
+    store_dir = tempfile.TemporaryDirectory()
+    divine.event_store = EventStore(os.path.join(store_dir.name, "events.sqlite3"))
+    divine.profile_store = ProfileStore(
+        os.path.join(store_dir.name, "profiles.sqlite3")
+    )
+    ids = calendar_ids(args.calendars)
+    service = FakeCalendarService.with_events(
+        ids + ["bharadwaj76509@gmail.com"], DATE, 10, latency=args.google_latency
+    )
+    processor = make_processor(latency=args.llm_latency)
+    chat_bot = _FakeChatBot(latency=args.llm_latency)
+
+    divine.app.dependency_overrides[divine.get_calendar_service] = lambda: service
+    divine.app.dependency_overrides[divine.get_calendar_processor] = lambda: processor
+    divine.app.dependency_overrides[divine.get_chat_bot] = lambda: chat_bot
+
+    payloads = {
+        "/process_calendar_events": {
+            "calendar_ids": ids,
+            "date": DATE,
+            "questionnaire": QUESTIONNAIRE,
+        },
+        "/query_chat_bot": {
+            "query": "How does my day look?",
+            "agent": "productivity",
+            "calendar_ids": ids,
+            "date": DATE,
+        },
+    }
+
+    async def run(path: str, payload: dict):
+        transport = httpx.ASGITransport(app=divine.app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://bench", timeout=None
+        ) as client:
+
+            async def call():
+                response = await client.post(path, json=payload)
+                response.raise_for_status()
+
+            await call()
+            return await measure_concurrent(call, args.requests, args.concurrency)
+
+    results = []
+    try:
+        for path, payload in payloads.items():
+            timings, wall = asyncio.run(run(path, payload))
+            results.append(
+                summarize(
+                    f"endpoint{path}[c={args.concurrency}]",
+                    timings,
+                    work_per_sample=1,
+                    unit="requests",
+                    wall_seconds=wall,
+                    params={
+                        "requests": args.requests,
+                        "concurrency": args.concurrency,
+                        "google_latency": args.google_latency,
+                        "llm_latency": args.llm_latency,
+                    },
+                )
+            )
+    finally:
+        divine.app.dependency_overrides.clear()
+        store_dir.cleanup()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--suite", action="append", choices=SUITES)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--calendars", type=int, default=3)
+    parser.add_argument("--rag-files", type=int, default=5)
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--google-latency", type=float, default=0.02)
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    parser.add_argument("--embed-texts", type=int, default=512)
+    parser.add_argument("--embed-top-k", type=int, default=10)
+    parser.add_argument(
+        "--embed-tolerance",
+        type=float,
+        default=0.9,
+        help="The lowest acceptable top-k agreement of the ONNX embeddings",
+    )
+    parser.add_argument("--output", default="benchmarks/results/latest.json")
+    parser.add_argument("--compare", help="A previous results file to diff against")
+    args = parser.parse_args()
+    lift_rate_limits()
+
+    suites = {
+        "extract": bench_extract,
+        "prompt": bench_prompt,
+        "rag": bench_rag,
+        "endpoints": bench_endpoints,
+        "embed": bench_embed,
+    }
+    results = []
+    for name in args.suite or DEFAULT_SUITES:
+        results.extend(suites[name](args))
+
+    print_results(results)
+    document = write_results(results, args.output)
+    print(f"Results written to {args.output}")
+    if args.compare:
+        compare_results(document, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""
+Profiles how time and memory scale with the number of events.
+
+For each size, a synthetic week of events (see `benchmarks.synthetic`) is
+pushed through the three stages of an optimize request:
+
+* `extract`: `calapi.extract_calendar_events` over the whole window.
+* `predict`: `AICalendarProcessor.predict` with a stub backend that answers
+  instantly, so only prompt construction and response parsing are timed.
+* `write_back`: `calapi.update_or_create_event` for every returned event.
+
+Each stage is timed without tracing, then run again under `tracemalloc` to
+record its peak allocation. A least-squares fit of log(time) against
+log(events) gives the scaling exponent of each stage: about 1 for a linear
+stage, about 2 for a quadratic one.
+
+Usage (from the `backend` directory):
+
+    python -m benchmarks.scaling [--sizes 100 200 400 800] [--calendars 24]
+        [--output PATH]
+"""
+
+import argparse
+import contextlib
+import json
+import math
+import os
+import time
+import tracemalloc
+
+from benchmarks.fakes import FakeAnthropic, FakeLlama, lift_rate_limits
+from benchmarks.harness import Result, summarize, write_results
+from benchmarks.synthetic import end_date, generate_service
+
+START_DATE = "2024-10-14"
+QUESTIONNAIRE = "I focus best in the morning and slow down after lunch."
+FIELDS = ("id", "calendar_id", "summary", "description", "start", "end")
+
+
+def fit_exponent(sizes: list[int], seconds: list[float]) -> float:
+    """
+    Returns the slope of the least-squares fit of log(seconds) on log(sizes).
+    """
+    points = [(math.log(n), math.log(t)) for n, t in zip(sizes, seconds) if t > 0]
+    if len(points) < 2:
+        return float("nan")
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    numerator = sum((x - mean_x) * (y - mean_y) for x, y in points)
+    denominator = sum((x - mean_x) ** 2 for x, _ in points)
+    return numerator / denominator if denominator else float("nan")
+
+
+def _peak_bytes(func) -> int:
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def _best_of(func, repeat: int) -> list[float]:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def profile_size(size: int, args) -> dict:
+    """
+    Times and measures the peak memory of each stage for `size` events.
+
+    Returns:
+        dict: Per-stage `timings` (seconds) and `peak_bytes`, and the number
+            of events generated and extracted.
+    """
+    from ai_calendar_processor import AICalendarProcessor
+    from calapi import extract_calendar_events, update_or_create_event
+
+    service, calendar_ids = generate_service(
+        size, calendars=args.calendars, days=args.days, start_date=START_DATE
+    )
+    last_day = end_date(START_DATE, args.days)
+
+    def extract():
+        return extract_calendar_events(
+            service,
+            calendar_ids=calendar_ids,
+            start_date=START_DATE,
+            end_date=last_day,
+        )
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        events = extract()
+
+        # The stub answers with the input schedule, so the cost measured is
+        # the processor's own prompt building and response parsing.
+        response = json.dumps(
+            {"events": [{key: event[key] for key in FIELDS} for event in events]}
+        )
+        processor = AICalendarProcessor(
+            client=FakeAnthropic(responder=lambda prompt: response), model=FakeLlama()
+        )
+
+        def predict():
+            return processor.predict(events, questionnaire=QUESTIONNAIRE)
+
+        output = predict()
+
+        def write_back():
+            for event in output:
+                update_or_create_event(service, event_data=event)
+
+        stages = {"extract": extract, "predict": predict, "write_back": write_back}
+        timings = {name: _best_of(func, args.repeat) for name, func in stages.items()}
+        peaks = {name: _peak_bytes(func) for name, func in stages.items()}
+
+    return {
+        "events": len(events),
+        "generated": size,
+        "timings": timings,
+        "peak_bytes": peaks,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[100, 200, 400, 800, 1600, 3200]
+    )
+    parser.add_argument("--calendars", type=int, default=24)
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", default="benchmarks/results/scaling.json")
+    args = parser.parse_args()
+    lift_rate_limits()
+
+    rows = [profile_size(size, args) for size in args.sizes]
+
+    results: list[Result] = []
+    exponents = {}
+    print(f"{'events':>8} {'stage':<12} {'best ms':>10} {'peak KiB':>10}")
+    for stage in ("extract", "predict", "write_back"):
+        best = []
+        for row in rows:
+            timings = row["timings"][stage]
+            best.append(min(timings))
+            results.append(
+                summarize(
+                    f"scaling.{stage}[{row['events']}]",
+                    timings,
+                    work_per_sample=row["events"],
+                    unit="events",
+                    params={
+                        "events": row["events"],
+                        "calendars": args.calendars,
+                        "days": args.days,
+                        "peak_bytes": row["peak_bytes"][stage],
+                    },
+                )
+            )
+            print(
+                f"{row['events']:>8} {stage:<12} {min(timings) * 1000:>10.2f} "
+                f"{row['peak_bytes'][stage] / 1024:>10.1f}"
+            )
+        exponents[stage] = {
+            "time": fit_exponent([row["events"] for row in rows], best),
+            "memory": fit_exponent(
+                [row["events"] for row in rows],
+                [row["peak_bytes"][stage] for row in rows],
+            ),
+        }
+
+    print("\nScaling exponents (1 = linear, 2 = quadratic):")
+    for stage, exponent in exponents.items():
+        print(
+            f"  {stage:<12} time n^{exponent['time']:.2f}  "
+            f"memory n^{exponent['memory']:.2f}"
+        )
+
+    write_results(results, args.output, extra={"scaling_exponents": exponents})
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
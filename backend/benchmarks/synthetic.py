@@ -0,0 +1,219 @@
+"""
+Synthetic Google-Calendar-shaped event sets for scale testing.
+
+`generate_calendars` builds a week (or any number of days) of events spread
+over many calendars, with the shapes that show up in real accounts: a busy
+primary calendar and a long tail of quieter ones, meetings with large
+attendee lists and conference data, standups that are instances of a
+recurring series, all-day events and the odd cancellation. The output can
+be passed straight to `FakeCalendarService`.
+
+Generation is deterministic for a given seed.
+"""
+
+import random
+from datetime import datetime, timedelta
+
+from benchmarks.fakes import FakeCalendarService
+
+DURATIONS_MINUTES = [15, 30, 30, 30, 45, 60, 60, 60, 90, 120]
+KINDS = {
+    "meeting": [
+        "Sync with {team}",
+        "{team} planning",
+        "Design review",
+        "Customer call",
+    ],
+    "one_on_one": ["1:1 with {person}"],
+    "standup": ["{team} standup"],
+    "focus": ["Focus time", "Deep work: {project}", "Write {project} doc"],
+    "personal": ["Lunch", "Gym", "Dentist", "Pick up kids"],
+    "review": ["Code review", "Review {project} PRs"],
+}
+KIND_WEIGHTS = {
+    "meeting": 30,
+    "one_on_one": 15,
+    "standup": 15,
+    "focus": 20,
+    "personal": 10,
+    "review": 10,
+}
+TEAMS = ["Platform", "Growth", "Infra", "Mobile", "Data", "Design"]
+PEOPLE = ["Alex", "Sam", "Jordan", "Taylor", "Riley", "Casey", "Morgan", "Jamie"]
+PROJECTS = ["Q4 roadmap", "billing", "onboarding", "search", "calendar sync"]
+
+
+def _calendar_weights(calendars: int) -> list[float]:
+    # Zipf-like: the primary calendar is much busier than the rest.
+    return [1.0 / (rank + 1) for rank in range(calendars)]
+
+
+def _title(rng: random.Random, kind: str) -> str:
+    template = rng.choice(KINDS[kind])
+    return template.format(
+        team=rng.choice(TEAMS), person=rng.choice(PEOPLE), project=rng.choice(PROJECTS)
+    )
+
+
+def _attendees(rng: random.Random, kind: str, organizer: str) -> list[dict]:
+    if kind in ("focus", "personal"):
+        return []
+    count = 2 if kind == "one_on_one" else rng.randint(3, 30)
+    attendees = [{"email": organizer, "organizer": True, "responseStatus": "accepted"}]
+    for i in range(count - 1):
+        attendees.append(
+            {
+                "email": f"{rng.choice(PEOPLE).lower()}{i}@example.com",
+                "responseStatus": rng.choice(
+                    ["accepted", "accepted", "tentative", "needsAction", "declined"]
+                ),
+            }
+        )
+    return attendees
+
+
+def _conference(rng: random.Random, event_id: str) -> dict:
+    code = "".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(10))
+    return {
+        "entryPoints": [
+            {
+                "entryPointType": "video",
+                "uri": f"https://meet.google.com/{code}",
+                "label": f"meet.google.com/{code}",
+            },
+            {
+                "entryPointType": "phone",
+                "uri": "tel:+1-555-0100",
+                "label": "+1 555-0100",
+                "pin": str(rng.randint(100000000, 999999999)),
+            },
+        ],
+        "conferenceSolution": {
+            "key": {"type": "hangoutsMeet"},
+            "name": "Google Meet",
+            "iconUri": "https://fonts.gstatic.com/s/i/productlogos/meet_2020q4/v6/web-512dp/logo_meet_2020q4_color_2x_web_512dp.png",
+        },
+        "conferenceId": code,
+    }
+
+
+def generate_calendars(
+    events: int,
+    calendars: int = 12,
+    days: int = 7,
+    start_date: str = "2024-10-14",
+    utc_offset: str = "-07:00",
+    seed: int = 0,
+) -> dict[str, list[dict]]:
+    """
+    Generates Google-Calendar-shaped event resources.
+
+    Args:
+        events (int): The total number of events to generate.
+        calendars (int): The number of calendars to spread them over.
+        days (int): The number of consecutive days to spread them over.
+        start_date (str): The first day, in YYYY-MM-DD format.
+        utc_offset (str): The UTC offset used in event times.
+        seed (int): The random seed.
+
+    Returns:
+        dict[str, list[dict]]: The event resources per calendar ID.
+    """
+    rng = random.Random(seed)
+    calendar_ids = ["primary@example.com"] + [
+        f"calendar{i}@group.calendar.google.com" for i in range(1, calendars)
+    ]
+    weights = _calendar_weights(calendars)
+    kinds = list(KIND_WEIGHTS)
+    kind_weights = [KIND_WEIGHTS[kind] for kind in kinds]
+    first_day = datetime.fromisoformat(f"{start_date}T00:00:00{utc_offset}")
+
+    output = {cid: [] for cid in calendar_ids}
+    for index in range(events):
+        cid = rng.choices(calendar_ids, weights)[0]
+        kind = rng.choices(kinds, kind_weights)[0]
+        day = first_day + timedelta(days=rng.randrange(days))
+        event_id = f"{index:08x}{rng.getrandbits(32):08x}"
+        description = " ".join(
+            rng.choice(PROJECTS + TEAMS) for _ in range(int(rng.lognormvariate(2.5, 1)))
+        )
+
+        event = {
+            "kind": "calendar#event",
+            "etag": f'"{rng.getrandbits(52)}"',
+            "id": event_id,
+            "status": "cancelled" if rng.random() < 0.02 else "confirmed",
+            "htmlLink": f"https://www.google.com/calendar/event?eid={event_id}",
+            "created": "2024-09-01T12:00:00.000Z",
+            "updated": "2024-10-01T12:00:00.000Z",
+            "summary": _title(rng, kind),
+            "description": description,
+            "creator": {"email": cid, "self": True},
+            "organizer": {"email": cid, "displayName": cid.split("@")[0], "self": True},
+            "iCalUID": f"{event_id}@google.com",
+            "sequence": rng.randint(0, 3),
+            "reminders": {"useDefault": rng.random() < 0.8},
+            "eventType": "default",
+        }
+
+        if rng.random() < 0.03:
+            event["start"] = {"date": day.date().isoformat()}
+            event["end"] = {"date": (day + timedelta(days=1)).date().isoformat()}
+            event["transparency"] = "transparent"
+        else:
+            if kind == "standup":
+                start = day + timedelta(hours=9, minutes=30)
+                duration = timedelta(minutes=15)
+            else:
+                start = day + timedelta(minutes=15 * rng.randint(7 * 4, 19 * 4))
+                duration = timedelta(minutes=rng.choice(DURATIONS_MINUTES))
+            event["start"] = {
+                "dateTime": start.isoformat(),
+                "timeZone": "America/Los_Angeles",
+            }
+            event["end"] = {
+                "dateTime": (start + duration).isoformat(),
+                "timeZone": "America/Los_Angeles",
+            }
+
+        attendees = _attendees(rng, kind, cid)
+        if attendees:
+            event["attendees"] = attendees
+            if rng.random() < 0.6:
+                event["hangoutLink"] = "https://meet.google.com/abc-defg-hij"
+                event["conferenceData"] = _conference(rng, event_id)
+        if kind == "standup":
+            event["recurringEventId"] = f"standup{cid.split('@')[0]}"
+            event["originalStartTime"] = event["start"]
+
+        output[cid].append(event)
+
+    return output
+
+
+def generate_service(
+    events: int,
+    calendars: int = 12,
+    days: int = 7,
+    start_date: str = "2024-10-14",
+    latency: float = 0.0,
+    seed: int = 0,
+) -> tuple[FakeCalendarService, list[str]]:
+    """
+    Builds a `FakeCalendarService` populated by `generate_calendars`.
+
+    Returns:
+        tuple[FakeCalendarService, list[str]]: The service and its calendar IDs.
+    """
+    data = generate_calendars(
+        events, calendars=calendars, days=days, start_date=start_date, seed=seed
+    )
+    return FakeCalendarService(data, latency=latency), list(data)
+
+
+def end_date(start_date: str, days: int) -> str:
+    """
+    Returns the last day of a `days`-long window starting at `start_date`.
+    """
+    first = datetime.fromisoformat(start_date)
+    return (first + timedelta(days=days - 1)).date().isoformat()
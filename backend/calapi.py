@@ -2,19 +2,42 @@ import datetime
 import json
 import os
 import base64
+import hashlib
+import threading
+import time
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
+from google_auth_httplib2 import AuthorizedHttp
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
-from datetime import datetime
-
+from googleapiclient.http import build_http
+from datetime import datetime, timedelta, timezone
+from outbound import GOOGLE_CALENDAR
+from event_table import SECONDS_PER_DAY, EventList, parse_time, table_of
+from recurrence import expand, is_series_item, master_id
 
 DEFAULT_CALENDAR_ID = "54d33b5da85ac849627cf6d0bf1a7d09e5eb9afe42d6be24b3c5e9ade279cc35@group.calendar.google.com"
 SCOPES = [
     "https://www.googleapis.com/auth/calendar",
     "https://www.googleapis.com/auth/calendar.events",
 ]
+# Listings ask only for what extract_event reads, in pages as large as the
+# API allows.
+EVENT_FIELDS = (
+    "nextPageToken,"
+    "items(id,status,summary,description,start,end,organizer/displayName)"
+)
+# Series listings also need what recurrence.expand reads.
+SERIES_FIELDS = (
+    "nextPageToken,"
+    "items(id,status,summary,description,start,end,organizer/displayName,"
+    "recurrence,recurringEventId,originalStartTime)"
+)
+MAX_PAGE_SIZE = 2500
+# Deltas are requested from a bit before the last sync started, in case the
+# server's clock is ahead of ours.
+SYNC_CLOCK_MARGIN = 60
 
 
 def encode_calendar_id(calendarId):
@@ -24,7 +47,39 @@ def encode_calendar_id(calendarId):
     return cid
 
 
+_service = None
+_service_lock = threading.Lock()
+
+
+class SharedHttp:
+    # An authorized HTTP transport that can be shared between threads. httplib2
+    # connections are not thread-safe, so each thread gets its own, and keeps
+    # it open across calls. Responses come gzipped: httplib2 accepts gzip and
+    # the client adds the "(gzip)" user agent Google requires for it.
+    def __init__(self, credentials):
+        self.credentials = credentials
+        self._local = threading.local()
+
+    def request(self, *args, **kwargs):
+        http = getattr(self._local, "http", None)
+        if http is None:
+            http = AuthorizedHttp(self.credentials, http=build_http())
+            self._local.http = http
+        return http.request(*args, **kwargs)
+
+
 def authenticate_google_calendar():
+    # The service is built once and shared: building it parses the discovery
+    # document, and its transport keeps connections open between requests.
+    global _service
+    with _service_lock:
+        if _service is None:
+            http = SharedHttp(load_credentials())
+            _service = build("calendar", "v3", http=http, cache_discovery=False)
+        return _service
+
+
+def load_credentials():
     creds = None
     flow = None
     if os.path.exists("token.json"):
@@ -40,8 +95,45 @@ def authenticate_google_calendar():
     with open("token.json", "w") as token:
         token.write(creds.to_json())
 
-    creds = Credentials.from_authorized_user_file("token.json", SCOPES)
-    return build("calendar", "v3", credentials=creds)
+    # AuthorizedHttp refreshes the access token when it expires.
+    return Credentials.from_authorized_user_file("token.json", SCOPES)
+
+
+def list_events(service, cid, time_min, time_max, **kwargs) -> list:
+    params = dict(singleEvents=True, orderBy="startTime", fields=EVENT_FIELDS)
+    params.update(kwargs)
+    events = []
+    page_token = None
+    while True:
+        events_result = GOOGLE_CALENDAR.call(
+            service.events()
+            .list(
+                calendarId=cid,
+                timeMin=time_min,
+                timeMax=time_max,
+                maxResults=MAX_PAGE_SIZE,
+                pageToken=page_token,
+                **params,
+            )
+            .execute
+        )
+        events.extend(events_result.get("items", []))
+        page_token = events_result.get("nextPageToken")
+        if not page_token:
+            return events
+
+
+def extract_event(event, cid) -> dict:
+    return {
+        "id": event["id"],
+        "calendar_id": cid,
+        "calendar_name": event["organizer"].get("displayName", "Unknown"),
+        "summary": event["summary"],
+        "description": event.get("description", ""),
+        "start": event["start"].get("dateTime", event["start"].get("date")),
+        "end": event["end"].get("dateTime", event["end"].get("date")),
+        "status": event["status"],
+    }
 
 
 def extract_calendar_events(
@@ -60,45 +152,195 @@ def extract_calendar_events(
 
         for cid in calendar_ids:
             print(f"time_min: {time_min}, time_max: {time_max}")
-            events_result = (
-                service.events()
-                .list(
-                    calendarId=cid,
-                    timeMin=time_min,
-                    timeMax=time_max,
-                    singleEvents=True,
-                    orderBy="startTime",
-                )
-                .execute()
-            )
-
-            events = events_result.get("items", [])
+            events = list_events(service, cid, time_min, time_max)
 
-            extracted_events = []
-            for event in events:
-
-                extracted_event = {
-                    "id": event["id"],
-                    "calendar_id": cid,
-                    "calendar_name": event["organizer"].get("displayName", "Unknown"),
-                    "summary": event["summary"],
-                    "description": event.get("description", ""),
-                    "start": event["start"].get("dateTime", event["start"].get("date")),
-                    "end": event["end"].get("dateTime", event["end"].get("date")),
-                    "status": event["status"],
-                }
-
-                extracted_events.append(extracted_event)
+            extracted_events = [extract_event(event, cid) for event in events]
 
             all_events.extend(extracted_events)
 
-        return all_events
+        # Parses the times once; the scheduling code reads them from the table.
+        return EventList(all_events)
 
     except HttpError as error:
         print(f"An error occurred: {error}")
         return []
 
 
+def list_series(service, cid, time_min, time_max, **kwargs) -> list:
+    # Recurring events once each, with their exceptions, cancelled ones
+    # included (see the recurrence module).
+    return list_events(
+        service,
+        cid,
+        time_min,
+        time_max,
+        singleEvents=False,
+        orderBy=None,
+        showDeleted=True,
+        fields=SERIES_FIELDS,
+        **kwargs,
+    )
+
+
+def expand_series(store, user_id, cid, series_ids, time_min, time_max) -> list:
+    after = datetime.fromtimestamp(time_min, timezone.utc)
+    before = datetime.fromtimestamp(time_max, timezone.utc)
+    return [
+        instance
+        for master, exceptions in store.load_series(user_id, cid, series_ids).values()
+        for instance in expand(master, exceptions, after, before)
+    ]
+
+
+def format_utc(epoch) -> str:
+    return datetime.fromtimestamp(epoch, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def sync_calendar_events(
+    service,
+    store,
+    user_id,
+    calendar_ids,
+    start_date,
+    end_date,
+    sync_interval=30.0,
+    full_sync_interval=3600.0,
+    expansion="server",
+) -> list:
+    # The dates are local days of the calendars, which can be up to 14 hours
+    # off UTC, so the window reaches one day past the UTC days on each side.
+    # The result holds events of the neighbouring days too: split it with
+    # split_events_by_day and keep the days asked for. See the event_store
+    # module for when each calendar is fetched in full, synced or read
+    # locally. With expansion="local", recurring events are listed once per
+    # series and expanded here rather than by Google.
+    if expansion not in ("server", "local"):
+        raise ValueError(f"Invalid expansion mode: {expansion}")
+    time_min = parse_time(f"{start_date}T00:00:00Z").timestamp() - SECONDS_PER_DAY
+    time_max = parse_time(f"{end_date}T23:59:59Z").timestamp() + SECONDS_PER_DAY
+
+    for cid in dict.fromkeys(calendar_ids):
+        state = store.sync_state(user_id, cid)
+        now = time.time()
+        updated_min = format_utc(now - SYNC_CLOCK_MARGIN)
+
+        def full_sync(lower, upper):
+            if expansion == "local":
+                items = list_series(service, cid, format_utc(lower), format_utc(upper))
+                store.save_series(user_id, cid, items)
+                series_ids = {master_id(i) for i in items if is_series_item(i)}
+                events = [
+                    item
+                    for item in items
+                    if not is_series_item(item) and item.get("status") != "cancelled"
+                ] + expand_series(store, user_id, cid, series_ids, lower, upper)
+            else:
+                events = list_events(service, cid, format_utc(lower), format_utc(upper))
+            store.replace(
+                user_id,
+                cid,
+                int(lower),
+                int(upper),
+                [extract_event(event, cid) for event in events],
+                updated_min,
+            )
+
+        try:
+            if state is None or not (
+                state["time_min"] <= time_min and time_max <= state["time_max"]
+            ):
+                full_sync(time_min, time_max)
+            elif now - state["full_synced"] > full_sync_interval:
+                full_sync(state["time_min"], state["time_max"])
+            elif now - state["synced"] > sync_interval:
+                try:
+                    if expansion == "local":
+                        events = list_series(
+                            service,
+                            cid,
+                            format_utc(state["time_min"]),
+                            format_utc(state["time_max"]),
+                            updatedMin=state["updated_min"],
+                        )
+                    else:
+                        events = list_events(
+                            service,
+                            cid,
+                            format_utc(state["time_min"]),
+                            format_utc(state["time_max"]),
+                            updatedMin=state["updated_min"],
+                            showDeleted=True,
+                        )
+                except HttpError as error:
+                    # 410 Gone: updatedMin is too far back to compute deltas.
+                    if error.resp.status != 410:
+                        raise
+                    full_sync(state["time_min"], state["time_max"])
+                else:
+                    if expansion == "local":
+                        # A changed master or exception changes the series'
+                        # instances; a cancelled item may be a deleted master.
+                        store.save_series(user_id, cid, events)
+                        series_ids = {
+                            master_id(event)
+                            for event in events
+                            if is_series_item(event)
+                            or event.get("status") == "cancelled"
+                        }
+                        store.replace_instances(
+                            user_id,
+                            cid,
+                            series_ids,
+                            [
+                                extract_event(event, cid)
+                                for event in expand_series(
+                                    store,
+                                    user_id,
+                                    cid,
+                                    series_ids,
+                                    state["time_min"],
+                                    state["time_max"],
+                                )
+                            ],
+                        )
+                        events = [e for e in events if not is_series_item(e)]
+                    store.apply_changes(
+                        user_id,
+                        cid,
+                        [
+                            extract_event(event, cid)
+                            for event in events
+                            if event.get("status") != "cancelled"
+                        ],
+                        [
+                            event["id"]
+                            for event in events
+                            if event.get("status") == "cancelled"
+                        ],
+                        updated_min,
+                    )
+        except HttpError as error:
+            # Serve what the store holds, if anything.
+            print(f"An error occurred: {error}")
+
+    return store.query(user_id, calendar_ids, time_min, time_max)
+
+
+def split_events_by_day(events) -> dict:
+    # Events are keyed by the local day of their start, i.e. the day in the
+    # calendar's own time zone. Each day keeps its slice of the event table.
+    return table_of(events).split_by_day()
+
+
+def stable_event_id(calendar_id, event_data) -> str:
+    # Google accepts client-chosen IDs of base32hex characters, which hex
+    # digits are. The ID of the event it replaces, if any, identifies it.
+    key = [calendar_id, event_data.get("id")]
+    if not event_data.get("id"):
+        key += [event_data.get(field) for field in ("summary", "start", "end")]
+    return hashlib.md5(json.dumps(key).encode("utf-8")).hexdigest()
+
+
 def update_or_create_event(service, event_data):
     calendar_id = event_data.get("calendar_id", "primary")
     event_id = event_data.get("id")
@@ -120,10 +362,10 @@ def update_or_create_event(service, event_data):
         if event_id:
             # Try to update the event
             try:
-                updated_event = (
+                updated_event = GOOGLE_CALENDAR.call(
                     service.events()
                     .update(calendarId=calendar_id, eventId=event_id, body=event_body)
-                    .execute()
+                    .execute
                 )
                 print(f"Event updated: {updated_event['summary']}")
                 return updated_event
@@ -137,12 +379,24 @@ def update_or_create_event(service, event_data):
                     raise error
 
         if not event_id:
-            # Create a new event
-            created_event = (
-                service.events()
-                .insert(calendarId=calendar_id, body=event_body)
-                .execute()
-            )
+            # Create a new event, under an ID derived from the event so that
+            # inserting it again, e.g. from a retried job, cannot duplicate it.
+            new_id = stable_event_id(calendar_id, event_data)
+            try:
+                created_event = GOOGLE_CALENDAR.call(
+                    service.events()
+                    .insert(calendarId=calendar_id, body={**event_body, "id": new_id})
+                    .execute
+                )
+            except HttpError as error:
+                if error.resp.status != 409:
+                    raise error
+                # Created by an earlier attempt
+                created_event = GOOGLE_CALENDAR.call(
+                    service.events()
+                    .update(calendarId=calendar_id, eventId=new_id, body=event_body)
+                    .execute
+                )
             print(f"New event created: {created_event['summary']}")
             return created_event
 
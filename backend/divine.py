@@ -8,6 +8,22 @@ modules to process calendar events and query the chatbot, respectively.
 The application also uses the `calapi` module to authenticate with Google
 Calendar and extract events from the calendar.
 
+Fetched events are kept in a local store that is synced with Google
+Calendar incrementally (see the `event_store` module), and cached per user
+(see the `event_cache` module). Requests identify their user with the
+`X-User-Id` header.
+
+Each user's questionnaire is parsed once into an hourly energy profile,
+which the prompts carry instead of the questionnaire (see the
+`energy_profile` module).
+
+Optimized schedules are checked against the day, duration and overlap
+constraints before anything is written back (see the `schedule_validator`
+module).
+
+Identical optimize and chat requests from the same user that arrive while
+one is in flight share its result (see the `singleflight` module).
+
 The application is configured using environment variables. The
 `UPLOAD_FOLDER` environment variable specifies the folder where uploaded
 files are stored. The `ALLOWED_EXTENSIONS` environment variable specifies the
@@ -18,23 +34,59 @@ uploaded files.
 The application has the following endpoints:
 
 * `/process_calendar_events`: Processes a list of calendar events and
-  returns the processed events.
+  returns the processed events. Accepts either a single `date` or a
+  `start_date`/`end_date` range, whose days are optimized concurrently.
 * `/query_chat_bot`: Queries the chatbot with a given query and returns the
   response.
-* `/health`: Returns a health check response.
+* `/health`: Returns a health check response. Succeeds as soon as the
+  process serves requests.
+* `/ready`: Returns whether the models have finished loading.
+  They are loaded in the background at startup, so the first requests do
+  not pay for it.
+* `/metrics`: Returns per-stage latency histograms in the Prometheus text
+  format.
+* `/jobs/{job_id}`: Returns the state of an optimization job.
+* `/jobs/{job_id}/events`: Streams the updates of an optimization job as
+  server-sent events.
+
+`/process_calendar_events` can run as a background job instead of holding
+the connection open (see the `jobs` module).
+
+Every response carries a `Server-Timing` header with the time spent in each
+stage of the request (see the `metrics` module). Selected requests can also
+be profiled into flamegraphs (see the `profiling` module).
 """
 
 import os
+import asyncio
+import contextvars
 import logging
-from functools import lru_cache
+import threading
+from contextlib import asynccontextmanager
+from datetime import date as Date
+from functools import lru_cache, partial
 
 from concurrent.futures import ThreadPoolExecutor
-from typing import Callable, Any
+from typing import TYPE_CHECKING, Callable, Any, Optional
 from functools import wraps
 from typing_extensions import Annotated
 import aiofiles
-from fastapi import FastAPI, File, UploadFile, Body, HTTPException, Depends, Request
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi import (
+    FastAPI,
+    File,
+    UploadFile,
+    Body,
+    HTTPException,
+    Depends,
+    Header,
+    Request,
+)
+from fastapi.responses import (
+    HTMLResponse,
+    JSONResponse,
+    PlainTextResponse,
+    StreamingResponse,
+)
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.background import BackgroundTask
 from pydantic_settings import BaseSettings
@@ -43,25 +95,46 @@ from asyncio import wrap_future
 import json
 from calapi import (
     authenticate_google_calendar,
-    extract_calendar_events,
+    sync_calendar_events,
+    split_events_by_day,
     update_or_create_event,
 )
 
 from ai_calendar_processor import AICalendarProcessor
-from ai_enlightened_chatbot import RAGAgent
+from energy_profile import EnergyProfile, ProfileStore
+from event_cache import create_event_cache, make_cache_key
+from event_store import EventStore
+from jobs import JobQueue, JobQueueFull, JobStore
+from metrics import ServerTimingMiddleware, render_prometheus, timed
+from outbound import ANTHROPIC, GOOGLE_CALENDAR
+from profiling import ProfilingMiddleware
+from schedule_validator import ScheduleValidator
+from singleflight import SingleFlight, normalize_text, request_key
 
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
 )
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Divine Calendar API", version="0.0.1")
+if TYPE_CHECKING:
+    # Importing llama_index takes seconds, so RAGAgent is imported on first use.
+    from ai_enlightened_chatbot import RAGAgent
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Starts the job workers and the warm-up with the application, and stops
+    the workers with it.
+    """
+    job_queue.start()
+    if settings.warm_up:
+        threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+    yield
+    await job_queue.stop()
+
 
-cal_ids = []
-events = []
-service = None
-counter = 0
-last_date = None
+app = FastAPI(title="Divine Calendar API", version="0.0.1", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -71,7 +144,9 @@ app.add_middleware(
         "*"
     ],  # Allows all methods (GET, POST, etc.), replace with specific methods if needed
     allow_headers=["*"],  # Allows all headers, replace with specific headers if needed
+    expose_headers=["Server-Timing", "X-Profile"],
 )
+app.add_middleware(ServerTimingMiddleware)
 
 
 class Settings(BaseSettings):
@@ -83,13 +158,105 @@ class Settings(BaseSettings):
 
     * `UPLOAD_FOLDER`: The folder where uploaded files are stored.
     * `ALLOWED_EXTENSIONS`: The allowed file extensions for uploaded files.
-    * `MAX_WORKERS`: The maximum number of workers to use for processing
-      uploaded files.
+    * `MAX_WORKERS`: The maximum number of worker threads to use for
+      short blocking work, such as fetching events, writing to the stores,
+      answering chat queries or waiting for a model to load.
+    * `OPTIMIZE_WORKERS`: The maximum number of days optimized at the same
+      time, across all requests. Days run on a pool of their own, so long
+      LLM calls never hold the `MAX_WORKERS` threads other endpoints need.
+    * `MAX_CONCURRENT_DAYS`: The maximum number of days of one date-range
+      request that are optimized at the same time. Keep it below
+      `OPTIMIZE_WORKERS`, so that one range request leaves room for others.
+    * `MAX_RANGE_DAYS`: The longest date range a request may ask for.
+    * `EVENT_CACHE_BACKEND`: Where fetched events are cached, "memory" or
+      "sqlite". Use "sqlite" to share the cache between worker processes.
+    * `EVENT_CACHE_PATH`: The database file of the "sqlite" cache.
+    * `EVENT_CACHE_TTL`: Seconds fetched events stay cached.
+    * `EVENT_CACHE_MAX_BYTES`: The memory bound of the event cache.
+    * `EVENT_STORE_PATH`: The database file where each user's events are
+      kept between syncs with Google Calendar.
+    * `EVENT_SYNC_INTERVAL`: Seconds during which stored events are served
+      without asking Google for changes.
+    * `EVENT_FULL_SYNC_INTERVAL`: Seconds after which the stored events of a
+      calendar are fetched again in full rather than as changes.
+    * `EVENT_EXPANSION`: Who expands recurring events into instances.
+      "server" lists every instance from Google; "local" lists each series
+      once and expands its rules locally (see the `recurrence` module).
+    * `PROFILE_STORE_PATH`: The database file where each user's energy
+      profile is kept.
+    * `SCHEDULE_VALIDATION`: What to do with optimized schedules that break
+      the day, duration or overlap constraints. "repair" fixes or drops the
+      offending events, "strict" fails the day without writing anything.
+    * `JOB_STORE_PATH`: The database file where optimization jobs are kept.
+    * `JOB_WORKERS`: The number of optimization jobs run at the same time.
+    * `MAX_QUEUED_JOBS`: The number of waiting jobs above which new jobs
+      are refused.
+    * `JOB_RETENTION`: Seconds finished jobs are kept.
+    * `GOOGLE_CALENDAR_RATE`, `ANTHROPIC_RATE`: The sustained calls per
+      second made to each API, across all requests of the process.
+    * `GOOGLE_CALENDAR_CONCURRENCY`, `ANTHROPIC_CONCURRENCY`: The most calls
+      in flight to each API. The actual limit adapts below this when the API
+      signals overload.
+    * `OUTBOUND_MAX_ATTEMPTS`: The attempts made per API call before giving
+      up on transient errors.
+    * `LLM_BACKEND`: The backend that optimizes schedules, "claude" or
+      "local".
+    * `LLM_HEDGE_BACKEND`: A second backend to race against `LLM_BACKEND`
+      when it is slow or fails. Unset to disable hedging.
+    * `LLM_HEDGE_DELAY`: Seconds to wait for the first event from
+      `LLM_BACKEND` before starting `LLM_HEDGE_BACKEND` as well.
+    * `INDEX_MEMORY_BUDGET`: The bytes the chatbot's loaded indices may
+      take. The least recently used are evicted beyond it, and loaded again
+      when queried.
+    * `EMBED_BACKEND`: The chatbot's embedding backend, "huggingface" or
+      "onnx" for the faster int8 ONNX Runtime model.
+    * `PROFILE_SAMPLE_RATE`: The fraction of requests profiled at random.
+    * `PROFILE_TOKEN`: The `X-Profile` header value that has a request
+      profiled. Unset to disable profiling on demand.
+    * `PROFILE_DIRECTORY`: Where request profiles are written.
+    * `PROFILE_INTERVAL`: Seconds between the stack samples of a profile.
+    * `PROFILE_MAX_DURATION`: Seconds after which a request, e.g. a streamed
+      response, stops being sampled.
+    * `WARM_UP`: Whether to load the models in the background at
+      startup. If disabled, they are loaded by the first request using them.
     """
 
     upload_folder: str = "uploads"
     allowed_extensions: set = {"jpg", "jpeg", "png", "gif"}
-    max_workers: int = 4
+    max_workers: int = 16
+    optimize_workers: int = 8
+    max_concurrent_days: int = 4
+    max_range_days: int = 31
+    event_cache_backend: str = "memory"
+    event_cache_path: str = "event_cache.sqlite3"
+    event_cache_ttl: float = 300.0
+    event_cache_max_bytes: int = 64 * 1024 * 1024
+    event_store_path: str = "events.sqlite3"
+    event_sync_interval: float = 30.0
+    event_full_sync_interval: float = 3600.0
+    event_expansion: str = "server"
+    profile_store_path: str = "profiles.sqlite3"
+    schedule_validation: str = "repair"
+    job_store_path: str = "jobs.sqlite3"
+    job_workers: int = 2
+    max_queued_jobs: int = 100
+    job_retention: float = 24 * 3600.0
+    google_calendar_rate: float = 10.0
+    google_calendar_concurrency: int = 8
+    anthropic_rate: float = 1.0
+    anthropic_concurrency: int = 4
+    outbound_max_attempts: int = 5
+    llm_backend: str = "claude"
+    llm_hedge_backend: Optional[str] = None
+    llm_hedge_delay: float = 5.0
+    embed_backend: str = "huggingface"
+    index_memory_budget: int = 1024 * 1024 * 1024
+    profile_sample_rate: float = 0.0
+    profile_token: Optional[str] = None
+    profile_directory: str = "request_profiles"
+    profile_interval: float = 0.005
+    profile_max_duration: float = 30.0
+    warm_up: bool = True
     host: str = "0.0.0.0"
     port: int = 8000
 
@@ -105,26 +272,205 @@ class Settings(BaseSettings):
 
 
 settings = Settings()
+if settings.profile_sample_rate > 0 or settings.profile_token:
+    app.add_middleware(
+        ProfilingMiddleware,
+        directory=settings.profile_directory,
+        sample_rate=settings.profile_sample_rate,
+        token=settings.profile_token,
+        interval=settings.profile_interval,
+        max_duration=settings.profile_max_duration,
+    )
+executor = ThreadPoolExecutor(max_workers=settings.max_workers)
+# Days being optimized, kept apart from `executor`, see `optimize_days`.
+optimizer = ThreadPoolExecutor(
+    max_workers=settings.optimize_workers, thread_name_prefix="optimize"
+)
+event_cache = create_event_cache(
+    settings.event_cache_backend,
+    path=settings.event_cache_path,
+    ttl=settings.event_cache_ttl,
+    max_bytes=settings.event_cache_max_bytes,
+)
+event_store = EventStore(settings.event_store_path)
+profile_store = ProfileStore(settings.profile_store_path)
+# Identical requests in flight share one computation.
+in_flight = SingleFlight()
+GOOGLE_CALENDAR.configure(
+    rate=settings.google_calendar_rate,
+    max_concurrency=settings.google_calendar_concurrency,
+    max_attempts=settings.outbound_max_attempts,
+)
+ANTHROPIC.configure(
+    rate=settings.anthropic_rate,
+    burst=settings.anthropic_concurrency,
+    max_concurrency=settings.anthropic_concurrency,
+    max_attempts=settings.outbound_max_attempts,
+)
+
+
+# The loading state of each component: "pending", "ready" or "failed".
+readiness = {"calendar_processor": "pending", "chat_bot": "pending"}
+
+
+# Held while a model is built, so the warm-up and a concurrent request do
+# not both load it.
+_calendar_processor_lock = threading.Lock()
+_chat_bot_lock = threading.Lock()
+
+
+@lru_cache(maxsize=1)
+def _calendar_processor() -> AICalendarProcessor:
+    processor = AICalendarProcessor()
+    readiness["calendar_processor"] = "ready"
+    return processor
 
 
 @lru_cache(maxsize=1)
+def _chat_bot() -> "RAGAgent":
+    from ai_enlightened_chatbot import RAGAgent
+
+    chat_bot = RAGAgent(
+        embed_backend=settings.embed_backend,
+        memory_budget=settings.index_memory_budget,
+    )
+    readiness["chat_bot"] = "ready"
+    return chat_bot
+
+
 def get_calendar_processor() -> AICalendarProcessor:
     """
     Returns an instance of the `AICalendarProcessor` class.
 
     The instance is cached using the `lru_cache` decorator.
     """
-    return AICalendarProcessor()
+    with _calendar_processor_lock:
+        return _calendar_processor()
 
 
-@lru_cache(maxsize=1)
-def get_chat_bot() -> RAGAgent:
+def get_chat_bot() -> "RAGAgent":
     """
-    Returns an instance of the `AIEnlightenedChatBot` class.
+    Returns an instance of the `RAGAgent` class.
 
     The instance is cached using the `lru_cache` decorator.
     """
-    return RAGAgent()
+    with _chat_bot_lock:
+        return _chat_bot()
+
+
+def warm_up():
+    """
+    Loads the calendar processor and the chat bot, recording their state in
+    `readiness`.
+
+    A component that fails to load is retried by the first request using it.
+    """
+    getters = {
+        "calendar_processor": get_calendar_processor,
+        "chat_bot": get_chat_bot,
+    }
+    for name, getter in getters.items():
+        getter = app.dependency_overrides.get(getter, getter)
+        try:
+            with timed(f"warm_up_{name}"):
+                getter()
+        except Exception:
+            logger.exception("Failed to warm up %s", name)
+            readiness[name] = "failed"
+        else:
+            logger.info("Warmed up %s", name)
+            readiness[name] = "ready"
+
+
+def get_calendar_service():
+    """
+    Returns an authenticated Google Calendar service. The service is built
+    once and shared between requests, along with its open connections.
+
+    Exposed as a dependency so the service can be swapped out, e.g. for the
+    offline benchmarks in `benchmarks/`.
+    """
+    with timed("auth"):
+        return authenticate_google_calendar()
+
+
+def get_user_id(x_user_id: Annotated[str, Header()] = "default") -> str:
+    """
+    Returns the ID of the user making the request, from the `X-User-Id`
+    header.
+    """
+    return x_user_id
+
+
+async def run_blocking(func: Callable[..., Any], *args: Any) -> Any:
+    """
+    Runs blocking work on the worker pool, such as calls through the
+    `outbound` limits, which sleep while they wait for a token or a retry.
+
+    The caller's context is copied so stage timings reach its request's
+    metrics.
+    """
+    context = contextvars.copy_context()
+    return await wrap_future(executor.submit(context.run, func, *args))
+
+
+def forget_events(user_id: str):
+    """
+    Drops a user's cached events and makes their stored events sync with
+    Google on the next read, e.g. after writing to their calendar.
+    """
+    event_cache.invalidate_user(user_id)
+    event_store.mark_stale(user_id)
+
+
+def fetch_days(
+    service,
+    user_id: str,
+    calendar_ids: list[str],
+    start_date: str,
+    end_date: str,
+) -> dict[str, list]:
+    """
+    Returns the events of `calendar_ids` between two dates, from the event
+    cache if possible, otherwise from the event store after syncing it.
+
+    The dates are local days. The fetch reaches into the neighbouring UTC
+    days, and the events are grouped by the local day of their start, so
+    the first and last days are complete in any time zone.
+
+    Args:
+        service: The Google Calendar service to sync with on a cache miss.
+        user_id (str): The user the events belong to.
+        calendar_ids (list[str]): The calendars to fetch.
+        start_date (str): The first date to fetch, in YYYY-MM-DD format.
+        end_date (str): The last date to fetch, in YYYY-MM-DD format.
+
+    Returns:
+        dict[str, list]: The extracted events of each day between the dates
+            that has any, keyed by YYYY-MM-DD.
+    """
+    key = make_cache_key(user_id, calendar_ids, start_date, end_date)
+    events = event_cache.get(key)
+    if events is None:
+        with timed("calendar_fetch"):
+            events = sync_calendar_events(
+                service,
+                event_store,
+                user_id,
+                calendar_ids,
+                start_date,
+                end_date,
+                sync_interval=settings.event_sync_interval,
+                full_sync_interval=settings.event_full_sync_interval,
+                expansion=settings.event_expansion,
+            )
+        event_cache.set(key, user_id, events)
+        logger.debug("Fetched %d events", len(events))
+    return {
+        day: day_events
+        for day, day_events in split_events_by_day(events).items()
+        if start_date <= day <= end_date
+    }
 
 
 def allowed_file(filename: str) -> bool:
@@ -168,54 +514,449 @@ def handle_exception(func: Callable) -> Callable:
     return wrapper
 
 
+async def optimize_days(
+    days: dict[str, list],
+    profile: EnergyProfile,
+    processor: AICalendarProcessor,
+    service,
+    progress: Optional[Callable[[int, int], None]] = None,
+) -> tuple[dict[str, list], dict[str, str]]:
+    """
+    Optimizes each day's events with its own LLM call and writes the results
+    back to the calendar.
+
+    Days are optimized concurrently on the `optimizer` pool, at most
+    `settings.max_concurrent_days` at a time. The model's output is parsed
+    as it streams in, and each event is written back as soon as it has been
+    generated, so write-back overlaps with generation. Write-backs go
+    through a single writer thread per request because the Calendar service
+    is not thread-safe.
+
+    Every event is checked by a `ScheduleValidator` before it is written.
+    Events that did not move are not written at all. In strict validation
+    mode, nothing is written until the whole day has been validated.
+
+    Args:
+        days (dict[str, list]): The events per day, keyed by YYYY-MM-DD.
+        profile (EnergyProfile): The energy profile of the user.
+        processor (AICalendarProcessor): The processor to optimize with.
+        service: The Google Calendar service to write events with.
+        progress (Optional[Callable[[int, int], None]]): Called with the
+            number of days done and the total number of days whenever a day
+            finishes.
+
+    Returns:
+        tuple[dict[str, list], dict[str, str]]: The optimized events per day,
+            and the error message of each day that failed.
+    """
+    semaphore = asyncio.Semaphore(settings.max_concurrent_days)
+    writer = ThreadPoolExecutor(max_workers=1)
+
+    def write_event(event: dict):
+        with timed("write_back"):
+            update_or_create_event(
+                service,
+                event_data=event,
+            )
+
+    def optimize_day(day_events: list) -> list:
+        validator = ScheduleValidator(day_events, mode=settings.schedule_validation)
+        pipelined = validator.mode == "repair"
+        output, writes = [], []
+
+        def write(valid: list):
+            for event in valid:
+                output.append(event)
+                context = contextvars.copy_context()
+                writes.append(writer.submit(context.run, write_event, event))
+
+        # Events that passed validation but are not yet safe to write.
+        pending = []
+        for event in processor.predict_stream(
+            day_events,
+            profile=profile,
+            backend=settings.llm_backend,
+            hedge_backend=settings.llm_hedge_backend,
+            hedge_delay=settings.llm_hedge_delay,
+        ):
+            with timed("validate"):
+                valid = validator.submit(event)
+            if pipelined:
+                write(valid)
+            else:
+                pending.extend(valid)
+        with timed("validate"):
+            pending.extend(validator.finish())
+        write(pending)
+        for write_future in writes:
+            write_future.result()
+
+        output.extend(validator.unchanged)
+        output.sort(key=lambda event: event["start"])
+        logger.debug("Optimized schedule: %s", output)
+        return output
+
+    done = 0
+
+    async def run(day_events: list) -> list:
+        nonlocal done
+        async with semaphore:
+            # Copy the context so stage timings reach this request's metrics.
+            context = contextvars.copy_context()
+            try:
+                return await wrap_future(
+                    optimizer.submit(context.run, optimize_day, day_events)
+                )
+            finally:
+                done += 1
+                if progress is not None:
+                    progress(done, len(names))
+
+    names = [day for day, day_events in days.items() if day_events]
+    try:
+        results = await asyncio.gather(
+            *(run(days[day]) for day in names), return_exceptions=True
+        )
+    finally:
+        writer.shutdown(wait=False)
+
+    outputs, errors = {}, {}
+    for day, result in zip(names, results):
+        if isinstance(result, Exception):
+            logger.error("Failed to optimize %s", day, exc_info=result)
+            errors[day] = str(result)
+        else:
+            outputs[day] = result
+    return outputs, errors
+
+
+def check_dates(
+    date: Optional[str], start_date: Optional[str], end_date: Optional[str]
+):
+    """
+    Checks that a request names either a date or a valid date range.
+
+    Raises:
+        HTTPException: 422 if neither is given, a date is malformed, or the
+            range is empty or longer than `settings.max_range_days`.
+    """
+
+    def parse(value: str) -> Date:
+        try:
+            parsed = Date.fromisoformat(value)
+        except (TypeError, ValueError):
+            parsed = None
+        # fromisoformat also reads e.g. "20241014", which the fetch does not.
+        if parsed is None or parsed.isoformat() != value:
+            raise HTTPException(status_code=422, detail="Dates must be YYYY-MM-DD")
+        return parsed
+
+    if date is not None:
+        parse(date)
+        return
+    if not start_date or not end_date:
+        raise HTTPException(
+            status_code=422, detail="Provide either date or start_date and end_date"
+        )
+    range_days = (parse(end_date) - parse(start_date)).days
+    if not 0 <= range_days < settings.max_range_days:
+        raise HTTPException(
+            status_code=422,
+            detail=f"The range must span 1 to {settings.max_range_days} days",
+        )
+
+
+async def optimize_calendar(
+    calendar_ids: list[str],
+    questionnaire: str,
+    date: Optional[str],
+    start_date: Optional[str],
+    end_date: Optional[str],
+    processor: AICalendarProcessor,
+    service,
+    user_id: str,
+    progress: Optional[Callable[[int, int], None]] = None,
+) -> list | dict:
+    """
+    Fetches, optimizes and writes back the events of a date or a range.
+
+    In range mode the whole range is fetched in one listing per calendar,
+    split by day, and the days are optimized concurrently. Events are never
+    moved across days, so the days are independent.
+
+    Identical calls from the same user that overlap in time share one
+    computation.
+
+    Args:
+        calendar_ids (list[str]): The list of calendar IDs to process.
+        questionnaire (str): The questionnaire to use for processing events.
+        date (Optional[str]): The date to process events for.
+        start_date (Optional[str]): The first date of the range to process.
+        end_date (Optional[str]): The last date of the range to process.
+        processor (AICalendarProcessor): The processor to optimize with.
+        service: The Google Calendar service to read and write events with.
+        user_id (str): The user making the request.
+        progress (Optional[Callable[[int, int], None]]): Passed on to
+            `optimize_days`. Not called if the computation is shared.
+
+    Returns:
+        list | dict: For a single `date`, the list of optimized events. For
+            a range, an object with the merged `events`, the number of
+            events optimized per day in `days`, and the days that failed in
+            `errors`.
+    """
+    check_dates(date, start_date, end_date)
+    profile = await run_blocking(profile_store.get, user_id, questionnaire)
+
+    async def optimize_date() -> list:
+        days = await run_blocking(
+            fetch_days, service, user_id, calendar_ids, date, date
+        )
+        try:
+            outputs, errors = await optimize_days(
+                days, profile, processor, service, progress
+            )
+        finally:
+            # The write-back changed the calendar, so cached events are stale.
+            await run_blocking(forget_events, user_id)
+        if date in errors:
+            raise HTTPException(status_code=500, detail=errors[date])
+        return outputs.get(date, [])
+
+    async def optimize_range() -> dict:
+        days = await run_blocking(
+            fetch_days, service, user_id, calendar_ids, start_date, end_date
+        )
+        try:
+            outputs, errors = await optimize_days(
+                days, profile, processor, service, progress
+            )
+        finally:
+            await run_blocking(forget_events, user_id)
+        if errors and not outputs:
+            raise HTTPException(status_code=500, detail=errors)
+
+        return {
+            "events": [event for day in sorted(outputs) for event in outputs[day]],
+            "days": {day: len(outputs[day]) for day in sorted(outputs)},
+            "errors": errors,
+        }
+
+    key = request_key(
+        "process_calendar_events",
+        user_id,
+        sorted(set(calendar_ids)),
+        normalize_text(questionnaire),
+        date,
+        start_date,
+        end_date,
+    )
+    return await in_flight.do(
+        key, optimize_date if date is not None else optimize_range
+    )
+
+
+async def resolve(dependency: Callable[[], Any]) -> Any:
+    """
+    Resolves a dependency outside of FastAPI's injection, honouring
+    `app.dependency_overrides` like a request would.
+
+    The dependency runs on the worker pool: getting the processor waits
+    while the warm-up loads the model, which must not block the event loop.
+    """
+    return await run_blocking(app.dependency_overrides.get(dependency, dependency))
+
+
+async def run_job(job: dict, report: Callable[[dict], None]) -> list | dict:
+    """
+    Runs a job submitted by `/process_calendar_events`.
+
+    The processor and calendar service are resolved when the job runs,
+    honouring `app.dependency_overrides` like a request would.
+
+    Args:
+        job (dict): The job, see `jobs.JobStore`.
+        report (Callable[[dict], None]): Records the progress of the job.
+
+    Returns:
+        list | dict: The same content `/process_calendar_events` returns.
+    """
+    processor = await resolve(get_calendar_processor)
+    service = await resolve(get_calendar_service)
+    return await optimize_calendar(
+        processor=processor,
+        service=service,
+        user_id=job["user_id"],
+        progress=lambda done, total: report({"days_done": done, "days_total": total}),
+        **job["payload"],
+    )
+
+
+job_queue = JobQueue(
+    JobStore(settings.job_store_path),
+    run_job,
+    workers=settings.job_workers,
+    max_queued=settings.max_queued_jobs,
+    retention=settings.job_retention,
+)
+
+
 @app.post("/process_calendar_events")
 @handle_exception
 async def process_calendar(
     calendar_ids: list[str] = Body(...),
-    date: str = Body(...),
     questionnaire: str = Body(...),
-    processor: AICalendarProcessor = Depends(get_calendar_processor),
+    date: Optional[str] = Body(None),
+    start_date: Optional[str] = Body(None),
+    end_date: Optional[str] = Body(None),
+    job: bool = Body(False),
+    service=Depends(get_calendar_service),
+    user_id: str = Depends(get_user_id),
 ) -> JSONResponse:
     """
     Processes a list of calendar events and returns the processed events.
 
+    Either `date` or both `start_date` and `end_date` must be given (see
+    `optimize_calendar`). Identical requests from the same user that arrive
+    while one is in flight share its result instead of optimizing again.
+
+    With `job` set, the optimization runs in the background and the response
+    only identifies the job. Poll `/jobs/{job_id}` or subscribe to
+    `/jobs/{job_id}/events` for its progress and result.
+
     Args:
         calendar_ids (list[str]): The list of calendar IDs to process.
-        date (str): The date to process events for.
         questionnaire (str): The questionnaire to use for processing events.
-        processor (AICalendarProcessor): The `AICalendarProcessor` instance to use for
-            processing events.
+        date (Optional[str]): The date to process events for.
+        start_date (Optional[str]): The first date of the range to process.
+        end_date (Optional[str]): The last date of the range to process.
+        job (bool): Whether to run the optimization as a background job.
+        service: The Google Calendar service to read and write events with.
+        user_id (str): The user making the request.
 
     Returns:
-        JSONResponse: The processed events.
+        JSONResponse: The processed events. For a single `date`, the list of
+            optimized events. For a range, an object with the merged
+            `events`, the number of events optimized per day in `days`, and
+            the days that failed in `errors`. In job mode, a 202 response
+            with the `job_id` and the URLs to follow the job at.
     """
+    if job:
+        check_dates(date, start_date, end_date)
+        try:
+            queued = job_queue.submit(
+                user_id,
+                "process_calendar_events",
+                {
+                    "calendar_ids": calendar_ids,
+                    "questionnaire": questionnaire,
+                    "date": date,
+                    "start_date": start_date,
+                    "end_date": end_date,
+                },
+            )
+        except JobQueueFull as exc:
+            raise HTTPException(status_code=503, detail=str(exc))
+        return JSONResponse(
+            status_code=202,
+            content={
+                "job_id": queued["id"],
+                "status": queued["status"],
+                "status_url": f"/jobs/{queued['id']}",
+                "events_url": f"/jobs/{queued['id']}/events",
+            },
+        )
 
-    global cal_ids, events, counter, last_date
+    # Resolved here rather than as a dependency, so job submissions do not
+    # wait for the model to load.
+    processor = await resolve(get_calendar_processor)
+    content = await optimize_calendar(
+        calendar_ids,
+        questionnaire,
+        date,
+        start_date,
+        end_date,
+        processor,
+        service,
+        user_id,
+    )
+    return JSONResponse(status_code=200, content=content)
 
-    service = authenticate_google_calendar()
-    if not cal_ids or cal_ids != calendar_ids or last_date != date:
-        cal_ids = calendar_ids
-        events = extract_calendar_events(
-            service,
-            calendar_ids=calendar_ids,
-            start_date=date,
-            end_date=date,
-        )
-        counter += 1
-        print(events)
 
-    try:
-        output = processor.predict(events, questionnaire=questionnaire)
-        print(output)
-        for event in output:
-            update_or_create_event(
-                service,
-                event_data=event,
-            )
-        return HTMLResponse(status_code=200, content=output)
+def job_view(job: dict) -> dict:
+    """
+    Returns the fields of a job that are shown to its user.
+    """
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "progress": job["progress"],
+        "result": job["result"],
+        "error": job["error"],
+        "created": job["created"],
+        "updated": job["updated"],
+    }
+
+
+def get_job(job_id: str, user_id: str = Depends(get_user_id)) -> dict:
+    """
+    Returns the job with ID `job_id` if it belongs to the requesting user.
+
+    Raises:
+        HTTPException: 404 if there is no such job.
+    """
+    job = job_queue.store.get(job_id)
+    if job is None or job["user_id"] != user_id:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.get("/jobs/{job_id}")
+async def job_status(job: dict = Depends(get_job)) -> JSONResponse:
+    """
+    Returns the state of an optimization job.
+
+    Args:
+        job (dict): The job, see `get_job`.
+
+    Returns:
+        JSONResponse: The job's `status` ("queued", "running", "succeeded" or
+            "failed"), its `progress`, and its `result` or `error` once it
+            has finished.
+    """
+    return JSONResponse(content=job_view(job))
 
-    except Exception as exc:
-        pass
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job: dict = Depends(get_job)) -> StreamingResponse:
+    """
+    Streams the updates of an optimization job as server-sent events.
+
+    Every change of the job is sent as an `update` event carrying the same
+    data as `/jobs/{job_id}`. The last event is a `done` event with the
+    finished job. Comments are sent while nothing changes, to keep the
+    connection open.
+
+    Args:
+        job (dict): The job, see `get_job`.
+
+    Returns:
+        StreamingResponse: The event stream.
+    """
+
+    async def stream():
+        async for update in job_queue.watch(job["id"]):
+            if update is None:
+                yield ": keep-alive\n\n"
+                continue
+            name = "done" if update["status"] in ("succeeded", "failed") else "update"
+            yield f"event: {name}\ndata: {json.dumps(job_view(update))}\n\n"
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
 
 
 @app.post("/query_chat_bot")
@@ -225,7 +966,9 @@ async def query_char_bot(
     agent: str = Body(...),
     calendar_ids: list[str] = Body(...),
     date: str = Body(...),
-    processor: RAGAgent = Depends(get_chat_bot),
+    processor=Depends(get_chat_bot),
+    service=Depends(get_calendar_service),
+    user_id: str = Depends(get_user_id),
 ) -> JSONResponse:
     """
     Queries the chatbot with a given query and returns the response.
@@ -235,34 +978,39 @@ async def query_char_bot(
         agent (str): The agent to use for querying the chatbot.
         processor (AIEnlightenedChatBot): The `AIEnlightenedChatBot` instance to use for
             querying the chatbot.
+        service: The Google Calendar service to read the schedule from.
+        user_id (str): The user making the request.
 
     Returns:
-        JSONResponse: The response from the chatbot.
-    """
-    service = authenticate_google_calendar()
-    query = (
-        "Only if the user asks about their schedule or you think you can give feedback based on their query, here is their schedule: "
-        + "\n"
-        + "".join(
-            str(
-                extract_calendar_events(
-                    service,
-                    calendar_ids=["bharadwaj76509@gmail.com"],
-                    start_date=date,
-                    end_date=date,
-                )
-            )
-        )
-        + "\nHere's the Query\n"
-        + query
-    )
-    print(query)
+        JSONResponse: The response from the chatbot. Identical queries from
+            the same user that arrive while one is in flight share its
+            response.
+    """
     if not agent in ["philosopher", "lawyer", "monk", "productivity"]:
         raise HTTPException(status_code=400, detail="Invalid agent type")
+    check_dates(date, None, None)
 
-    return JSONResponse(
-        status_code=200, content=processor.query(query, agent_type=agent)
-    )
+    async def answer():
+        days = await run_blocking(
+            fetch_days, service, user_id, ["bharadwaj76509@gmail.com"], date, date
+        )
+        schedule = days.get(date, [])
+        prompt = (
+            "Only if the user asks about their schedule or you think you can give feedback based on their query, here is their schedule: "
+            + "\n"
+            + "".join(str(schedule))
+            + "\nHere's the Query\n"
+            + query
+        )
+        logger.debug("Chat bot query: %s", prompt)
+        with timed("rag_query"):
+            return await run_blocking(
+                partial(processor.query, prompt, agent_type=agent)
+            )
+
+    key = request_key("query_chat_bot", user_id, agent, normalize_text(query), date)
+    response = await in_flight.do(key, answer)
+    return JSONResponse(status_code=200, content=response)
 
 
 @app.get("/health")
@@ -276,7 +1024,43 @@ async def health_check() -> JSONResponse:
     return JSONResponse(content={"status": "healthy"})
 
 
+@app.get("/ready")
+async def readiness_check() -> JSONResponse:
+    """
+    Returns whether the application is ready to serve requests quickly.
+
+    Returns:
+        JSONResponse: 200 once every component has loaded, 503 while loading
+            or if a component failed to load, with the state of each
+            component. Always 200 if the warm-up is disabled, since
+            components then load on first use.
+    """
+    if not settings.warm_up or all(state == "ready" for state in readiness.values()):
+        status = "ready"
+    elif "failed" in readiness.values():
+        status = "failed"
+    else:
+        status = "loading"
+    return JSONResponse(
+        status_code=200 if status == "ready" else 503,
+        content={"status": status, "components": readiness},
+    )
+
+
+@app.get("/metrics")
+async def prometheus_metrics() -> PlainTextResponse:
+    """
+    Returns the latency histograms in the Prometheus text exposition format.
+
+    Returns:
+        PlainTextResponse: The metrics of this worker process.
+    """
+    return PlainTextResponse(
+        content=render_prometheus(), media_type="text/plain; version=0.0.4"
+    )
+
+
 if __name__ == "__main__":
     # get_chat_bot()
-    service = authenticate_google_calendar()
+    authenticate_google_calendar()
     uvicorn.run("main:app", host=settings.host, port=settings.port, reload=True)
@@ -0,0 +1,240 @@
+"""
+Cache of parsed documents for the chatbot's indices.
+
+Creating or refreshing a `RAGAgent` index read every PDF with
+`SimpleDirectoryReader`, one file after the other, and again for every
+agent and every process. `DocumentCache` keeps the text of each page and
+its `page_label`, keyed by the hash of the file's content, in a SQLite
+database. Files that are already cached are not parsed again, wherever they
+are stored and under whatever name; the `file_name` and `file_path`
+metadata the references use are added when the documents are loaded.
+
+Files missing from the cache are parsed in a pool of processes, as PDF
+extraction is CPU-bound. The workers are spawned rather than forked, since
+the parent may be loading a model on another thread, and only import
+`llama_index` when they parse a file.
+
+A page's document ID is its file path and page number. `indexed_pages` and
+`stale_documents` find the pages an index still holds for files that were
+removed or got shorter, so that they can be deleted from it.
+"""
+
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import TYPE_CHECKING, Optional
+
+from metrics import timed
+from sqlite_store import SQLiteStore
+
+if TYPE_CHECKING:
+    from llama_index.core import Document
+
+logger = logging.getLogger(__name__)
+
+# Metadata the references read but that should not be embedded.
+FILE_METADATA = ["file_name", "file_path"]
+
+
+def file_hash(path: str) -> str:
+    """
+    Returns the MD5 hex digest of a file's content, the same hash as
+    `RAGAgent._get_document_hashes`.
+    """
+    with open(path, "rb") as f:
+        return hashlib.md5(f.read()).hexdigest()
+
+
+def parse_file(path: str) -> list[tuple[str, Optional[str]]]:
+    """
+    Parses a file with llama_index's reader for its type.
+
+    Returns:
+        list[tuple[str, Optional[str]]]: The text and page label of each
+            page, or of the whole file if it has no pages.
+    """
+    from llama_index.core import SimpleDirectoryReader
+
+    documents = SimpleDirectoryReader(input_files=[path]).load_data()
+    return [(doc.text, doc.metadata.get("page_label")) for doc in documents]
+
+
+def list_files(directory: str) -> list[str]:
+    """
+    Returns the files under `directory`, without hidden ones, like
+    `SimpleDirectoryReader(directory, recursive=True)`.
+    """
+    paths = []
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+        paths.extend(
+            os.path.join(root, file)
+            for file in sorted(files)
+            if not file.startswith(".")
+        )
+    return paths
+
+
+def indexed_pages(index) -> dict[str, set[str]]:
+    """
+    Returns the IDs of the documents stored in an index for each file, read
+    from their `file_path` metadata.
+    """
+    pages = {}
+    for doc_id, info in index.ref_doc_info.items():
+        path = (info.metadata or {}).get("file_path", doc_id.rsplit("#", 1)[0])
+        pages.setdefault(path, set()).add(doc_id)
+    return pages
+
+
+def stale_documents(
+    indexed: dict[str, set[str]], documents: list["Document"], paths: list[str]
+) -> list[str]:
+    """
+    Returns the IDs of the indexed documents of `paths` that are not in
+    `documents`: every page of a removed file, and the pages a changed file
+    no longer has.
+
+    Args:
+        indexed (dict[str, set[str]]): The documents of each file in the
+            index, see `indexed_pages`.
+        documents (list[Document]): The current documents of the files that
+            changed.
+        paths (list[str]): The files that changed or were removed.
+    """
+    current = {document.id_ for document in documents}
+    return sorted(
+        doc_id
+        for path in paths
+        for doc_id in indexed.get(path, ())
+        if doc_id not in current
+    )
+
+
+class DocumentCache(SQLiteStore):
+    """
+    Parsed documents stored in a SQLite database.
+
+    Each row holds the pages of one file content, as a JSON list of
+    `[text, page_label]` pairs keyed by the content's hash, so agents and
+    processes sharing the database parse each file once.
+
+    Attributes:
+        path (str): The path of the database file.
+        workers (int): The most processes parsing files at the same time.
+    """
+
+    SCHEMA = (
+        """
+        CREATE TABLE IF NOT EXISTS files (
+            hash TEXT PRIMARY KEY,
+            pages TEXT NOT NULL,
+            parsed REAL NOT NULL
+        )
+        """,
+    )
+
+    def __init__(self, path: str = "documents.sqlite3", workers: Optional[int] = None):
+        self.workers = workers or os.cpu_count() or 1
+        super().__init__(path)
+
+    def load(
+        self, paths: list[str], hashes: Optional[dict[str, str]] = None
+    ) -> list["Document"]:
+        """
+        Returns the documents of `paths`, parsing the files that are not
+        cached yet.
+
+        Args:
+            paths (list[str]): The files to load.
+            hashes (Optional[dict[str, str]]): The content hash of each file
+                if already known, see `file_hash`.
+
+        Returns:
+            list[Document]: One document per page, in the order of `paths`,
+                with the `page_label`, `file_name` and `file_path` metadata.
+                A page's ID is its file path and page number, so a changed
+                file replaces its pages when the index is refreshed, and
+                `stale_documents` finds the pages it no longer has.
+        """
+        from llama_index.core import Document
+
+        hashes = hashes or {}
+        keys = {path: hashes.get(path) or file_hash(path) for path in paths}
+        pages = self._lookup(set(keys.values()))
+
+        missing = {}
+        for path, key in keys.items():
+            if key not in pages:
+                missing.setdefault(key, path)
+        if missing:
+            pages.update(self._parse(missing))
+
+        documents = []
+        for path in paths:
+            for number, (text, label) in enumerate(pages[keys[path]]):
+                metadata = {"file_name": os.path.basename(path), "file_path": path}
+                if label is not None:
+                    metadata["page_label"] = label
+                documents.append(
+                    Document(
+                        id_=f"{path}#{number}",
+                        text=text,
+                        metadata=metadata,
+                        excluded_embed_metadata_keys=FILE_METADATA,
+                        excluded_llm_metadata_keys=FILE_METADATA,
+                    )
+                )
+        return documents
+
+    def load_directory(
+        self, directory: str, hashes: Optional[dict[str, str]] = None
+    ) -> list["Document"]:
+        """
+        Returns the documents of every file under `directory`, see `load`.
+        """
+        return self.load(list_files(directory), hashes)
+
+    def _lookup(self, keys: set[str]) -> dict[str, list]:
+        conn = self._connection()
+        found = {}
+        keys = list(keys)
+        # Stay below SQLite's limit on query parameters.
+        for i in range(0, len(keys), 500):
+            chunk = keys[i : i + 500]
+            rows = conn.execute(
+                "SELECT hash, pages FROM files WHERE hash IN "
+                f"({', '.join('?' * len(chunk))})",
+                chunk,
+            )
+            found.update((key, json.loads(pages)) for key, pages in rows)
+        return found
+
+    def _parse(self, missing: dict[str, str]) -> dict[str, list]:
+        """
+        Parses one file per hash in `missing`, in parallel if there are
+        several, and stores the results.
+        """
+        with timed("document_parse"):
+            keys, paths = list(missing), list(missing.values())
+            logger.info("Parsing %d documents", len(paths))
+            if len(paths) == 1:
+                results = [parse_file(paths[0])]
+            else:
+                with ProcessPoolExecutor(
+                    max_workers=min(self.workers, len(paths)),
+                    mp_context=multiprocessing.get_context("spawn"),
+                ) as pool:
+                    results = list(pool.map(parse_file, paths))
+
+        parsed = dict(zip(keys, results))
+        now = time.time()
+        self._connection().executemany(
+            "INSERT OR REPLACE INTO files VALUES (?, ?, ?)",
+            [(key, json.dumps(pages), now) for key, pages in parsed.items()],
+        )
+        return parsed
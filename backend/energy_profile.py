@@ -0,0 +1,394 @@
+"""
+Hourly energy profiles parsed from the user's questionnaire.
+
+The free-text questionnaire used to be pasted into every optimization
+prompt, and the model had to interpret it again on each call, not always
+the same way. `parse_questionnaire` turns it once into an `EnergyProfile`:
+
+* `curve`: the user's energy in each hour of the day, from 0 to 1;
+* `notes`: the clauses that say nothing about energy, e.g. preferences
+  for meetings, kept verbatim so the model still sees them.
+
+The parser is rule-based, so the same questionnaire always gives the same
+profile. It starts from a typical day and applies each clause that pairs an
+energy cue ("best focused work", "my energy dips") with a time of day
+("before lunch", "after 2pm", "between 9 and 11am"). Chronotypes such as
+"morning person" or "night owl" shift the whole curve.
+
+A negated clause ("I'm not productive in the morning", "I never feel
+focused after 8pm", "I'm not a night owl") lowers the hours it names
+instead of raising them. A negated low-energy cue ("my energy doesn't dip
+after lunch") only says those hours are not low, so the curve is left as it
+is and the clause is kept as a note.
+
+`EnergyProfile.describe` is what the prompt carries instead of the
+questionnaire, and `EnergyProfile.mean_energy` lets code other than the
+model score a schedule against the same profile.
+
+`ProfileStore` keeps the profile of each user in SQLite, keyed by a hash of
+their questionnaire, so a questionnaire is parsed once, and again only when
+it changes.
+"""
+
+import hashlib
+import json
+import logging
+import re
+import time
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from typing import Optional
+
+from sqlite_store import SQLiteStore
+
+logger = logging.getLogger(__name__)
+
+# Stored profiles parsed by another version of the parser are parsed again.
+PARSER_VERSION = 2
+
+# A typical day: asleep at night, up in the morning, a dip after lunch.
+BASELINE = [
+    0.1, 0.1, 0.1, 0.1, 0.1, 0.15,
+    0.3, 0.5, 0.65, 0.7, 0.7, 0.7,
+    0.6, 0.5, 0.5, 0.55, 0.6, 0.55,
+    0.5, 0.45, 0.4, 0.3, 0.2, 0.15,
+]  # fmt: skip
+
+# The hours each phrase names, longest phrases first so that e.g. "late
+# afternoon" is not also read as "afternoon".
+PERIODS = {
+    "early morning": range(5, 8),
+    "late morning": range(10, 12),
+    "before lunch": range(9, 12),
+    "after lunch": range(13, 15),
+    "early afternoon": range(13, 15),
+    "late afternoon": range(15, 18),
+    "late evening": range(20, 23),
+    "late at night": range(22, 24),
+    "late night": range(22, 24),
+    "midday": range(12, 13),
+    "lunch": range(12, 13),
+    "noon": range(12, 13),
+    "morning": range(6, 12),
+    "afternoon": range(12, 18),
+    "evening": range(18, 22),
+    "night": range(21, 24),
+}
+HIGH_CUES = (
+    "best", "peak", "most productive", "productive", "focused", "focus",
+    "sharp", "alert", "energized", "energetic", "high energy", "fresh",
+    "creative", "motivated", "at my best",
+)  # fmt: skip
+LOW_CUES = (
+    "dip", "dips", "slump", "crash", "tired", "sleepy", "drained", "low",
+    "exhausted", "sluggish", "worst", "unproductive", "fatigue", "fade",
+    "fades", "struggle", "drowsy",
+)  # fmt: skip
+CHRONOTYPES = {
+    "morning person": range(6, 12),
+    "early bird": range(5, 11),
+    "early riser": range(5, 11),
+    "night owl": range(19, 24),
+    "evening person": range(17, 22),
+    "night person": range(20, 24),
+}
+STEP = 0.25
+
+_TIME = r"(\d{1,2})(?::(\d{2}))?\s*(am|pm|a\.m\.|p\.m\.)?|noon|midnight"
+_RANGE = re.compile(
+    rf"(?:between|from)\s+(?P<a>{_TIME})\s+(?:and|to|until|till)\s+(?P<b>{_TIME})"
+    rf"|(?P<c>{_TIME})\s*(?P<sep>-|–|to)\s*(?P<d>{_TIME})"
+)
+# Words after a range of bare numbers that make it a count, not hours.
+_COUNT = re.compile(
+    r"\s*(?:meetings?|calls?|hours?|hrs?|minutes?|mins?|times?|tasks?|days?|"
+    r"breaks?|cups?|people|x)\b"
+)
+_BOUND = re.compile(rf"\b(?P<op>after|before|until|till|around|at)\s+(?P<t>{_TIME})")
+_EXPLICIT = re.compile(r"am|pm|a\.m\.|p\.m\.|:|noon|midnight")
+_MERIDIEM = re.compile(r"am|pm|a\.m\.|p\.m\.")
+_BETWEEN = re.compile(r"\bbetween\s+\S+$", re.IGNORECASE)
+_NEGATION = re.compile(
+    r"\b(?:not|never|no|hardly|rarely|seldom|cannot)\b|n['’]t\b", re.IGNORECASE
+)
+_CLAUSES = re.compile(
+    r"[,;!?\n]+|\.(?:\s+|$)|\s+\b(?:and|but|while|whereas|although)\b\s+",
+    re.IGNORECASE,
+)
+
+
+def _hour(text: str, bare: bool) -> Optional[int]:
+    """
+    Returns the hour a time names, or None.
+
+    A bare number, without "am", "pm" or minutes, is only accepted if
+    `bare` is set, and is read as a working hour: 7 to 11 in the morning,
+    12 to 6 in the afternoon.
+    """
+    text = text.strip()
+    if text == "noon":
+        return 12
+    if text == "midnight":
+        return 0
+    match = re.fullmatch(_TIME, text)
+    if match is None or match.group(1) is None:
+        return None
+    hour, minutes, meridiem = int(match.group(1)), match.group(2), match.group(3)
+    if meridiem:
+        if hour > 12:
+            return None
+        return hour % 12 + (12 if meridiem.startswith("p") else 0)
+    if minutes is not None:
+        return hour if hour < 24 else None
+    if not bare or hour > 12:
+        return None
+    return hour if 7 <= hour <= 11 else hour % 12 + 12
+
+
+def _hours(clause: str) -> list[int]:
+    """
+    Returns the hours a clause refers to, in order.
+    """
+    hours = set()
+    for match in _RANGE.finditer(clause):
+        first, last = match.group("a"), match.group("b")
+        if first is None:
+            # Without "between" or "from", only accept explicit times or a
+            # dash between bare numbers ("focused 10-12"), so that e.g. "2 to
+            # 3 meetings" or "2-3 calls" is not read as hours.
+            if not _EXPLICIT.search(match.group(0)) and (
+                match.group("sep") == "to" or _COUNT.match(clause, match.end())
+            ):
+                continue
+            first, last = match.group("c"), match.group("d")
+        start, end = _hour(first, True), _hour(last, True)
+        # "9 to 11pm": the first time shares the meridiem of the second.
+        meridiem = _MERIDIEM.search(last)
+        if meridiem and not _EXPLICIT.search(first):
+            shared = _hour(first + meridiem.group(0), False)
+            if shared is not None and end is not None and shared < end:
+                start = shared
+        if start is not None and end is not None:
+            # "9 to 12" covers the hours starting at 9, 10 and 11.
+            hours.update(range(start, end) if start < end else range(start, 24))
+    clause = _RANGE.sub(" ", clause)
+
+    for match in _BOUND.finditer(clause):
+        hour = _hour(match.group("t"), False)
+        if hour is None:
+            continue
+        op = match.group("op")
+        if op == "after":
+            hours.update(range(hour, 24))
+        elif op in ("before", "until", "till"):
+            hours.update(range(6, hour))
+        else:
+            hours.update(range(max(hour - 1, 0), min(hour + 2, 24)))
+    clause = _BOUND.sub(" ", clause)
+
+    for phrase, period in PERIODS.items():
+        if re.search(rf"\b{phrase}s?\b", clause):
+            hours.update(period)
+            clause = clause.replace(phrase, " ")
+    return sorted(hours)
+
+
+def _mentions(clause: str, cues: tuple[str, ...]) -> bool:
+    return any(re.search(rf"\b{re.escape(cue)}\b", clause) for cue in cues)
+
+
+@dataclass
+class EnergyProfile:
+    """
+    A user's energy over the day.
+
+    Attributes:
+        curve (list[float]): The energy in each hour, from 0 (lowest) to 1
+            (highest). `curve[h]` covers h:00 to h:59.
+        notes (list[str]): What the questionnaire says besides energy.
+    """
+
+    curve: list[float] = field(default_factory=lambda: list(BASELINE))
+    notes: list[str] = field(default_factory=list)
+
+    def energy(self, hour: int) -> float:
+        """
+        Returns the energy in the hour starting at `hour`.
+        """
+        return self.curve[hour % 24]
+
+    def mean_energy(self, start: datetime, end: datetime) -> float:
+        """
+        Returns the mean energy between two times of the same day, weighted
+        by the minutes spent in each hour.
+        """
+        start_minute = start.hour * 60 + start.minute
+        end_minute = end.hour * 60 + end.minute
+        if end.date() > start.date():
+            end_minute = 24 * 60
+        if end_minute <= start_minute:
+            return self.energy(start.hour)
+        total = 0.0
+        for hour in range(start.hour, (end_minute - 1) // 60 + 1):
+            overlap = min(end_minute, (hour + 1) * 60) - max(start_minute, hour * 60)
+            total += self.curve[hour] * overlap
+        return total / (end_minute - start_minute)
+
+    def peak_hours(self, threshold: float = 0.8) -> list[int]:
+        """
+        Returns the hours whose energy is at least `threshold` of the
+        highest.
+        """
+        highest = max(self.curve)
+        return [h for h, level in enumerate(self.curve) if level >= threshold * highest]
+
+    def describe(self) -> str:
+        """
+        Returns the profile as the prompt states it.
+        """
+        levels = " ".join(str(round(level * 9)) for level in self.curve)
+        peaks = ", ".join(f"{h:02d}:00" for h in self.peak_hours())
+        text = (
+            "The user's energy in each hour of the day, from 00:00 to 23:00, "
+            f"on a scale from 0 (lowest) to 9 (highest): {levels}. "
+            f"Peak hours: {peaks}."
+        )
+        if self.notes:
+            text += " Other details from the user: " + "; ".join(self.notes) + "."
+        return text
+
+    def to_json(self) -> str:
+        return json.dumps(asdict(self))
+
+    @classmethod
+    def from_json(cls, data: str) -> "EnergyProfile":
+        return cls(**json.loads(data))
+
+
+def _clauses(text: str) -> list[str]:
+    """
+    Splits text into clauses, keeping "between 9 and 11am" in one.
+    """
+    clauses = []
+    for clause in _CLAUSES.split(text):
+        clause = " ".join(clause.split())
+        if not clause:
+            continue
+        if clauses and _BETWEEN.search(clauses[-1]):
+            clauses[-1] += " and " + clause
+        else:
+            clauses.append(clause)
+    return clauses
+
+
+def _apply(curve: list[float], clause: str) -> bool:
+    """
+    Applies the energy cues of a lowercase clause to `curve`. A negated
+    high-energy cue or chronotype lowers the hours it names.
+
+    Returns:
+        bool: Whether the clause says anything about the user's energy.
+    """
+    negated = bool(_NEGATION.search(clause))
+    for phrase, period in CHRONOTYPES.items():
+        if phrase in clause:
+            for hour in range(24):
+                if hour in period:
+                    curve[hour] += -STEP if negated else STEP
+                # A strong preference for one end of the day costs the other.
+                elif 6 <= hour < 23 and not negated:
+                    curve[hour] -= STEP / 3
+            return True
+
+    high, low = _mentions(clause, HIGH_CUES), _mentions(clause, LOW_CUES)
+    if high == low or (low and negated):
+        return False
+    hours = _hours(clause)
+    for hour in hours:
+        curve[hour] += STEP if high and not negated else -STEP
+    return bool(hours)
+
+
+def parse_questionnaire(questionnaire: str) -> EnergyProfile:
+    """
+    Parses a questionnaire into an energy profile.
+
+    Args:
+        questionnaire (str): The user's description of their day.
+
+    Returns:
+        EnergyProfile: The profile. Without any energy cue, the curve is the
+            typical day.
+    """
+    curve = list(BASELINE)
+    notes = []
+    for clause in _clauses(questionnaire):
+        if not _apply(curve, clause.lower()):
+            notes.append(clause)
+    return EnergyProfile(
+        curve=[round(min(max(level, 0.0), 1.0), 3) for level in curve], notes=notes
+    )
+
+
+def questionnaire_hash(questionnaire: str) -> str:
+    """
+    Returns the key of a questionnaire in the `ProfileStore`. Questionnaires
+    that differ only in whitespace share a key.
+    """
+    normalized = f"{PARSER_VERSION}:" + " ".join(questionnaire.split())
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+class ProfileStore(SQLiteStore):
+    """
+    The energy profile of each user, stored in a SQLite database.
+
+    A user has one row: their latest profile, with the `questionnaire_hash`
+    of the questionnaire it was parsed from.
+
+    Attributes:
+        path (str): The path of the database file.
+    """
+
+    SCHEMA = (
+        """
+        CREATE TABLE IF NOT EXISTS profiles (
+            user_id TEXT PRIMARY KEY,
+            questionnaire_hash TEXT NOT NULL,
+            profile TEXT NOT NULL,
+            updated REAL NOT NULL
+        )
+        """,
+    )
+
+    def __init__(self, path: str = "profiles.sqlite3"):
+        super().__init__(path)
+
+    def get(self, user_id: str, questionnaire: str) -> EnergyProfile:
+        """
+        Returns the profile of a user, parsing `questionnaire` if the user
+        has no profile yet or their questionnaire changed.
+
+        Args:
+            user_id (str): The user the questionnaire belongs to.
+            questionnaire (str): The user's current questionnaire.
+
+        Returns:
+            EnergyProfile: The user's profile.
+        """
+        key = questionnaire_hash(questionnaire)
+        conn = self._connection()
+        row = conn.execute(
+            "SELECT questionnaire_hash, profile FROM profiles WHERE user_id = ?",
+            (user_id,),
+        ).fetchone()
+        if row is not None and row[0] == key:
+            return EnergyProfile.from_json(row[1])
+
+        profile = parse_questionnaire(questionnaire)
+        conn.execute(
+            "INSERT OR REPLACE INTO profiles VALUES (?, ?, ?, ?)",
+            (user_id, key, profile.to_json(), time.time()),
+        )
+        logger.info("Parsed the energy profile of %s", user_id)
+        return profile
@@ -0,0 +1,228 @@
+"""
+Per-user cache of fetched calendar events.
+
+Fetching events from Google Calendar is one of the slowest stages of a
+request, and consecutive requests from one user usually ask for the same
+calendars and dates. The cache keeps the extracted events of each
+(user, calendars, date range) for a limited time and within a memory bound.
+
+Two backends are available:
+
+* `MemoryEventCache`: an in-process LRU. Fast, but private to one worker.
+* `SQLiteEventCache`: a SQLite file in WAL mode. Several uvicorn workers on
+  the same host can point at the same file and get hits for each other's
+  fetches.
+
+Entries are keyed by `make_cache_key`, which normalizes the order of the
+calendar IDs. Every entry also records its user so that all of a user's
+entries can be dropped at once, e.g. after writing to their calendar.
+"""
+
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from sqlite_store import SQLiteStore
+
+logger = logging.getLogger(__name__)
+
+
+def make_cache_key(
+    user_id: str, calendar_ids: list[str], start_date: str, end_date: str
+) -> str:
+    """
+    Builds the cache key of a fetch.
+
+    Args:
+        user_id (str): The user the events belong to.
+        calendar_ids (list[str]): The calendars fetched. Order does not matter.
+        start_date (str): The first date fetched, in YYYY-MM-DD format.
+        end_date (str): The last date fetched, in YYYY-MM-DD format.
+
+    Returns:
+        str: A hex digest identifying the fetch.
+    """
+    payload = json.dumps(
+        [user_id, sorted(set(calendar_ids)), start_date, end_date],
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class MemoryEventCache:
+    """
+    An in-process LRU cache with a TTL and a size bound.
+
+    Attributes:
+        ttl (float): Seconds an entry stays valid.
+        max_bytes (int): The maximum total size of the cached values, measured
+            as the length of their JSON encoding.
+    """
+
+    def __init__(self, ttl: float = 300.0, max_bytes: int = 64 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (user_id, value, size, expires)
+        self._size = 0
+
+    def get(self, key: str) -> Optional[list]:
+        """
+        Returns the cached value of `key`, or None if missing or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[3] < time.time():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: str, user_id: str, value: list):
+        """
+        Caches `value` under `key` for `user_id`, evicting the least recently
+        used entries if the size bound is exceeded.
+        """
+        size = len(json.dumps(value))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (user_id, value, size, time.time() + self.ttl)
+            self._size += size
+            while self._size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate_user(self, user_id: str):
+        """
+        Drops every entry of `user_id`.
+        """
+        with self._lock:
+            for key in [k for k, v in self._entries.items() if v[0] == user_id]:
+                self._remove(key)
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key)
+        self._size -= entry[2]
+
+
+class SQLiteEventCache(SQLiteStore):
+    """
+    A cache stored in a SQLite database, shareable between processes.
+
+    Entries record their expiry and when they were last read, so that any
+    process writing to the cache can drop expired entries and evict the
+    least recently used ones for all of them.
+
+    Attributes:
+        path (str): The path of the database file.
+        ttl (float): Seconds an entry stays valid.
+        max_bytes (int): The maximum total size of the cached values.
+    """
+
+    SCHEMA = (
+        """
+        CREATE TABLE IF NOT EXISTS events (
+            key TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            value TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            expires REAL NOT NULL,
+            accessed REAL NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS events_user ON events (user_id)",
+        "CREATE INDEX IF NOT EXISTS events_accessed ON events (accessed)",
+    )
+
+    def __init__(
+        self,
+        path: str = "event_cache.sqlite3",
+        ttl: float = 300.0,
+        max_bytes: int = 64 * 1024 * 1024,
+    ):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        super().__init__(path)
+
+    def get(self, key: str) -> Optional[list]:
+        """
+        Returns the cached value of `key`, or None if missing or expired.
+        """
+        conn = self._connection()
+        now = time.time()
+        row = conn.execute(
+            "SELECT value FROM events WHERE key = ? AND expires >= ?", (key, now)
+        ).fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE events SET accessed = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def set(self, key: str, user_id: str, value: list):
+        """
+        Caches `value` under `key` for `user_id`, evicting expired entries and
+        then the least recently used ones if the size bound is exceeded.
+        """
+        encoded = json.dumps(value)
+        if len(encoded) > self.max_bytes:
+            return
+        now = time.time()
+        try:
+            with self._transaction() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, user_id, encoded, len(encoded), now + self.ttl, now),
+                )
+                conn.execute("DELETE FROM events WHERE expires < ?", (now,))
+                total = conn.execute(
+                    "SELECT COALESCE(SUM(size), 0) FROM events"
+                ).fetchone()[0]
+                if total > self.max_bytes:
+                    excess = total - self.max_bytes
+                    victims = []
+                    for victim, size in conn.execute(
+                        "SELECT key, size FROM events WHERE key != ? ORDER BY accessed",
+                        (key,),
+                    ):
+                        victims.append((victim,))
+                        excess -= size
+                        if excess <= 0:
+                            break
+                    conn.executemany("DELETE FROM events WHERE key = ?", victims)
+        except sqlite3.Error:
+            logger.exception("Failed to write to the event cache")
+
+    def invalidate_user(self, user_id: str):
+        """
+        Drops every entry of `user_id`.
+        """
+        self._connection().execute("DELETE FROM events WHERE user_id = ?", (user_id,))
+
+
+def create_event_cache(backend: str, path: str, ttl: float, max_bytes: int):
+    """
+    Creates the event cache for the given backend name.
+
+    Args:
+        backend (str): "memory" or "sqlite".
+        path (str): The database file of the "sqlite" backend.
+        ttl (float): Seconds an entry stays valid.
+        max_bytes (int): The maximum total size of the cached values.
+
+    Returns:
+        MemoryEventCache | SQLiteEventCache: The cache.
+    """
+    if backend == "memory":
+        return MemoryEventCache(ttl=ttl, max_bytes=max_bytes)
+    if backend == "sqlite":
+        return SQLiteEventCache(path=path, ttl=ttl, max_bytes=max_bytes)
+    raise ValueError(f"Unknown event cache backend: {backend}")
@@ -0,0 +1,372 @@
+"""
+Local store of each user's calendar events.
+
+The event cache only helps when a request repeats an earlier fetch exactly.
+Any other date or calendar set, e.g. every chat message about a new day,
+went back to Google for the whole range. `EventStore` keeps the extracted
+events of each (user, calendar) in a SQLite table indexed on
+(user_id, calendar_id, start), so any range inside what has been fetched
+before is answered locally.
+
+For each (user, calendar), the store records the window it holds and
+when it was last synced with Google. `calapi.sync_calendar_events` keeps it
+current:
+
+* a window that is not covered yet is fetched in full;
+* a covered window that was synced recently is answered from the store;
+* otherwise only the events changed since the last sync are fetched
+  (`updatedMin` with `showDeleted`), and applied to the store;
+* every `full_sync_interval` the whole window is fetched again. Events
+  moved out of the window by another client are not in the deltas, so
+  this bounds how long such an event can linger.
+
+In "local" expansion mode (see the `recurrence` module), the store also
+keeps each recurring master and its exceptions in the `series` table. The
+instances of a series are expanded into the `events` table like any other
+event, and expanded again when a delta changes the master or an exception.
+
+After writing to a user's calendar, `mark_stale` makes the next read sync
+the deltas, which include the writes.
+
+Times are stored as epoch seconds and compared with Google's semantics: an
+event is in [time_min, time_max) if it ends after time_min and starts
+before time_max.
+"""
+
+import json
+import logging
+import sqlite3
+import time
+from typing import Optional
+
+from event_table import EventList, parse_time
+from recurrence import is_series_item, master_id
+from sqlite_store import SQLiteStore
+
+logger = logging.getLogger(__name__)
+
+
+class EventStore(SQLiteStore):
+    """
+    Extracted calendar events stored in a SQLite database.
+
+    Besides the events, the store records for each calendar the window it
+    holds and when it was last synced (`syncs`), and the recurring masters
+    and exceptions of the calendar's series (`series`).
+
+    Attributes:
+        path (str): The path of the database file.
+        max_window (int): The longest window kept per calendar, in
+            seconds. Fetching a window that would extend the stored one
+            beyond this replaces it instead.
+    """
+
+    SCHEMA = (
+        """
+        CREATE TABLE IF NOT EXISTS events (
+            user_id TEXT NOT NULL,
+            calendar_id TEXT NOT NULL,
+            id TEXT NOT NULL,
+            start_time INTEGER NOT NULL,
+            end_time INTEGER NOT NULL,
+            data TEXT NOT NULL,
+            PRIMARY KEY (user_id, calendar_id, id)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS events_start "
+        "ON events (user_id, calendar_id, start_time)",
+        """
+        CREATE TABLE IF NOT EXISTS syncs (
+            user_id TEXT NOT NULL,
+            calendar_id TEXT NOT NULL,
+            time_min INTEGER NOT NULL,
+            time_max INTEGER NOT NULL,
+            updated_min TEXT NOT NULL,
+            synced REAL NOT NULL,
+            full_synced REAL NOT NULL,
+            PRIMARY KEY (user_id, calendar_id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS series (
+            user_id TEXT NOT NULL,
+            calendar_id TEXT NOT NULL,
+            id TEXT NOT NULL,
+            master_id TEXT NOT NULL,
+            data TEXT NOT NULL,
+            PRIMARY KEY (user_id, calendar_id, id)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS series_master "
+        "ON series (user_id, calendar_id, master_id)",
+    )
+    ROW_FACTORY = sqlite3.Row
+
+    def __init__(self, path: str = "events.sqlite3", max_window_days: int = 92):
+        self.max_window = max_window_days * 86400
+        super().__init__(path)
+
+    def sync_state(self, user_id: str, calendar_id: str) -> Optional[dict]:
+        """
+        Returns the window held for a calendar and when it was synced, or
+        None if nothing is held.
+
+        Returns:
+            Optional[dict]: `time_min` and `time_max` in epoch seconds,
+                `updated_min`, the RFC 3339 time to ask Google for changes
+                since, and the `synced` and `full_synced` times.
+        """
+        row = (
+            self._connection()
+            .execute(
+                "SELECT * FROM syncs WHERE user_id = ? AND calendar_id = ?",
+                (user_id, calendar_id),
+            )
+            .fetchone()
+        )
+        return dict(row) if row is not None else None
+
+    def query(
+        self, user_id: str, calendar_ids: list[str], time_min: int, time_max: int
+    ) -> EventList:
+        """
+        Returns the stored events of `calendar_ids` in [time_min, time_max).
+
+        Events are ordered by calendar, in the order of `calendar_ids`, then
+        by start, like `calapi.extract_calendar_events`.
+        """
+        conn = self._connection()
+        events = []
+        for calendar_id in calendar_ids:
+            rows = conn.execute(
+                "SELECT data FROM events WHERE user_id = ? AND calendar_id = ? "
+                "AND start_time < ? AND end_time > ? ORDER BY start_time",
+                (user_id, calendar_id, time_max, time_min),
+            )
+            events.extend(json.loads(row[0]) for row in rows)
+        return EventList(events)
+
+    def replace(
+        self,
+        user_id: str,
+        calendar_id: str,
+        time_min: int,
+        time_max: int,
+        events: list[dict],
+        updated_min: str,
+    ):
+        """
+        Stores the result of fetching a whole window of a calendar.
+
+        The window is merged into the stored one if they overlap and the
+        result is no longer than `max_window`; otherwise it replaces it.
+
+        Args:
+            user_id (str): The user the calendar belongs to.
+            calendar_id (str): The calendar fetched.
+            time_min (int): The start of the window fetched, in epoch seconds.
+            time_max (int): The end of the window fetched.
+            events (list[dict]): Every event of the window.
+            updated_min (str): The time the fetch started, minus a margin for
+                clock skew, in RFC 3339 format.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            state = self.sync_state(user_id, calendar_id)
+            conn.execute(
+                "DELETE FROM events WHERE user_id = ? AND calendar_id = ? "
+                "AND start_time < ? AND end_time > ?",
+                (user_id, calendar_id, time_max, time_min),
+            )
+            if (
+                state is not None
+                and state["time_min"] <= time_max
+                and time_min <= state["time_max"]
+                and max(time_max, state["time_max"]) - min(time_min, state["time_min"])
+                <= self.max_window
+            ):
+                # The older updated_min also covers the rest of the window.
+                updated_min = min(updated_min, state["updated_min"])
+                full_synced = state["full_synced"]
+                # A full sync of the whole window counts as one.
+                if time_min <= state["time_min"] and state["time_max"] <= time_max:
+                    full_synced = now
+                time_min = min(time_min, state["time_min"])
+                time_max = max(time_max, state["time_max"])
+            else:
+                full_synced = now
+                conn.execute(
+                    "DELETE FROM events WHERE user_id = ? AND calendar_id = ?",
+                    (user_id, calendar_id),
+                )
+            self._upsert(conn, user_id, events)
+            conn.execute(
+                "INSERT OR REPLACE INTO syncs VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    user_id,
+                    calendar_id,
+                    time_min,
+                    time_max,
+                    updated_min,
+                    now,
+                    full_synced,
+                ),
+            )
+
+    def apply_changes(
+        self,
+        user_id: str,
+        calendar_id: str,
+        changed: list[dict],
+        cancelled: list[str],
+        updated_min: str,
+    ):
+        """
+        Applies the events changed in a calendar since the last sync.
+
+        Args:
+            user_id (str): The user the calendar belongs to.
+            calendar_id (str): The calendar synced.
+            changed (list[dict]): The events created or updated.
+            cancelled (list[str]): The IDs of the events deleted.
+            updated_min (str): The time the sync started, minus a margin for
+                clock skew, in RFC 3339 format.
+        """
+        with self._transaction() as conn:
+            conn.executemany(
+                "DELETE FROM events WHERE user_id = ? AND calendar_id = ? AND id = ?",
+                [(user_id, calendar_id, event_id) for event_id in cancelled],
+            )
+            self._upsert(conn, user_id, changed)
+            conn.execute(
+                "UPDATE syncs SET updated_min = ?, synced = ? "
+                "WHERE user_id = ? AND calendar_id = ?",
+                (updated_min, time.time(), user_id, calendar_id),
+            )
+
+    def save_series(self, user_id: str, calendar_id: str, items: list[dict]):
+        """
+        Stores the recurring masters and exceptions among listed items.
+
+        A cancelled item that is not an exception may be a deleted master,
+        whose series is then forgotten, exceptions included.
+
+        Args:
+            user_id (str): The user the calendar belongs to.
+            calendar_id (str): The calendar listed.
+            items (list[dict]): The items of a `singleEvents=False` listing.
+        """
+        with self._transaction() as conn:
+            conn.executemany(
+                "DELETE FROM series WHERE user_id = ? AND calendar_id = ? "
+                "AND master_id = ?",
+                [
+                    (user_id, calendar_id, item["id"])
+                    for item in items
+                    if item.get("status") == "cancelled"
+                    and "recurringEventId" not in item
+                ],
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO series VALUES (?, ?, ?, ?, ?)",
+                [
+                    (
+                        user_id,
+                        calendar_id,
+                        item["id"],
+                        master_id(item),
+                        json.dumps(item),
+                    )
+                    for item in items
+                    if is_series_item(item)
+                    and not (
+                        item.get("status") == "cancelled"
+                        and "recurringEventId" not in item
+                    )
+                ],
+            )
+
+    def load_series(
+        self, user_id: str, calendar_id: str, master_ids: set[str]
+    ) -> dict[str, tuple[Optional[dict], list[dict]]]:
+        """
+        Returns the stored series of a calendar.
+
+        Returns:
+            dict[str, tuple[Optional[dict], list[dict]]]: The master, if
+                stored, and the exceptions of each series in `master_ids`
+                that has any.
+        """
+        conn = self._connection()
+        found = {}
+        for series_id in master_ids:
+            rows = conn.execute(
+                "SELECT id, data FROM series WHERE user_id = ? AND calendar_id = ? "
+                "AND master_id = ?",
+                (user_id, calendar_id, series_id),
+            )
+            master, exceptions = None, []
+            for item_id, data in rows:
+                if item_id == series_id:
+                    master = json.loads(data)
+                else:
+                    exceptions.append(json.loads(data))
+            if master is not None or exceptions:
+                found[series_id] = (master, exceptions)
+        return found
+
+    def replace_instances(
+        self,
+        user_id: str,
+        calendar_id: str,
+        master_ids: set[str],
+        events: list[dict],
+    ):
+        """
+        Replaces the stored instances of some series.
+
+        Args:
+            user_id (str): The user the calendar belongs to.
+            calendar_id (str): The calendar of the series.
+            master_ids (set[str]): The series to replace.
+            events (list[dict]): Their instances in the stored window.
+        """
+        with self._transaction() as conn:
+            # Instance IDs are the master's ID, "_" and the original start.
+            conn.executemany(
+                "DELETE FROM events WHERE user_id = ? AND calendar_id = ? "
+                "AND id > ? AND id < ?",
+                [
+                    (user_id, calendar_id, f"{series_id}_", f"{series_id}`")
+                    for series_id in master_ids
+                ],
+            )
+            self._upsert(conn, user_id, events)
+
+    def mark_stale(self, user_id: str):
+        """
+        Makes the next read of each of `user_id`'s calendars sync with Google.
+        """
+        self._connection().execute(
+            "UPDATE syncs SET synced = 0 WHERE user_id = ?", (user_id,)
+        )
+
+    @staticmethod
+    def _upsert(conn: sqlite3.Connection, user_id: str, events: list[dict]):
+        rows = []
+        for event in events:
+            start = parse_time(event["start"])
+            end = parse_time(event["end"], start.tzinfo)
+            rows.append(
+                (
+                    user_id,
+                    event["calendar_id"],
+                    event["id"],
+                    int(start.timestamp()),
+                    int(end.timestamp()),
+                    json.dumps(event),
+                )
+            )
+        conn.executemany(
+            "INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?, ?, ?)", rows
+        )
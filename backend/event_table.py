@@ -0,0 +1,224 @@
+"""
+Compact, array-backed event times for the scheduling hot path.
+
+Events travel through the application as dicts with ISO 8601 strings,
+which is what the prompt, the event cache and the API responses need.
+Comparing times that way means parsing strings again at every stage.
+`EventTable` parses the times of a list of events once into a NumPy
+structured array:
+
+* `start`, `end`: epoch seconds;
+* `offset`: the UTC offset of the start, in seconds, which defines the
+  event's local day;
+* `calendar`: an index into `EventTable.calendars`, the interned calendar
+  IDs;
+* `all_day`: whether the event only has dates.
+
+`EventList` is a list of event dicts that carries its table.
+`extract_calendar_events` returns one, so the table is built once per
+fetch, and everything that treats it as a list keeps working. Code that
+only has a plain list, e.g. events read back from the SQLite event cache,
+calls `table_of` to build the table on demand.
+"""
+
+from datetime import datetime, timedelta, timezone, tzinfo
+from typing import Iterable, Optional
+
+import numpy as np
+
+SECONDS_PER_DAY = 86400
+
+EVENT_DTYPE = np.dtype(
+    [
+        ("start", np.int64),
+        ("end", np.int64),
+        ("offset", np.int32),
+        ("calendar", np.int32),
+        ("all_day", np.bool_),
+    ]
+)
+
+
+def parse_time(value: str, default_tz: Optional[tzinfo] = None) -> datetime:
+    """
+    Parses an RFC 3339 date-time or a YYYY-MM-DD date.
+
+    Args:
+        value (str): The value to parse.
+        default_tz (Optional[tzinfo]): The time zone of values without an
+            offset. Defaults to the local time zone.
+
+    Returns:
+        datetime: The parsed, timezone-aware time.
+    """
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=default_tz or datetime.now().astimezone().tzinfo)
+    return parsed
+
+
+def format_time(epoch: int, offset: int) -> str:
+    """
+    Formats epoch seconds as RFC 3339 with the given UTC offset in seconds.
+    """
+    tz = timezone(timedelta(seconds=int(offset)))
+    return datetime.fromtimestamp(int(epoch), tz).isoformat()
+
+
+class EventTable:
+    """
+    The times and calendars of a list of events, as NumPy arrays.
+
+    Row `i` describes `events[i]`.
+
+    Attributes:
+        events (list[dict]): The events, as extracted by `calapi`.
+        ids (list[str]): The event IDs.
+        calendars (list[str]): The distinct calendar IDs, in order of first
+            appearance.
+        rows (np.ndarray): The structured array, see `EVENT_DTYPE`.
+    """
+
+    def __init__(
+        self,
+        events: list[dict],
+        ids: list[str],
+        calendars: list[str],
+        rows: np.ndarray,
+    ):
+        self.events = events
+        self.ids = ids
+        self.calendars = calendars
+        self.rows = rows
+        self._index = None
+
+    @classmethod
+    def from_events(cls, events: Iterable[dict]) -> "EventTable":
+        """
+        Parses the times of `events` into a table.
+        """
+        events = list(events)
+        rows = np.empty(len(events), dtype=EVENT_DTYPE)
+        calendars, calendar_index = [], {}
+        for i, event in enumerate(events):
+            start = parse_time(event["start"])
+            end = parse_time(event["end"], start.tzinfo)
+            calendar_id = event.get("calendar_id", "")
+            index = calendar_index.get(calendar_id)
+            if index is None:
+                index = calendar_index[calendar_id] = len(calendars)
+                calendars.append(calendar_id)
+            rows[i] = (
+                int(start.timestamp()),
+                int(end.timestamp()),
+                int(start.utcoffset().total_seconds()),
+                index,
+                "T" not in event["start"],
+            )
+        return cls(events, [event["id"] for event in events], calendars, rows)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    @property
+    def start(self) -> np.ndarray:
+        return self.rows["start"]
+
+    @property
+    def end(self) -> np.ndarray:
+        return self.rows["end"]
+
+    @property
+    def offset(self) -> np.ndarray:
+        return self.rows["offset"]
+
+    @property
+    def all_day(self) -> np.ndarray:
+        return self.rows["all_day"]
+
+    @property
+    def day(self) -> np.ndarray:
+        """
+        The local day of each event's start, in days since the epoch.
+        """
+        return (self.start + self.offset) // SECONDS_PER_DAY
+
+    @property
+    def day_end(self) -> np.ndarray:
+        """
+        The epoch seconds of the local midnight ending each event's day.
+        """
+        return (self.day + 1) * SECONDS_PER_DAY - self.offset
+
+    def index(self, event_id: str) -> Optional[int]:
+        """
+        Returns the row of the event with ID `event_id`, or None.
+        """
+        if self._index is None:
+            self._index = {event_id: i for i, event_id in enumerate(self.ids)}
+        return self._index.get(event_id)
+
+    def take(self, indices: np.ndarray) -> "EventTable":
+        """
+        Returns the table of the events at `indices`, in that order.
+        """
+        indices = np.asarray(indices, dtype=np.intp)
+        return EventTable(
+            [self.events[i] for i in indices],
+            [self.ids[i] for i in indices],
+            self.calendars,
+            self.rows[indices],
+        )
+
+    def split_by_day(self) -> dict[str, "EventList"]:
+        """
+        Groups the events by the local day of their start.
+
+        Returns:
+            dict[str, EventList]: The events per day, keyed by YYYY-MM-DD,
+                in order of first appearance, each with its own table.
+        """
+        unique, first, inverse = np.unique(
+            self.day, return_index=True, return_inverse=True
+        )
+        order = np.argsort(inverse, kind="stable")
+        groups = np.split(order, np.cumsum(np.bincount(inverse))[:-1])
+        output = {}
+        for position in np.argsort(first, kind="stable"):
+            indices = groups[position]
+            day = datetime.fromtimestamp(
+                int(unique[position]) * SECONDS_PER_DAY, timezone.utc
+            ).date()
+            output[day.isoformat()] = EventList.from_table(self.take(indices))
+        return output
+
+
+class EventList(list):
+    """
+    A list of event dicts that carries their `EventTable`.
+
+    Attributes:
+        table (EventTable): The parsed times of the events.
+    """
+
+    def __init__(self, events: Iterable[dict] = ()):
+        super().__init__(events)
+        self.table = EventTable.from_events(self)
+
+    @classmethod
+    def from_table(cls, table: EventTable) -> "EventList":
+        events = cls.__new__(cls)
+        list.__init__(events, table.events)
+        events.table = table
+        return events
+
+
+def table_of(events: list[dict]) -> EventTable:
+    """
+    Returns the table of `events`, building it unless `events` is an
+    `EventList` whose table is current.
+    """
+    table = getattr(events, "table", None)
+    if table is not None and len(table) == len(events):
+        return table
+    return EventTable.from_events(events)
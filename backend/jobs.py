@@ -0,0 +1,367 @@
+"""
+Background jobs for long-running optimizations.
+
+Optimizing a calendar holds a request open for the whole LLM call and
+write-back. In job mode, the request only records a job and returns its ID.
+A bounded pool of workers runs the jobs, and clients poll the job or
+subscribe to its updates as server-sent events.
+
+Jobs are kept in a SQLite database (`JobStore`), so their state survives a
+restart of the worker process. Several processes may share one database:
+a job is claimed atomically before it runs, and the process running it
+renews a lease on it while it runs. A running job whose lease has expired
+belonged to a process that stopped, and is queued again. Running a job
+again optimizes the calendar as the first run left it, and writes back by
+event ID: moved events are updated in place, and events created by
+`calapi.update_or_create_event` get an ID derived from the event, so a
+second insert of the same event updates it rather than duplicating it.
+"""
+
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+import uuid
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional
+
+from sqlite_store import SQLiteStore
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+FINISHED = (SUCCEEDED, FAILED)
+
+
+class JobQueueFull(Exception):
+    """
+    Raised when a job is submitted while too many jobs are waiting.
+    """
+
+
+class JobStore(SQLiteStore):
+    """
+    Job state stored in a SQLite database.
+
+    A job row holds its payload, status, latest progress and outcome. The
+    `heartbeat` of a running job is its lease: the time the process running
+    it last renewed it.
+
+    Attributes:
+        path (str): The path of the database file.
+    """
+
+    SCHEMA = (
+        """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            status TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            progress TEXT,
+            result TEXT,
+            error TEXT,
+            created REAL NOT NULL,
+            updated REAL NOT NULL,
+            heartbeat REAL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created)",
+    )
+    ROW_FACTORY = sqlite3.Row
+
+    def __init__(self, path: str = "jobs.sqlite3"):
+        super().__init__(path)
+
+    def create(self, user_id: str, kind: str, payload: dict) -> dict:
+        """
+        Records a new queued job.
+
+        Args:
+            user_id (str): The user the job belongs to.
+            kind (str): What the job does, e.g. "process_calendar_events".
+            payload (dict): The arguments of the job.
+
+        Returns:
+            dict: The job.
+        """
+        now = time.time()
+        job_id = uuid.uuid4().hex
+        self._connection().execute(
+            "INSERT INTO jobs (id, user_id, kind, status, payload, created, updated) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (job_id, user_id, kind, QUEUED, json.dumps(payload), now, now),
+        )
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        """
+        Returns the job with ID `job_id`, or None if there is none.
+        """
+        row = (
+            self._connection()
+            .execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+            .fetchone()
+        )
+        if row is None:
+            return None
+        job = dict(row)
+        for field in ("payload", "progress", "result"):
+            if job[field] is not None:
+                job[field] = json.loads(job[field])
+        return job
+
+    def claim(self, job_id: str) -> bool:
+        """
+        Marks a queued job as running.
+
+        Returns:
+            bool: Whether the job was claimed. False if another worker
+                claimed it first or it is not queued.
+        """
+        now = time.time()
+        cursor = self._connection().execute(
+            "UPDATE jobs SET status = ?, updated = ?, heartbeat = ? "
+            "WHERE id = ? AND status = ?",
+            (RUNNING, now, now, job_id, QUEUED),
+        )
+        return cursor.rowcount == 1
+
+    def renew(self, job_ids: list[str]):
+        """
+        Renews the lease on running jobs.
+        """
+        self._connection().executemany(
+            "UPDATE jobs SET heartbeat = ? WHERE id = ? AND status = ?",
+            [(time.time(), job_id, RUNNING) for job_id in job_ids],
+        )
+
+    def update(self, job_id: str, **fields: Any):
+        """
+        Updates the `status`, `progress`, `result` or `error` of a job.
+        """
+        for field in ("progress", "result"):
+            if field in fields:
+                fields[field] = json.dumps(fields[field])
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        self._connection().execute(
+            f"UPDATE jobs SET {columns}, updated = ? WHERE id = ?",
+            (*fields.values(), time.time(), job_id),
+        )
+
+    def count(self, status: str) -> int:
+        """
+        Returns the number of jobs with the given status.
+        """
+        return (
+            self._connection()
+            .execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (status,))
+            .fetchone()[0]
+        )
+
+    def queued(self) -> list[str]:
+        """
+        Returns the IDs of the queued jobs, oldest first.
+        """
+        rows = self._connection().execute(
+            "SELECT id FROM jobs WHERE status = ? ORDER BY created", (QUEUED,)
+        )
+        return [row[0] for row in rows]
+
+    def requeue_expired(self, lease: float) -> list[str]:
+        """
+        Queues the running jobs whose lease expired more than `lease` seconds
+        ago again.
+
+        Returns:
+            list[str]: The IDs of the jobs queued again.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            rows = conn.execute(
+                "SELECT id FROM jobs WHERE status = ? AND heartbeat < ?",
+                (RUNNING, now - lease),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE jobs SET status = ?, updated = ? WHERE id = ?",
+                [(QUEUED, now, row[0]) for row in rows],
+            )
+        return [row[0] for row in rows]
+
+    def purge(self, older_than: float):
+        """
+        Deletes the finished jobs last updated more than `older_than`
+        seconds ago.
+        """
+        self._connection().execute(
+            "DELETE FROM jobs WHERE status IN (?, ?) AND updated < ?",
+            (*FINISHED, time.time() - older_than),
+        )
+
+
+class JobQueue:
+    """
+    Runs stored jobs on a bounded pool of asyncio workers.
+
+    Attributes:
+        store (JobStore): Where job state is kept.
+        workers (int): The number of jobs run at the same time.
+        max_queued (int): The number of waiting jobs above which `submit`
+            refuses new jobs.
+        retention (float): Seconds finished jobs are kept.
+        lease (float): Seconds without renewal after which a running job is
+            considered abandoned.
+    """
+
+    def __init__(
+        self,
+        store: JobStore,
+        handler: Callable[[dict, Callable[[dict], None]], Awaitable[Any]],
+        workers: int = 2,
+        max_queued: int = 100,
+        retention: float = 24 * 3600.0,
+        lease: float = 60.0,
+    ):
+        """
+        Initializes the queue.
+
+        Args:
+            store (JobStore): Where job state is kept.
+            handler (Callable): Runs a job. Called with the job and a
+                function that records its progress, and returns the
+                JSON-serializable result.
+            workers (int): The number of jobs run at the same time.
+            max_queued (int): The maximum number of waiting jobs.
+            retention (float): Seconds finished jobs are kept.
+            lease (float): Seconds without renewal after which a running job
+                is considered abandoned.
+        """
+        self.store = store
+        self.workers = workers
+        self.max_queued = max_queued
+        self.retention = retention
+        self.lease = lease
+        self._handler = handler
+        self._running: set[str] = set()
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: list[asyncio.Task] = []
+        self._watchers: dict[str, set[asyncio.Event]] = {}
+
+    def start(self):
+        """
+        Starts the workers and queues the stored jobs that have not finished.
+        Does nothing if the workers are already running.
+        """
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue()
+        self.store.purge(self.retention)
+        for job_id in self.store.queued():
+            self._queue.put_nowait(job_id)
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._maintain()))
+
+    async def stop(self):
+        """
+        Cancels the workers. Jobs they were running stay marked as running
+        and are queued again once their lease expires.
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, user_id: str, kind: str, payload: dict) -> dict:
+        """
+        Records a job and queues it.
+
+        Returns:
+            dict: The job.
+
+        Raises:
+            JobQueueFull: If `max_queued` jobs are already waiting.
+        """
+        self.start()
+        if self.store.count(QUEUED) >= self.max_queued:
+            raise JobQueueFull(f"{self.max_queued} jobs are already waiting")
+        job = self.store.create(user_id, kind, payload)
+        self._queue.put_nowait(job["id"])
+        return job
+
+    async def watch(self, job_id: str, heartbeat: float = 15.0) -> AsyncIterator:
+        """
+        Yields the job whenever it changes, until it has finished.
+
+        Yields None after `heartbeat` seconds without a change, so callers can
+        keep their connection alive. The store is read again at that point,
+        which also picks up changes made by other processes.
+        """
+        changed = asyncio.Event()
+        self._watchers.setdefault(job_id, set()).add(changed)
+        try:
+            last_update = None
+            while True:
+                changed.clear()
+                job = self.store.get(job_id)
+                if job is None:
+                    return
+                if job["updated"] != last_update:
+                    last_update = job["updated"]
+                    yield job
+                    if job["status"] in FINISHED:
+                        return
+                try:
+                    await asyncio.wait_for(changed.wait(), timeout=heartbeat)
+                except asyncio.TimeoutError:
+                    yield None
+        finally:
+            watchers = self._watchers.get(job_id)
+            if watchers is not None:
+                watchers.discard(changed)
+                if not watchers:
+                    del self._watchers[job_id]
+
+    def _notify(self, job_id: str):
+        for changed in self._watchers.get(job_id, ()):
+            changed.set()
+
+    def _update(self, job_id: str, **fields: Any):
+        self.store.update(job_id, **fields)
+        self._notify(job_id)
+
+    async def _maintain(self):
+        # Renews the lease on this process's jobs and takes over the jobs of
+        # processes that stopped.
+        while True:
+            self.store.renew(list(self._running))
+            for job_id in self.store.requeue_expired(self.lease):
+                logger.warning("Requeueing abandoned job %s", job_id)
+                self._queue.put_nowait(job_id)
+            await asyncio.sleep(self.lease / 3)
+
+    async def _work(self):
+        while True:
+            job_id = await self._queue.get()
+            if not self.store.claim(job_id):
+                continue
+            self._running.add(job_id)
+            self._notify(job_id)
+            job = self.store.get(job_id)
+            try:
+                result = await self._handler(
+                    job, lambda progress: self._update(job_id, progress=progress)
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                logger.exception("Job %s failed", job_id)
+                detail = getattr(exc, "detail", None) or str(exc)
+                self._update(job_id, status=FAILED, error=str(detail))
+            else:
+                self._update(job_id, status=SUCCEEDED, result=result)
+            finally:
+                self._running.discard(job_id)
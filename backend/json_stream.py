@@ -0,0 +1,115 @@
+"""
+Incremental parsing of the `events` array in streamed LLM output.
+
+The LLM answers with a JSON object of the form `{"events": [{...}, ...]}`,
+possibly surrounded by prose. `EventStreamParser` is fed the text as it is
+generated and returns each element of the `events` array as soon as its
+closing brace arrives, so downstream work can start before generation ends.
+
+Only the bytes of the element currently being generated are buffered, and
+each character is scanned once, so parsing a response is linear in its
+length regardless of how it is chunked.
+"""
+
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class EventStreamParser:
+    """
+    Extracts the elements of a JSON array from a stream of text chunks.
+
+    Attributes:
+        key (str): The name of the array to extract.
+        done (bool): Whether the closing bracket of the array has been seen.
+    """
+
+    def __init__(self, key: str = "events"):
+        self.key = key
+        self.done = False
+        self._marker = f'"{key}"'
+        self._buffer = ""
+        self._pos = 0
+        self._in_array = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._start = None
+
+    def feed(self, chunk: str) -> list[dict]:
+        """
+        Consumes the next chunk of text.
+
+        Args:
+            chunk (str): The next piece of the generated text.
+
+        Returns:
+            list[dict]: The array elements completed by this chunk. Elements
+                that are not valid JSON objects are logged and skipped.
+        """
+        if self.done:
+            return []
+        self._buffer += chunk
+
+        if not self._in_array:
+            key_index = self._buffer.find(self._marker)
+            if key_index < 0:
+                # Keep enough of the tail to match a key split across chunks.
+                self._buffer = self._buffer[-len(self._marker) :]
+                return []
+            bracket = self._buffer.find("[", key_index + len(self._marker))
+            if bracket < 0:
+                return []
+            self._buffer = self._buffer[bracket + 1 :]
+            self._pos = 0
+            self._in_array = True
+
+        buffer = self._buffer
+        raw_items = []
+        i = self._pos
+        while i < len(buffer):
+            char = buffer[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                if self._depth == 0:
+                    self._start = i
+                self._depth += 1
+            elif char in "}]":
+                if self._depth == 0:
+                    # The closing bracket of the array itself.
+                    self.done = True
+                    break
+                self._depth -= 1
+                if self._depth == 0:
+                    raw_items.append(buffer[self._start : i + 1])
+                    self._start = None
+            i += 1
+
+        if self._start is None:
+            self._buffer = ""
+            self._pos = 0
+        else:
+            self._buffer = buffer[self._start :]
+            self._pos = i - self._start
+            self._start = 0
+
+        items = []
+        for raw in raw_items:
+            try:
+                item = json.loads(raw)
+            except json.JSONDecodeError:
+                logger.warning("Skipping malformed array element: %s", raw[:200])
+                continue
+            if isinstance(item, dict):
+                items.append(item)
+        return items
@@ -0,0 +1,255 @@
+"""
+Latency instrumentation for the Divine Calendar API.
+
+The module keeps Prometheus-style histograms in process memory and exposes
+them in the Prometheus text exposition format through `render_prometheus`.
+
+Code paths are instrumented with the `timed` context manager:
+
+    with timed("calendar_fetch"):
+        events = extract_calendar_events(...)
+
+Each timed block is observed in the `divine_stage_duration_seconds`
+histogram under its stage label. When it runs inside a request handled by
+`ServerTimingMiddleware`, the duration is also reported back to the client
+in the `Server-Timing` response header, so a slow request can be broken
+down from the browser's network panel.
+
+The histograms are per process. When running several uvicorn workers, each
+worker exposes its own series and they should be aggregated by the scraper.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    float("inf"),
+)
+
+
+class Histogram:
+    """
+    A thread-safe cumulative histogram with labels.
+
+    Attributes:
+        name (str): The metric name.
+        documentation (str): The help text of the metric.
+        labelnames (tuple[str, ...]): The names of the labels.
+        buckets (tuple[float, ...]): The upper bounds of the buckets.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple = (),
+        buckets: tuple = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, value: float, *labelvalues: str):
+        """
+        Records one observation.
+
+        Args:
+            value (float): The observed value.
+            *labelvalues (str): The label values, in `labelnames` order.
+        """
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = {
+                    "counts": [0] * len(self.buckets),
+                    "sum": 0.0,
+                    "count": 0,
+                }
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["counts"][i] += 1
+                    break
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self) -> str:
+        """
+        Renders the histogram in the Prometheus text exposition format.
+        """
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self._lock:
+            series = {
+                key: dict(value, counts=list(value["counts"]))
+                for key, value in self._series.items()
+            }
+
+        for labelvalues, data in sorted(series.items()):
+            labels = [
+                f'{k}="{_escape(v)}"' for k, v in zip(self.labelnames, labelvalues)
+            ]
+            cumulative = 0
+            for bound, count in zip(self.buckets, data["counts"]):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                bucket_labels = ",".join(labels + [f'le="{le}"'])
+                lines.append(f"{self.name}_bucket{{{bucket_labels}}} {cumulative}")
+            suffix = "{" + ",".join(labels) + "}" if labels else ""
+            lines.append(f"{self.name}_sum{suffix} {data['sum']}")
+            lines.append(f"{self.name}_count{suffix} {data['count']}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+STAGE_LATENCY = Histogram(
+    "divine_stage_duration_seconds",
+    "Time spent in each stage of request processing.",
+    labelnames=("stage",),
+)
+REQUEST_LATENCY = Histogram(
+    "divine_request_duration_seconds",
+    "Total time spent handling an HTTP request.",
+    labelnames=("method", "path", "status"),
+)
+REGISTRY = [STAGE_LATENCY, REQUEST_LATENCY]
+
+# The stage timings of the request being handled, if any.
+_request_timings: ContextVar[Optional[list]] = ContextVar(
+    "request_timings", default=None
+)
+
+
+def observe_stage(stage: str, elapsed: float):
+    """
+    Records `elapsed` seconds spent in `stage`.
+
+    Use this instead of `timed` when a stage's time is accumulated across
+    interleaved work, e.g. parsing a streamed response chunk by chunk.
+
+    Args:
+        stage (str): The name of the stage.
+        elapsed (float): The time spent, in seconds.
+    """
+    STAGE_LATENCY.observe(elapsed, stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((stage, elapsed))
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    """
+    Times the enclosed block as `stage`.
+
+    The duration is recorded in `STAGE_LATENCY` and, inside a request, added
+    to the request's `Server-Timing` header. The block is recorded even if it
+    raises.
+
+    Args:
+        stage (str): The name of the stage, e.g. "llm_call".
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+
+def render_prometheus() -> str:
+    """
+    Renders all registered metrics in the Prometheus text exposition format.
+    """
+    return "".join(metric.render() for metric in REGISTRY)
+
+
+def server_timing_header(timings: list, total: float) -> str:
+    """
+    Formats stage timings as a `Server-Timing` header value.
+
+    Repeated stages are summed, and stages are listed in the order they first
+    ran, followed by the total.
+
+    Args:
+        timings (list): `(stage, seconds)` pairs.
+        total (float): The total request duration in seconds.
+
+    Returns:
+        str: The header value, e.g. "auth;dur=1.2, total;dur=5.0".
+    """
+    durations = {}
+    for stage, elapsed in timings:
+        durations[stage] = durations.get(stage, 0.0) + elapsed
+    entries = [
+        f"{stage};dur={elapsed * 1000:.1f}" for stage, elapsed in durations.items()
+    ]
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
+
+
+class ServerTimingMiddleware:
+    """
+    ASGI middleware that collects the stage timings of each HTTP request,
+    records the request duration in `REQUEST_LATENCY` and returns the timings
+    in a `Server-Timing` header.
+
+    Only stages that finished before the response headers are sent are
+    included in the header, so streamed responses report the time to first
+    byte.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = []
+        token = _request_timings.set(timings)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                header = server_timing_header(timings, time.perf_counter() - start)
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"server-timing", header.encode("latin-1"))
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_timings.reset(token)
+            # Label by route template rather than raw path to bound cardinality.
+            path = getattr(scope.get("route"), "path", "unmatched")
+            REQUEST_LATENCY.observe(
+                time.perf_counter() - start, scope["method"], path, str(status)
+            )
@@ -0,0 +1,255 @@
+"""
+Process-wide registry of local LLaMA models.
+
+`AICalendarProcessor` and `RAGAgent` both run Meta-Llama-3.1-8B-Instruct.
+Loading it separately for each, with a 64k-token context, held two copies of
+the weights and two full-size KV caches. The registry loads each model file
+once and hands out a `SharedLlama`, which both components borrow.
+
+`llama_cpp.Llama` is not thread-safe, so a borrower holds the model's lock
+until it is done generating. The context is sized to what borrowers
+actually need: the model is loaded with `min_context` tokens, and `fit`
+reloads it with a larger context, rounded up to a power of two, when a
+prompt and its output would not fit. The context never shrinks, so the
+reloads stop once the largest prompt has been seen.
+
+Tokenizing only reads the model's vocabulary, which generation never
+changes, so `tokenize` takes a lock of its own that only a reload waits
+for. Counting tokens, e.g. for llama_index's prompt helper, does not wait
+behind a generation.
+
+`llama_cpp` is imported when a model is first loaded.
+"""
+
+import fnmatch
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Any, Callable, Iterator, Optional
+from urllib.parse import urlparse
+
+from metrics import timed
+
+if TYPE_CHECKING:
+    from llama_cpp import Llama
+
+logger = logging.getLogger(__name__)
+
+# Tokens added by the chat template around the messages.
+TEMPLATE_TOKENS = 64
+
+
+def context_size(tokens: int, minimum: int, maximum: int) -> int:
+    """
+    Returns the smallest power of two of at least `tokens` and `minimum`,
+    capped at `maximum`.
+    """
+    size = minimum
+    while size < tokens:
+        size *= 2
+    return min(size, maximum)
+
+
+def parse_model_url(url: str) -> tuple[str, str]:
+    """
+    Splits a Hugging Face download URL into its repository and file name.
+
+    Args:
+        url (str): A URL of the form
+            `https://huggingface.co/<repo_id>/resolve/<revision>/<filename>`.
+
+    Returns:
+        tuple[str, str]: The repository ID and the file name.
+
+    Raises:
+        ValueError: If `url` is not a Hugging Face download URL.
+    """
+    parsed = urlparse(url)
+    parts = parsed.path.strip("/").split("/")
+    if parsed.netloc != "huggingface.co" or len(parts) < 5 or parts[2] != "resolve":
+        raise ValueError(f"Not a Hugging Face download URL: {url}")
+    return "/".join(parts[:2]), "/".join(parts[4:])
+
+
+class SharedLlama:
+    """
+    A LLaMA model shared by the components of the process.
+
+    Attributes:
+        repo_id (Optional[str]): The Hugging Face repository of the model.
+        filename (Optional[str]): The model file loaded.
+        n_ctx (int): The context size the model is currently loaded with.
+        max_context (int): The largest context `fit` loads the model with.
+    """
+
+    def __init__(
+        self,
+        llama: Any,
+        loader: Optional[Callable[[int], "Llama"]] = None,
+        max_context: int = 65536,
+        repo_id: Optional[str] = None,
+    ):
+        """
+        Initializes the handle.
+
+        Args:
+            llama: The loaded model.
+            loader (Optional[Callable[[int], Llama]]): Loads the model again
+                with a given context size. Without it, the context is fixed.
+            max_context (int): The largest context to load the model with.
+            repo_id (Optional[str]): The Hugging Face repository of the model.
+        """
+        self.llama = llama
+        self.repo_id = repo_id
+        self.max_context = max_context
+        self._loader = loader
+        self._lock = threading.RLock()
+        # Held by `tokenize` and while the model is swapped by a reload.
+        self._vocab_lock = threading.Lock()
+        self._derived = {}
+
+    @classmethod
+    def wrap(cls, llama: Any) -> "SharedLlama":
+        """
+        Wraps an already loaded model, e.g. one passed in by a caller or a
+        test double. Its context is never resized.
+        """
+        return cls(llama)
+
+    @property
+    def filename(self) -> Optional[str]:
+        path = getattr(self.llama, "model_path", None)
+        return os.path.basename(path) if path else None
+
+    @property
+    def n_ctx(self) -> int:
+        return self.llama.n_ctx() if hasattr(self.llama, "n_ctx") else 0
+
+    @contextmanager
+    def borrow(self) -> Iterator[Any]:
+        """
+        Holds the model for the calling thread. Yields the model.
+
+        The lock is reentrant, so a borrower may call `fit`, `tokenize` and
+        `derived`.
+        """
+        with self._lock:
+            yield self.llama
+
+    def fit(self, text: str, max_tokens: int) -> Any:
+        """
+        Returns the model with a context large enough for `text` and
+        `max_tokens` generated tokens, loading it again with a larger context
+        if needed. Call it while borrowing, and use the returned model.
+        """
+        with self._lock:
+            if self._loader is None:
+                return self.llama
+            needed = len(self.tokenize(text)) + max_tokens + TEMPLATE_TOKENS
+            if needed > self.n_ctx and self.n_ctx < self.max_context:
+                size = context_size(needed, self.n_ctx, self.max_context)
+                logger.info(
+                    "Reloading %s with a %d-token context (%d needed)",
+                    self.filename,
+                    size,
+                    needed,
+                )
+                self._reload(size)
+            return self.llama
+
+    def tokenize(self, text: str) -> list[int]:
+        """
+        Tokenizes `text` with the model's vocabulary. Does not wait for
+        borrowers, only for a reload.
+        """
+        with self._vocab_lock:
+            return self.llama.tokenize(text.encode("utf-8"), add_bos=False)
+
+    def derived(self, key: str, build: Callable[[Any], Any]) -> Any:
+        """
+        Returns `build(model)`, computed once per loaded model, e.g. tokenizer
+        data for constrained decoding. Cleared when the model is reloaded, so
+        it never keeps an old model alive.
+        """
+        with self._lock:
+            if key not in self._derived:
+                self._derived[key] = build(self.llama)
+            return self._derived[key]
+
+    def _reload(self, n_ctx: int):
+        with self._vocab_lock:
+            old, self.llama = self.llama, None
+            self._derived.clear()
+            close = getattr(old, "close", None)
+            if close is not None:
+                close()
+            del old
+            with timed("model_load"):
+                self.llama = self._loader(n_ctx)
+
+
+class ModelRegistry:
+    """
+    Loads each model file once per process.
+
+    Attributes:
+        min_context (int): The context size models are first loaded with.
+        max_context (int): The largest context a model is loaded with.
+        n_gpu_layers (int): The layers offloaded to the GPU, -1 for all.
+    """
+
+    def __init__(
+        self, min_context: int = 4096, max_context: int = 65536, n_gpu_layers: int = -1
+    ):
+        self.min_context = min_context
+        self.max_context = max_context
+        self.n_gpu_layers = n_gpu_layers
+        self._models: list[SharedLlama] = []
+        self._lock = threading.Lock()
+
+    def get(self, repo_id: str, filename: str) -> SharedLlama:
+        """
+        Returns the model stored as `filename` in the Hugging Face repository
+        `repo_id`, loading it if no component has yet.
+
+        Args:
+            repo_id (str): The repository, e.g.
+                "lmstudio-community/Meta-Llama-3.1-8B-Instruct-GGUF".
+            filename (str): The file name, or a glob such as "*Q8_0.gguf".
+                A glob matches a model that is already loaded from the same
+                repository.
+
+        Returns:
+            SharedLlama: The shared model.
+        """
+        with self._lock:
+            for model in self._models:
+                if model.repo_id == repo_id and fnmatch.fnmatch(
+                    model.filename or "", filename
+                ):
+                    return model
+
+            def load(n_ctx: int) -> "Llama":
+                from llama_cpp import Llama
+
+                return Llama.from_pretrained(
+                    repo_id=repo_id,
+                    filename=filename,
+                    n_ctx=n_ctx,
+                    n_gpu_layers=self.n_gpu_layers,
+                    verbose=True,
+                )
+
+            with timed("model_load"):
+                llama = load(self.min_context)
+            model = SharedLlama(
+                llama, loader=load, max_context=self.max_context, repo_id=repo_id
+            )
+            self._models.append(model)
+            logger.info("Loaded %s from %s", model.filename, repo_id)
+            return model
+
+
+# The registry of the process.
+MODELS = ModelRegistry()
@@ -0,0 +1,237 @@
+"""
+Int8-quantized embeddings on ONNX Runtime for `RAGAgent`.
+
+`HuggingFaceEmbedding` runs BAAI/bge-small-en-v1.5 in full precision on
+PyTorch, which is slow on our CPU-only hosts for both index builds and
+per-query embeddings. `OnnxEmbedding` runs an int8-quantized ONNX export of
+the same model, by default the one published as
+`Xenova/bge-small-en-v1.5`, with the model's `tokenizer.json`. It
+reproduces what `HuggingFaceEmbedding` computes for the model: the query
+instruction is prepended to queries, the [CLS] hidden state is the
+embedding, and embeddings are L2-normalized.
+
+Batches are formed dynamically:
+
+* texts embedded together, e.g. the nodes of an index build, are sorted by
+  token count and cut into batches of at most `max_batch_tokens` padded
+  tokens, so short texts are not padded to the length of long ones;
+* queries are embedded by a worker thread, which takes every query waiting
+  at once. Queries from concurrent requests that arrive while a batch runs
+  are embedded together in the next one. `query_batch_wait` makes it wait
+  for more queries before each batch.
+
+ONNX Runtime uses one thread per CPU available to the process for each
+operator, and runs operators one at a time, which suits batch-of-one
+queries and large batches alike. `intra_op_threads` overrides it.
+
+`onnxruntime`, `tokenizers` and `huggingface_hub` are imported when the
+model is loaded. `onnxruntime` is not part of the environment; install it to
+use this backend. `benchmarks.run --suite embed` compares the speed and
+retrieval agreement of both backends.
+"""
+
+import asyncio
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Optional
+
+import numpy as np
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+
+from metrics import timed
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REPO = "Xenova/bge-small-en-v1.5"
+DEFAULT_FILE = "onnx/model_quantized.onnx"
+# The instruction `HuggingFaceEmbedding` prepends to queries for the English
+# BGE models.
+BGE_QUERY_INSTRUCTION = "Represent this question for searching relevant passages: "
+
+
+def available_cpus() -> int:
+    """
+    Returns the number of CPUs the process may run on.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def token_batches(
+    lengths: list[int], max_batch_tokens: int, max_batch_size: int
+) -> list[list[int]]:
+    """
+    Groups texts into batches of similar length.
+
+    Args:
+        lengths (list[int]): The token count of each text.
+        max_batch_tokens (int): The most tokens a batch may hold once padded
+            to its longest text. A longer text gets a batch of its own.
+        max_batch_size (int): The most texts in a batch.
+
+    Returns:
+        list[list[int]]: The indices of the texts in each batch.
+    """
+    batches, batch, longest = [], [], 0
+    for i in sorted(range(len(lengths)), key=lengths.__getitem__):
+        longest_with = max(longest, lengths[i])
+        if batch and (
+            len(batch) == max_batch_size
+            or longest_with * (len(batch) + 1) > max_batch_tokens
+        ):
+            batches.append(batch)
+            batch, longest_with = [], lengths[i]
+        batch.append(i)
+        longest = longest_with
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+class OnnxEmbedding(BaseEmbedding):
+    """
+    A llama_index embedding model running a quantized ONNX export.
+
+    Attributes:
+        repo_id (str): The Hugging Face repository of the export.
+        filename (str): The ONNX file in the repository.
+        query_instruction (str): Prepended to queries.
+        max_length (int): The tokens per text, longer texts are truncated.
+        max_batch_tokens (int): The most padded tokens per batch.
+        query_batch_wait (float): Seconds the first query of a batch waits
+            for others to be embedded with it.
+        intra_op_threads (int): The threads per operator, 0 for one per
+            available CPU.
+    """
+
+    repo_id: str = DEFAULT_REPO
+    filename: str = DEFAULT_FILE
+    query_instruction: str = BGE_QUERY_INSTRUCTION
+    max_length: int = 512
+    max_batch_tokens: int = 8192
+    query_batch_wait: float = 0.0
+    intra_op_threads: int = 0
+    _session: Any = PrivateAttr()
+    _tokenizer: Any = PrivateAttr()
+    _inputs: list[str] = PrivateAttr()
+    _queries: "queue.Queue[tuple[str, Future]]" = PrivateAttr()
+    _worker: Optional[threading.Thread] = PrivateAttr(default=None)
+    _worker_lock: threading.Lock = PrivateAttr()
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault("model_name", "BAAI/bge-small-en-v1.5")
+        # llama_index hands over this many texts at a time; sorting them by
+        # length only helps if there are enough.
+        kwargs.setdefault("embed_batch_size", 256)
+        super().__init__(**kwargs)
+
+        import onnxruntime as ort
+        from huggingface_hub import hf_hub_download
+        from tokenizers import Tokenizer
+
+        with timed("model_load"):
+            options = ort.SessionOptions()
+            options.intra_op_num_threads = self.intra_op_threads or available_cpus()
+            options.inter_op_num_threads = 1
+            options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            self._session = ort.InferenceSession(
+                hf_hub_download(self.repo_id, self.filename),
+                sess_options=options,
+                providers=["CPUExecutionProvider"],
+            )
+            self._tokenizer = Tokenizer.from_file(
+                hf_hub_download(self.repo_id, "tokenizer.json")
+            )
+        self._tokenizer.enable_truncation(max_length=self.max_length)
+        self._tokenizer.no_padding()
+        self._inputs = [i.name for i in self._session.get_inputs()]
+        self._queries = queue.Queue()
+        self._worker_lock = threading.Lock()
+        logger.info(
+            "Loaded %s/%s with %d threads",
+            self.repo_id,
+            self.filename,
+            options.intra_op_num_threads,
+        )
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "OnnxEmbedding"
+
+    def _embed(self, texts: list[str]) -> list[list[float]]:
+        encodings = self._tokenizer.encode_batch(texts)
+        output = [None] * len(texts)
+        for batch in token_batches(
+            [len(e.ids) for e in encodings],
+            self.max_batch_tokens,
+            self.embed_batch_size,
+        ):
+            width = max(len(encodings[i].ids) for i in batch)
+            feed = {
+                name: np.zeros((len(batch), width), dtype=np.int64)
+                for name in self._inputs
+            }
+            for row, i in enumerate(batch):
+                ids = encodings[i].ids
+                feed["input_ids"][row, : len(ids)] = ids
+                feed["attention_mask"][row, : len(ids)] = 1
+                if "token_type_ids" in feed:
+                    feed["token_type_ids"][row, : len(ids)] = encodings[i].type_ids
+            hidden = self._session.run(None, feed)[0]
+            embeddings = hidden[:, 0]
+            embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+            for row, i in enumerate(batch):
+                output[i] = embeddings[row].tolist()
+        return output
+
+    def _submit_query(self, query: str) -> Future:
+        with self._worker_lock:
+            if self._worker is None:
+                self._worker = threading.Thread(
+                    target=self._embed_queries, name="query-embedder", daemon=True
+                )
+                self._worker.start()
+        future = Future()
+        self._queries.put((self.query_instruction + query, future))
+        return future
+
+    def _embed_queries(self):
+        while True:
+            pending = [self._queries.get()]
+            deadline = time.monotonic() + self.query_batch_wait
+            while len(pending) < self.embed_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    if remaining > 0:
+                        pending.append(self._queries.get(timeout=remaining))
+                    else:
+                        pending.append(self._queries.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                embeddings = self._embed([text for text, _ in pending])
+            except Exception as e:
+                for _, future in pending:
+                    future.set_exception(e)
+            else:
+                for (_, future), embedding in zip(pending, embeddings):
+                    future.set_result(embedding)
+
+    def _get_query_embedding(self, query: str) -> list[float]:
+        return self._submit_query(query).result()
+
+    async def _aget_query_embedding(self, query: str) -> list[float]:
+        return await asyncio.wrap_future(self._submit_query(query))
+
+    def _get_text_embedding(self, text: str) -> list[float]:
+        return self._embed([text])[0]
+
+    def _get_text_embeddings(self, texts: list[str]) -> list[list[float]]:
+        return self._embed(texts)
@@ -0,0 +1,411 @@
+"""
+Rate limiting, retries and adaptive concurrency for outbound API calls.
+
+Google Calendar and Anthropic both answer overload with 429 or 5xx
+responses. Failing the request outright loses work, and retrying right
+away makes the overload worse. Every call to those APIs goes through an
+`OutboundService`, which:
+
+* spaces calls with a token bucket, so bursts stay within the quota;
+* bounds the calls in flight with an AIMD limit that is halved when the
+  API signals overload and grows back by one per round of successes;
+* retries transient failures with exponential backoff and full jitter,
+  waiting at least as long as the API's `Retry-After` header asks.
+
+Calls that are not idempotent, such as creating an event without choosing
+its ID, are only retried when the API rejected them outright (429, 503 and
+rate-limit errors), so a retry never duplicates work the server has already
+done.
+
+The services are module-level singletons, `GOOGLE_CALENDAR` and
+`ANTHROPIC`, shared by every thread of the process. `divine.py` configures
+them from its settings. Calls block the calling thread while they wait, so
+they must run on worker threads rather than on the event loop.
+"""
+
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Iterator, NamedTuple, Optional
+
+from metrics import observe_stage
+
+logger = logging.getLogger(__name__)
+
+
+class Verdict(NamedTuple):
+    """
+    How to handle a failed call.
+
+    Attributes:
+        retry (bool): Whether the failure is transient.
+        overload (bool): Whether the API rejected the call because it is
+            overloaded or over quota. Such calls were not processed.
+        retry_after (Optional[float]): Seconds the API asked to wait.
+    """
+
+    retry: bool
+    overload: bool = False
+    retry_after: Optional[float] = None
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Parses a `Retry-After` header given in seconds or as an HTTP date.
+
+    Returns:
+        Optional[float]: The seconds to wait, or None if the header is
+            missing or malformed.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def classify_google_error(exc: Exception) -> Verdict:
+    """
+    Classifies an error raised by the Google API client.
+    """
+    from googleapiclient.errors import HttpError
+
+    if isinstance(exc, HttpError):
+        status = exc.resp.status
+        retry_after = parse_retry_after(exc.resp.get("retry-after"))
+        # Calendar reports exhausted quota as 403 with a rate limit reason.
+        if status == 429 or (
+            status == 403
+            and any(
+                detail.get("reason") in ("rateLimitExceeded", "userRateLimitExceeded")
+                for detail in getattr(exc, "error_details", None) or []
+                if isinstance(detail, dict)
+            )
+        ):
+            return Verdict(True, overload=True, retry_after=retry_after)
+        if status == 503:
+            return Verdict(True, overload=True, retry_after=retry_after)
+        return Verdict(status in (500, 502, 504), retry_after=retry_after)
+    return Verdict(isinstance(exc, (ConnectionError, TimeoutError)))
+
+
+def classify_anthropic_error(exc: Exception) -> Verdict:
+    """
+    Classifies an error raised by the Anthropic client.
+    """
+    import anthropic
+
+    if isinstance(exc, anthropic.APIStatusError):
+        status = exc.status_code
+        retry_after = parse_retry_after(exc.response.headers.get("retry-after"))
+        if status in (429, 503, 529):
+            return Verdict(True, overload=True, retry_after=retry_after)
+        return Verdict(status >= 500 or status == 408, retry_after=retry_after)
+    return Verdict(
+        isinstance(exc, (anthropic.APIConnectionError, ConnectionError, TimeoutError))
+    )
+
+
+class TokenBucket:
+    """
+    A thread-safe token bucket.
+
+    Attributes:
+        rate (float): Tokens added per second.
+        burst (float): The capacity of the bucket.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """
+        Takes a token, waiting for one if the bucket is empty.
+
+        Returns:
+            float: The seconds spent waiting.
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.burst, self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+class AdaptiveLimit:
+    """
+    A concurrency limit adjusted by additive increase, multiplicative
+    decrease (AIMD).
+
+    Each success raises the limit by 1 / limit, i.e. by about one per round
+    of calls. An overload signal halves it, at most once per `cooldown`
+    seconds so that a burst of rejections counts as one signal.
+
+    Attributes:
+        minimum (int): The lowest the limit goes.
+        maximum (int): The highest the limit goes.
+        cooldown (float): Seconds between two decreases.
+    """
+
+    def __init__(
+        self, initial: int, minimum: int = 1, maximum: int = 64, cooldown: float = 1.0
+    ):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.cooldown = cooldown
+        self._limit = float(max(minimum, min(initial, maximum)))
+        self._in_flight = 0
+        self._decreased = 0.0
+        self._condition = threading.Condition()
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    @contextmanager
+    def slot(self) -> Iterator[float]:
+        """
+        Holds one unit of concurrency, waiting for one if needed. Yields the
+        seconds spent waiting.
+        """
+        start = time.monotonic()
+        waited = False
+        with self._condition:
+            while self._in_flight >= int(self._limit):
+                waited = True
+                self._condition.wait()
+            self._in_flight += 1
+        try:
+            yield time.monotonic() - start if waited else 0.0
+        finally:
+            with self._condition:
+                self._in_flight -= 1
+                self._condition.notify()
+
+    def on_success(self):
+        with self._condition:
+            self._limit = min(self.maximum, self._limit + 1 / self._limit)
+            self._condition.notify_all()
+
+    def on_overload(self):
+        with self._condition:
+            now = time.monotonic()
+            if now - self._decreased >= self.cooldown:
+                self._limit = max(self.minimum, self._limit / 2)
+                self._decreased = now
+                logger.warning(
+                    "Overload signalled, concurrency limit now %d", self.limit
+                )
+
+
+class OutboundService:
+    """
+    The rate limit, concurrency limit and retry policy of one API.
+
+    Attributes:
+        name (str): The name of the API, used in logs and stage metrics.
+        max_attempts (int): The number of attempts per call.
+        base_delay (float): The backoff before the second attempt, in seconds.
+        max_delay (float): The longest backoff between two attempts.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        classify: Callable[[Exception], Verdict],
+        rate: float = 10.0,
+        burst: Optional[float] = None,
+        max_concurrency: int = 8,
+        max_attempts: int = 5,
+        base_delay: float = 0.5,
+        max_delay: float = 30.0,
+    ):
+        """
+        Initializes the service.
+
+        Args:
+            name (str): The name of the API.
+            classify (Callable[[Exception], Verdict]): Decides how to handle
+                an error raised by a call.
+            rate (float): The sustained calls per second.
+            burst (Optional[float]): The calls allowed at once after a quiet
+                period. Defaults to one second's worth.
+            max_concurrency (int): The highest number of calls in flight.
+            max_attempts (int): The number of attempts per call.
+            base_delay (float): The backoff before the second attempt.
+            max_delay (float): The longest backoff between two attempts.
+        """
+        self.name = name
+        self._classify = classify
+        self.configure(
+            rate=rate,
+            burst=burst,
+            max_concurrency=max_concurrency,
+            max_attempts=max_attempts,
+            base_delay=base_delay,
+            max_delay=max_delay,
+        )
+
+    def configure(
+        self,
+        rate: float,
+        burst: Optional[float] = None,
+        max_concurrency: int = 8,
+        max_attempts: int = 5,
+        base_delay: float = 0.5,
+        max_delay: float = 30.0,
+    ):
+        """
+        Replaces the limits and retry policy. Takes the same arguments as the
+        constructor.
+        """
+        self.bucket = TokenBucket(rate, burst or max(1.0, rate))
+        self.limit = AdaptiveLimit(
+            initial=max(1, max_concurrency // 2), maximum=max_concurrency
+        )
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """
+        Returns the delay before retrying after `attempt` failed attempts:
+        full jitter over an exponentially growing window, but never less than
+        `retry_after`.
+        """
+        window = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        delay = random.uniform(0, window)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+    def call(self, func: Callable[..., Any], *args, idempotent: bool = True, **kwargs):
+        """
+        Calls `func(*args, **kwargs)` within the limits, retrying transient
+        failures.
+
+        Args:
+            func (Callable[..., Any]): The call to make, e.g. the `execute`
+                method of a Google API request.
+            idempotent (bool): Whether the call may be retried after a
+                failure the server may have processed.
+
+        Returns:
+            Any: The result of `func`.
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            self._wait(self.bucket.acquire())
+            with self.limit.slot() as waited:
+                self._wait(waited)
+                try:
+                    result = func(*args, **kwargs)
+                except Exception as exc:
+                    error = exc
+                else:
+                    self.limit.on_success()
+                    return result
+            self._retry_or_raise(error, attempt, idempotent)
+
+    @contextmanager
+    def stream(self, open_stream: Callable[[], Any], idempotent: bool = True):
+        """
+        Opens a streaming response within the limits and holds a concurrency
+        slot until the stream is closed.
+
+        Only opening the stream is retried: once the caller has consumed part
+        of it, a failure is raised to the caller.
+
+        Args:
+            open_stream (Callable[[], Any]): Returns a context manager that
+                opens the stream, e.g. `client.messages.stream(...)`.
+            idempotent (bool): See `call`.
+
+        Yields:
+            The value of the entered stream.
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            self._wait(self.bucket.acquire())
+            with self.limit.slot() as waited:
+                self._wait(waited)
+                manager = open_stream()
+                try:
+                    stream = manager.__enter__()
+                except Exception as exc:
+                    error = exc
+                else:
+                    try:
+                        yield stream
+                    except BaseException as exc:
+                        if not manager.__exit__(type(exc), exc, exc.__traceback__):
+                            if isinstance(exc, Exception):
+                                self._record(exc)
+                            raise
+                    else:
+                        manager.__exit__(None, None, None)
+                        self.limit.on_success()
+                    return
+            self._retry_or_raise(error, attempt, idempotent)
+
+    def _record(self, exc: Exception) -> Verdict:
+        verdict = self._classify(exc)
+        if verdict.overload:
+            self.limit.on_overload()
+        return verdict
+
+    def _retry_or_raise(self, exc: Exception, attempt: int, idempotent: bool):
+        verdict = self._record(exc)
+        retry = verdict.retry and (idempotent or verdict.overload)
+        if not retry or attempt >= self.max_attempts:
+            raise exc
+        delay = self.backoff(attempt, verdict.retry_after)
+        logger.warning(
+            "%s call failed (%s), retrying in %.2fs (attempt %d of %d)",
+            self.name,
+            exc,
+            delay,
+            attempt + 1,
+            self.max_attempts,
+        )
+        time.sleep(delay)
+        self._wait(delay)
+
+    def _wait(self, seconds: float):
+        if seconds > 0:
+            observe_stage(f"{self.name}_wait", seconds)
+
+
+GOOGLE_CALENDAR = OutboundService(
+    "google_calendar", classify_google_error, rate=10.0, max_concurrency=8
+)
+ANTHROPIC = OutboundService(
+    "anthropic", classify_anthropic_error, rate=1.0, burst=4, max_concurrency=4
+)
@@ -0,0 +1,208 @@
+"""
+Sampling profiles of individual requests, written as flamegraph input.
+
+The stage timings of the `metrics` module show which stage of a request is
+slow, not which Python code inside it is: llama_index internals, pydantic
+schema generation or formatting events into a prompt all sit inside one
+stage. `ProfilingMiddleware` profiles selected requests and writes one
+profile per request to a local directory.
+
+A request is profiled if it carries the `X-Profile` header set to the
+configured token, or at random with the configured sample rate. While it is
+handled, a `Sampler` thread records the stack of every thread of the
+process with `sys._current_frames`, every few milliseconds. Sampling does
+not instrument the code, so the request runs at nearly its normal speed,
+and requests that are not profiled only pay for the header lookup and a
+random draw.
+
+Profiles are written in the collapsed-stack format, one line per distinct
+stack with its sample count, which `flamegraph.pl`, speedscope and
+inferno render as a flamegraph:
+
+    MainThread;Runner.run (runners.py);...;ScheduleValidator.submit (schedule_validator.py) 12
+
+Stacks are rooted at their thread's name. The work of a request runs on
+the event loop and on worker threads, so every thread is sampled, and the
+profile also shows what concurrent requests were doing. Threads waiting
+for work are left out. Samples are taken in wall-clock time, so code
+waiting on Google Calendar or the LLM weighs as much as code using the CPU.
+
+A sampler stops on its own after `max_duration` seconds, so a streamed
+response, such as the events of a job, cannot keep one running for as long
+as the client listens. Stopping the sampler and writing the profile run on
+a worker thread, off the event loop.
+"""
+
+import asyncio
+import hmac
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = b"x-profile"
+# Modules whose frames at the top of a stack mean the thread is idle.
+IDLE_FILES = ("threading.py", "selectors.py", "queue.py", "thread.py")
+
+
+def frame_label(frame) -> str:
+    """
+    Returns the label of a frame in a collapsed stack, e.g.
+    "AICalendarProcessor.predict (ai_calendar_processor.py)".
+    """
+    code = frame.f_code
+    return f"{code.co_qualname} ({os.path.basename(code.co_filename)})"
+
+
+class Sampler:
+    """
+    Samples the stacks of every thread of the process from a thread of its
+    own.
+
+    Attributes:
+        interval (float): Seconds between samples.
+        max_duration (Optional[float]): Seconds after which sampling stops
+            on its own. None samples until `stop`.
+        stacks (Counter): The number of samples of each collapsed stack.
+        samples (int): The number of samples taken.
+        truncated (bool): Whether sampling stopped after `max_duration`.
+    """
+
+    def __init__(self, interval: float = 0.005, max_duration: Optional[float] = None):
+        self.interval = interval
+        self.max_duration = max_duration
+        self.stacks = Counter()
+        self.samples = 0
+        self.truncated = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops sampling and waits for the last sample.
+        """
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        deadline = None
+        if self.max_duration is not None:
+            deadline = time.monotonic() + self.max_duration
+        while not self._stop.wait(self.interval):
+            if deadline is not None and time.monotonic() >= deadline:
+                self.truncated = True
+                break
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                if os.path.basename(frame.f_code.co_filename) in IDLE_FILES:
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(frame_label(frame))
+                    frame = frame.f_back
+                labels.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(labels))] += 1
+            self.samples += 1
+
+    def collapsed(self) -> str:
+        """
+        Returns the samples in the collapsed-stack format.
+        """
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.items())
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware that profiles selected HTTP requests with a `Sampler`.
+
+    The profile of a request is written to `directory` once its response is
+    sent, and the response names the file in its `X-Profile` header.
+
+    Attributes:
+        directory (str): Where profiles are written.
+        sample_rate (float): The fraction of requests profiled at random.
+        token (Optional[str]): The `X-Profile` header value that profiles a
+            request. None disables profiling on demand.
+        interval (float): Seconds between samples.
+        max_duration (Optional[float]): Seconds after which a request stops
+            being sampled. None samples the whole request.
+    """
+
+    def __init__(
+        self,
+        app,
+        directory: str = "request_profiles",
+        sample_rate: float = 0.0,
+        token: Optional[str] = None,
+        interval: float = 0.005,
+        max_duration: Optional[float] = 30.0,
+    ):
+        self.app = app
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.token = token.encode("latin-1") if token else None
+        self.interval = interval
+        self.max_duration = max_duration
+
+    def _selected(self, scope) -> bool:
+        if self.token is not None:
+            for name, value in scope["headers"]:
+                if name == PROFILE_HEADER:
+                    return hmac.compare_digest(value, self.token)
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def _write(self, sampler: Sampler, path: str):
+        sampler.stop()
+        os.makedirs(self.directory, exist_ok=True)
+        with open(path, "w") as f:
+            f.write(sampler.collapsed())
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._selected(scope):
+            await self.app(scope, receive, send)
+            return
+
+        name = "{}-{}-{}-{}.folded".format(
+            time.strftime("%Y%m%dT%H%M%S"),
+            scope["method"],
+            scope["path"].strip("/").replace("/", "_") or "root",
+            uuid.uuid4().hex[:8],
+        )
+        path = os.path.join(self.directory, name)
+
+        async def send_with_profile(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [
+                    (PROFILE_HEADER, name.encode("latin-1"))
+                ]
+            await send(message)
+
+        sampler = Sampler(self.interval, self.max_duration)
+        sampler.start()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_profile)
+        finally:
+            await asyncio.to_thread(self._write, sampler, path)
+            logger.info(
+                "Wrote %d samples of %s %s over %.2fs%s to %s",
+                sampler.samples,
+                scope["method"],
+                scope["path"],
+                time.perf_counter() - start,
+                f", the first {self.max_duration:g}s" if sampler.truncated else "",
+                path,
+            )
@@ -0,0 +1,188 @@
+"""
+Local expansion of recurring events.
+
+Listing events with `singleEvents=True` makes Google return every instance
+of every recurring series as a full event resource, so a daily standup
+costs one resource per day of the range, on every fetch. With
+`singleEvents=False`, the listing returns each series once instead:
+
+* the recurring event ("master"), with its RRULE, RDATE and EXDATE lines in
+  `recurrence`;
+* the instances that were changed ("exceptions"), with the master's ID in
+  `recurringEventId` and the instance's original start in
+  `originalStartTime`. Instances that were deleted are exceptions with the
+  status "cancelled", listed when `showDeleted` is set.
+
+`expand` turns a master and its exceptions into the instances of a window,
+shaped like the resources `singleEvents=True` returns, with the same IDs:
+each occurrence of the rules that has no exception, then each exception
+that is not cancelled and overlaps the window. Occurrences are computed in
+the master's time zone, so a 9am meeting stays at 9am across DST changes.
+"""
+
+import re
+from datetime import date, datetime, timezone
+from typing import Optional, Union
+from zoneinfo import ZoneInfo
+
+from dateutil.rrule import rrulestr
+
+from event_table import parse_time
+
+_UNTIL = re.compile(r"UNTIL=(\d{8})(T\d{6})?(Z?)")
+
+
+def is_series_item(item: dict) -> bool:
+    """
+    Returns whether a listed item is a recurring master or an exception.
+    """
+    return "recurrence" in item or "recurringEventId" in item
+
+
+def master_id(item: dict) -> str:
+    """
+    Returns the ID of the series an item belongs to.
+    """
+    return item.get("recurringEventId") or item["id"]
+
+
+def _start(value: dict) -> Union[datetime, date]:
+    """
+    Returns the start of an event time: a date for all-day events, else a
+    datetime in the event's time zone.
+    """
+    if "date" in value:
+        return date.fromisoformat(value["date"])
+    start = parse_time(value["dateTime"])
+    if value.get("timeZone"):
+        start = start.astimezone(ZoneInfo(value["timeZone"]))
+    return start
+
+
+def instance_id(series_id: str, original_start: Union[datetime, date]) -> str:
+    """
+    Returns the ID Google gives the instance of a series starting at
+    `original_start`.
+    """
+    if isinstance(original_start, datetime):
+        utc = original_start.astimezone(timezone.utc)
+        return f"{series_id}_{utc:%Y%m%dT%H%M%SZ}"
+    return f"{series_id}_{original_start:%Y%m%d}"
+
+
+def _normalize_until(line: str, dtstart: datetime) -> str:
+    """
+    Rewrites the UNTIL of an RRULE in the form dateutil requires: UTC for a
+    timezone-aware start, local for a naive one.
+    """
+
+    def replace(match: re.Match) -> str:
+        day, clock, utc = match.groups()
+        if dtstart.tzinfo is None:
+            return f"UNTIL={day}{clock or ''}"
+        if utc:
+            return match.group(0)
+        # A local or date-only UNTIL is inclusive, in the series' zone.
+        until = datetime.strptime(day + (clock or "T235959"), "%Y%m%dT%H%M%S")
+        until = until.replace(tzinfo=dtstart.tzinfo).astimezone(timezone.utc)
+        return f"UNTIL={until:%Y%m%dT%H%M%SZ}"
+
+    return _UNTIL.sub(replace, line) if line.startswith("RRULE") else line
+
+
+def occurrences(master: dict, after: datetime, before: datetime) -> list:
+    """
+    Returns the starts of the occurrences of a master that overlap
+    [after, before), exceptions not applied.
+
+    Returns:
+        list: Dates for an all-day series, else datetimes in the series'
+            time zone.
+    """
+    start, end = _start(master["start"]), _start(master["end"])
+    all_day = not isinstance(start, datetime)
+    if all_day:
+        # All-day events cover local days, like `event_table.parse_time`.
+        dtstart = datetime.combine(start, datetime.min.time())
+        after = after.astimezone().replace(tzinfo=None)
+        before = before.astimezone().replace(tzinfo=None)
+    else:
+        dtstart = start
+    duration = end - start
+
+    rules = rrulestr(
+        "\n".join(_normalize_until(line, dtstart) for line in master["recurrence"]),
+        dtstart=dtstart,
+        forceset=True,
+    )
+    starts = rules.between(after - duration, before, inc=True)
+    starts = [s for s in starts if s + duration > after and s < before]
+    return [s.date() for s in starts] if all_day else starts
+
+
+def _event_time(value: Union[datetime, date], zone: Optional[str]) -> dict:
+    if not isinstance(value, datetime):
+        return {"date": value.isoformat()}
+    if zone is None:
+        return {"dateTime": value.isoformat()}
+    return {"dateTime": value.isoformat(), "timeZone": zone}
+
+
+def expand(
+    master: Optional[dict], exceptions: list[dict], after: datetime, before: datetime
+) -> list[dict]:
+    """
+    Returns the instances of a series that overlap [after, before).
+
+    Args:
+        master (Optional[dict]): The recurring event. If it is unknown, only
+            the exceptions are returned.
+        exceptions (list[dict]): The changed and cancelled instances of the
+            series.
+        after (datetime): The start of the window.
+        before (datetime): The end of the window.
+
+    Returns:
+        list[dict]: The instances, as listed with `singleEvents=True`.
+    """
+    instances = []
+    overridden = {
+        instance_id(master_id(exception), _start(exception["originalStartTime"]))
+        for exception in exceptions
+    }
+    if master is not None and master.get("status") != "cancelled":
+        start, end = _start(master["start"]), _start(master["end"])
+        duration = end - start
+        zone = master["start"].get("timeZone")
+        fields = {
+            key: value
+            for key, value in master.items()
+            if key not in ("id", "recurrence", "start", "end")
+        }
+        for occurrence in occurrences(master, after, before):
+            id_ = instance_id(master["id"], occurrence)
+            if id_ in overridden:
+                continue
+            instances.append(
+                {
+                    **fields,
+                    "id": id_,
+                    "recurringEventId": master["id"],
+                    "originalStartTime": _event_time(occurrence, zone),
+                    "start": _event_time(occurrence, zone),
+                    "end": _event_time(occurrence + duration, zone),
+                }
+            )
+
+    for exception in exceptions:
+        if exception.get("status") == "cancelled":
+            continue
+        start = parse_time(
+            exception["start"].get("dateTime", exception["start"].get("date"))
+        )
+        end = parse_time(
+            exception["end"].get("dateTime", exception["end"].get("date")), start.tzinfo
+        )
+        if end > after and start < before:
+            instances.append(exception)
+    return instances
@@ -0,0 +1,416 @@
+"""
+Validation of optimized schedules before they are written to the calendar.
+
+`_create_prompt` asks the model to keep every event on its day, keep its
+duration and avoid overlaps, but nothing guarantees it does. The
+`ScheduleValidator` enforces those constraints before any network write.
+
+The original times come from the events' `EventTable`, which holds them
+as epoch seconds and is usually built once when the events are fetched.
+Per-event checks (known ID, same calendar, same day, same duration) are
+constant time, and overlaps are found by sorting intervals by start and
+sweeping them once with vectorized running maxima (`find_overlaps`), so a
+schedule of n events is checked in O(n log n).
+
+The validator works incrementally so that write-back can still overlap
+with generation. `submit` returns an event as soon as it is certain to be
+valid in the final schedule: its new slot is free of every event that is
+already written and of the original slot of every event the model has not
+returned yet. Events that conflict are deferred until `finish`, which
+releases their original slots and places them together. This handles
+swaps, where each event moves into the other's slot, without ever
+invalidating an event that was already written.
+
+In "repair" mode, durations are corrected, events that land on an occupied
+slot are moved to the next free slot of the same day, and events that
+cannot be fixed are dropped (they stay where they were). In "strict" mode
+the first violation raises `ScheduleValidationError`.
+"""
+
+import bisect
+import logging
+from datetime import timedelta, timezone
+from typing import Optional
+
+import numpy as np
+
+from event_table import SECONDS_PER_DAY, format_time, parse_time, table_of
+
+logger = logging.getLogger(__name__)
+
+
+class ScheduleValidationError(ValueError):
+    """
+    Raised when a schedule violates a constraint in strict mode.
+
+    Attributes:
+        violations (list[str]): A description of each violation.
+    """
+
+    def __init__(self, violations: list[str]):
+        super().__init__("; ".join(violations))
+        self.violations = violations
+
+
+def find_overlaps(
+    start: np.ndarray, end: np.ndarray, moved: np.ndarray
+) -> list[tuple[int, int]]:
+    """
+    Finds overlapping intervals with a sort-and-sweep.
+
+    Only overlaps involving at least one moved interval are reported, since
+    overlaps between events the user already had are not the optimizer's to
+    fix. Each interval is compared with the interval reaching furthest among
+    those starting before it, so every interval that overlaps an earlier one
+    is reported, paired with one of the intervals it overlaps. In
+    particular, no pair is reported only if no moved interval overlaps
+    anything.
+
+    Args:
+        start (np.ndarray): The starts of the intervals, in epoch seconds.
+        end (np.ndarray): The ends of the intervals.
+        moved (np.ndarray): Whether each interval was moved.
+
+    Returns:
+        list[tuple[int, int]]: `(i, j)` index pairs of overlapping intervals,
+            where interval `i` starts before interval `j` ends.
+    """
+    if len(start) == 0:
+        return []
+    order = np.lexsort((end, start))
+    start, end, moved = start[order], end[order], moved[order]
+    positions = np.arange(len(start))
+    lowest = np.iinfo(np.int64).min
+
+    def reach_before(ends: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        # The furthest end among the earlier intervals, and whose it is.
+        reach = np.maximum.accumulate(ends)
+        owner = np.maximum.accumulate(np.where(ends >= reach, positions, 0))
+        return (
+            np.concatenate(([lowest], reach[:-1])),
+            np.concatenate(([0], owner[:-1])),
+        )
+
+    reach_any, owner_any = reach_before(end)
+    reach_moved, owner_moved = reach_before(np.where(moved, end, lowest))
+    overlaps = []
+    for hits, owners in (
+        (moved & (start < reach_any), owner_any),
+        (~moved & (start < reach_moved), owner_moved),
+    ):
+        for j in np.flatnonzero(hits):
+            overlaps.append((int(order[owners[j]]), int(order[j])))
+    return overlaps
+
+
+class _Timeline:
+    """
+    Busy intervals sorted by start, with fast conflict queries.
+    """
+
+    def __init__(self, intervals: Optional[list] = None):
+        self.intervals = sorted(intervals or [])
+        self.max_duration = max((e - s for s, e, _ in self.intervals), default=0)
+
+    def copy(self) -> "_Timeline":
+        timeline = _Timeline()
+        timeline.intervals = list(self.intervals)
+        timeline.max_duration = self.max_duration
+        return timeline
+
+    def add(self, start: int, end: int, event_id: str):
+        bisect.insort(self.intervals, (start, end, event_id))
+        self.max_duration = max(self.max_duration, end - start)
+
+    def remove(self, start: int, end: int, event_id: str):
+        index = bisect.bisect_left(self.intervals, (start, end, event_id))
+        if index < len(self.intervals) and self.intervals[index] == (
+            start,
+            end,
+            event_id,
+        ):
+            del self.intervals[index]
+
+    def conflict_end(
+        self, start: int, end: int, ignore: Optional[str] = None
+    ) -> Optional[int]:
+        """
+        Returns the latest end of the intervals overlapping [start, end),
+        other than those of the event `ignore`, or None if the slot is free.
+        """
+        latest = None
+        # Only intervals starting before `end` can overlap, and none starting
+        # more than `max_duration` before `start` can reach it.
+        index = bisect.bisect_left(self.intervals, (end,))
+        while index > 0:
+            index -= 1
+            other_start, other_end, other_id = self.intervals[index]
+            if other_start < start - self.max_duration:
+                break
+            if other_end > start and other_id != ignore:
+                latest = other_end if latest is None else max(latest, other_end)
+        return latest
+
+    def place(
+        self, start: int, duration: int, limit: int, shift: bool
+    ) -> Optional[int]:
+        """
+        Returns the earliest free start at or after `start` such that the
+        interval ends by `limit`, or None. Without `shift`, only `start`
+        itself is tried.
+        """
+        while start + duration <= limit:
+            blocked_until = self.conflict_end(start, start + duration)
+            if blocked_until is None:
+                return start
+            if not shift:
+                return None
+            start = blocked_until
+        return None
+
+
+class ScheduleValidator:
+    """
+    Validates and optionally repairs the events returned by the optimizer.
+
+    Attributes:
+        mode (str): "repair" or "strict".
+        violations (list[str]): The violations found so far.
+        unchanged (list[dict]): The returned events whose time did not
+            change and that therefore need no write.
+    """
+
+    def __init__(self, original_events: list[dict], mode: str = "repair"):
+        """
+        Initializes the validator with the schedule before optimization.
+
+        Args:
+            original_events (list[dict]): The events sent to the optimizer, as
+                returned by `extract_calendar_events`. The table of an
+                `EventList` is reused.
+            mode (str): "repair" or "strict".
+        """
+        if mode not in ("repair", "strict"):
+            raise ValueError(f"Unknown validation mode: {mode}")
+        self.mode = mode
+        self.violations = []
+        self.unchanged = []
+
+        table = table_of(original_events)
+        self._table = table
+        # Plain lists index faster than NumPy arrays one element at a time.
+        self._start = table.start.tolist()
+        self._end = table.end.tolist()
+        self._offset = table.offset.tolist()
+        self._day = table.day.tolist()
+        # Events may end at their day's end, or at their original end if
+        # they already ran past it, e.g. overnight.
+        self._day_end = np.maximum(table.day_end, table.end).tolist()
+        self._all_day = table.all_day.tolist()
+        intervals = [
+            (self._start[i], self._end[i], table.ids[i])
+            for i in np.flatnonzero(~table.all_day).tolist()
+        ]
+
+        # Written events and the original slots of events not yet moved.
+        self._busy = _Timeline(intervals)
+        self._seen = set()
+        self._deferred = []
+
+    def submit(self, event: dict) -> list[dict]:
+        """
+        Checks one event returned by the optimizer.
+
+        Args:
+            event (dict): The event as generated by the model.
+
+        Returns:
+            list[dict]: The event, possibly repaired, if it can be written
+                now, or an empty list if it was deferred, dropped or did not
+                move.
+
+        Raises:
+            ScheduleValidationError: On a violation in strict mode.
+        """
+        checked = self._check_event(event)
+        if checked is None:
+            return []
+        row, start, end = checked
+        event_id = self._table.ids[row]
+
+        if start == self._start[row] and end == self._end[row]:
+            self.unchanged.append(event)
+            return []
+
+        # The original slots of other events still count as busy, so a slot
+        # that is free now stays free whatever the model returns next.
+        if self._busy.conflict_end(start, end, ignore=event_id) is not None:
+            self._deferred.append((start, end, row, event))
+            return []
+
+        self._busy.remove(self._start[row], self._end[row], event_id)
+        self._busy.add(start, end, event_id)
+        return [self._with_times(event, row, start, end)]
+
+    def finish(self) -> list[dict]:
+        """
+        Places the deferred events once the whole schedule is known.
+
+        The original slots of all deferred events are released, then the
+        events are placed in order of their proposed start. If an event
+        cannot be placed, it is dropped, its original slot is taken back and
+        the remaining events are placed again.
+
+        Returns:
+            list[dict]: The deferred events that can now be written.
+
+        Raises:
+            ScheduleValidationError: On a violation in strict mode.
+        """
+        remaining = sorted(self._deferred, key=lambda item: item[:3])
+        self._deferred = []
+        base = self._busy.copy()
+        for _, _, row, _ in remaining:
+            base.remove(self._start[row], self._end[row], self._table.ids[row])
+
+        while True:
+            timeline = base.copy()
+            placed, failed = [], []
+            for start, end, row, event in remaining:
+                new_start = timeline.place(
+                    start, end - start, self._day_end[row], shift=self.mode == "repair"
+                )
+                if new_start is None:
+                    failed.append((start, end, row, event))
+                    continue
+                new_end = new_start + end - start
+                timeline.add(new_start, new_end, self._table.ids[row])
+                placed.append((new_start, new_end, row, event))
+
+            if not failed:
+                break
+            for _, _, row, _ in failed:
+                event_id = self._table.ids[row]
+                self._violation(f"Event {event_id} overlaps another event")
+                base.add(self._start[row], self._end[row], event_id)
+            remaining = [item for item in remaining if item not in failed]
+
+        self._busy = timeline
+        return [
+            self._with_times(event, row, start, end)
+            for start, end, row, event in placed
+        ]
+
+    def validate(self, events: list[dict]) -> list[dict]:
+        """
+        Validates a complete schedule.
+
+        Args:
+            events (list[dict]): The events returned by the optimizer.
+
+        Returns:
+            list[dict]: The events to write.
+
+        Raises:
+            ScheduleValidationError: On a violation in strict mode. Nothing
+                is returned in that case, so nothing gets written.
+        """
+        output = []
+        for event in events:
+            output.extend(self.submit(event))
+        output.extend(self.finish())
+
+        rows, start, end, moved = self.final_intervals(output)
+        overlaps = find_overlaps(start, end, moved)
+        if overlaps:
+            # `finish` places events around each other, so this only happens
+            # if the invariants above are broken.
+            ids = [self._table.ids[row] for row in rows]
+            raise ScheduleValidationError(
+                [f"Events {ids[i]} and {ids[j]} overlap" for i, j in overlaps]
+            )
+        return output
+
+    def final_intervals(self, written: list[dict]) -> tuple:
+        """
+        Returns the timed intervals of the schedule after `written` is applied.
+
+        Returns:
+            tuple: The table rows of the timed events, and their `start`,
+                `end` and `moved` arrays for `find_overlaps`.
+        """
+        table = self._table
+        start, end = table.start.copy(), table.end.copy()
+        moved = np.zeros(len(table), dtype=bool)
+        for event in written:
+            row = table.index(event["id"])
+            tz = self._tz(row)
+            start[row] = parse_time(event["start"], tz).timestamp()
+            end[row] = parse_time(event["end"], tz).timestamp()
+            moved[row] = True
+        rows = np.flatnonzero(~table.all_day)
+        return rows, start[rows], end[rows], moved[rows]
+
+    def _check_event(self, event: dict) -> Optional[tuple]:
+        """
+        Applies the per-event checks, returning `(row, start, end)` with a
+        repaired end time, or None if the event is dropped.
+        """
+        event_id = event.get("id")
+        row = self._table.index(event_id) if isinstance(event_id, str) else None
+        if row is None:
+            return self._violation(f"Unknown event {event_id}")
+        if event_id in self._seen:
+            return self._violation(f"Event {event_id} was returned twice")
+        self._seen.add(event_id)
+
+        original = self._table.events[row]
+        if event.get("calendar_id") != original["calendar_id"]:
+            if self.mode == "strict":
+                return self._violation(f"Event {event_id} changed calendar")
+            event["calendar_id"] = original["calendar_id"]
+
+        if self._all_day[row]:
+            if event.get("start") != original["start"]:
+                return self._violation(f"All-day event {event_id} was moved")
+            return row, self._start[row], self._end[row]
+
+        try:
+            tz = self._tz(row)
+            start = int(parse_time(event["start"], tz).timestamp())
+            end = int(parse_time(event["end"], tz).timestamp())
+        except (KeyError, TypeError, ValueError):
+            return self._violation(f"Event {event_id} has invalid times")
+        if start == self._start[row] and end == self._end[row]:
+            return row, start, end
+
+        if (start + self._offset[row]) // SECONDS_PER_DAY != self._day[row]:
+            return self._violation(f"Event {event_id} moved to another day")
+
+        duration = self._end[row] - self._start[row]
+        if end - start != duration:
+            if self.mode == "strict":
+                return self._violation(f"Event {event_id} changed duration")
+            end = start + duration
+        if end > self._day_end[row]:
+            return self._violation(f"Event {event_id} runs past the end of its day")
+
+        return row, start, end
+
+    def _tz(self, row: int) -> timezone:
+        return timezone(timedelta(seconds=self._offset[row]))
+
+    def _violation(self, message: str) -> None:
+        self.violations.append(message)
+        if self.mode == "strict":
+            raise ScheduleValidationError(self.violations)
+        logger.warning("Dropping event from the optimized schedule: %s", message)
+        return None
+
+    def _with_times(self, event: dict, row: int, start: int, end: int) -> dict:
+        offset = self._offset[row]
+        return {
+            **event,
+            "start": format_time(start, offset),
+            "end": format_time(end, offset),
+        }
@@ -0,0 +1,99 @@
+"""
+Coalescing of identical concurrent requests.
+
+The frontend can post the same optimization twice (`App.jsx` and
+`MainContent.jsx` both call `/process_calendar_events`), and several open
+tabs do the same. Each duplicate would run its own LLM call and Google
+Calendar round trips. `SingleFlight` lets the first request run the work
+and makes identical requests that arrive while it is in flight await the
+same result instead.
+
+Requests are identified by `request_key`, a hash of their normalized
+payload.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+from typing import Any, Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_text(text: str) -> str:
+    """
+    Collapses runs of whitespace, so payloads that differ only in
+    formatting share a key.
+    """
+    return " ".join(text.split())
+
+
+def request_key(*parts: Any) -> str:
+    """
+    Builds the key identifying a request.
+
+    Args:
+        *parts: JSON-serializable values identifying the request, e.g. the
+            endpoint, the user and the normalized body fields.
+
+    Returns:
+        str: A hex digest of the parts.
+    """
+    payload = json.dumps(parts, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class SingleFlight:
+    """
+    Runs at most one computation per key at a time.
+
+    A computation runs as its own task and is shielded from its callers, so
+    a caller that disconnects cancels neither the work nor the other callers
+    waiting on it. Once the computation finishes, its key is released, and
+    the next call with that key runs again.
+
+    Attributes:
+        coalesced (int): The number of calls that joined a computation
+            started by another call.
+    """
+
+    def __init__(self):
+        self._calls: dict[str, asyncio.Future] = {}
+        self.coalesced = 0
+
+    async def do(self, key: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Returns the result of `func`, sharing it with concurrent calls that
+        use the same key.
+
+        Args:
+            key (str): The key of the computation, see `request_key`.
+            func (Callable[[], Awaitable[Any]]): Starts the computation. Only
+                called if no computation with this key is in flight.
+
+        Returns:
+            Any: The result of the computation. Exceptions are raised to
+                every caller.
+        """
+        call = self._calls.get(key)
+        if call is None:
+            call = asyncio.ensure_future(func())
+            self._calls[key] = call
+            call.add_done_callback(lambda _: self._release(key))
+        else:
+            self.coalesced += 1
+            logger.debug("Joining in-flight request %s", key[:12])
+        return await asyncio.shield(call)
+
+    def _release(self, key: str):
+        call = self._calls.pop(key)
+        if not call.cancelled():
+            # Mark the exception as retrieved even if every caller has gone.
+            call.exception()
+
+    def in_flight(self) -> int:
+        """
+        Returns the number of computations currently running.
+        """
+        return len(self._calls)
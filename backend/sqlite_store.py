@@ -0,0 +1,83 @@
+"""
+Connection handling shared by the stores kept in SQLite databases.
+
+The event cache, the event store, energy profiles, parsed documents, jobs
+and batch checkpoints each keep their state in a SQLite file, which several
+uvicorn workers on the same host may share. `SQLiteStore` is their base
+class:
+
+* each thread opens its own connection, as a connection cannot be used by
+  two threads at once;
+* the database runs in WAL mode, so readers in one worker do not block
+  writers in another, and waits up to `TIMEOUT` seconds for a lock;
+* connections are in autocommit mode, and `_transaction` groups several
+  statements into one write transaction;
+* the tables and indices a store declares in `SCHEMA` are created when it
+  is opened.
+"""
+
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional
+
+# Seconds a statement waits for another connection's lock.
+TIMEOUT = 5.0
+
+
+class SQLiteStore:
+    """
+    Base class of the stores kept in a SQLite database.
+
+    Subclasses declare their tables and indices in `SCHEMA`, and set
+    `ROW_FACTORY` to `sqlite3.Row` to read columns by name.
+
+    Attributes:
+        path (str): The path of the database file.
+    """
+
+    SCHEMA: tuple[str, ...] = ()
+    ROW_FACTORY: Optional[Callable] = None
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connection()
+        for statement in self.SCHEMA:
+            conn.execute(statement)
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        Returns the calling thread's connection, opening it if needed.
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=TIMEOUT, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.row_factory = self.ROW_FACTORY
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """
+        Runs the block in a write transaction on the calling thread's
+        connection, which it yields. The transaction takes the write lock
+        when it begins, is committed if the block succeeds and rolled back
+        if it raises.
+        """
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
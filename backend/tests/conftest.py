@@ -0,0 +1,20 @@
+"""
+Shared setup for the backend tests.
+
+The backend modules import each other by their flat names, as they do when
+run from the `backend` directory, so that directory is put on the path.
+The stores `divine` opens when it is imported are kept in a scratch
+directory.
+"""
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_scratch = tempfile.mkdtemp(prefix="backend-tests-")
+for _setting in ("EVENT_CACHE", "EVENT_STORE", "PROFILE_STORE", "JOB_STORE"):
+    os.environ.setdefault(
+        f"{_setting}_PATH", os.path.join(_scratch, f"{_setting.lower()}.sqlite3")
+    )
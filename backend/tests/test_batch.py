@@ -0,0 +1,112 @@
+import asyncio
+import json
+
+import pytest
+
+import batch
+from batch import DONE, FAILED, OPTIMIZED, Batch, BatchCheckpoint, user_key
+
+PLAN = {
+    "writes": [{"id": "a", "calendar_id": "cal"}, {"id": "b", "calendar_id": "cal"}],
+    "days": {"2024-10-14": 2},
+    "errors": {},
+}
+
+
+def user(user_id: str = "u", **changes) -> dict:
+    return {
+        "user_id": user_id,
+        "calendar_ids": ["cal"],
+        "questionnaire": "I'm a morning person",
+        "date": "2024-10-14",
+        "start_date": None,
+        "end_date": None,
+        **changes,
+    }
+
+
+@pytest.fixture
+def checkpoint(tmp_path):
+    return BatchCheckpoint(str(tmp_path / "batch.sqlite3"))
+
+
+@pytest.fixture
+def writes(monkeypatch):
+    """The events written back, and the IDs whose writes fail."""
+    written, failing = [], set()
+
+    def update_or_create_event(service, event_data):
+        if event_data["id"] in failing:
+            return None
+        written.append(event_data["id"])
+        return event_data
+
+    monkeypatch.setattr(batch, "update_or_create_event", update_or_create_event)
+    return written, failing
+
+
+def run(users, checkpoint) -> dict:
+    # Stored plans are written back without fetching or optimizing.
+    return asyncio.run(Batch(users, checkpoint, None, None).run())
+
+
+def test_checkpoint_records_progress_per_input(checkpoint):
+    key = user_key(user())
+    assert checkpoint.get("u", key) is None
+    checkpoint.optimized("u", key, PLAN)
+    assert checkpoint.get("u", key)["status"] == OPTIMIZED
+    assert checkpoint.get("u", key)["plan"] == PLAN
+    checkpoint.done("u", key, {"written": 2})
+    assert checkpoint.get("u", key)["result"] == {"written": 2}
+    # A changed questionnaire starts over.
+    assert checkpoint.get("u", user_key(user(questionnaire="night owl"))) is None
+    checkpoint.clear()
+    assert checkpoint.get("u", key) is None
+
+
+def test_user_key_ignores_calendar_order_and_whitespace():
+    assert user_key(user(calendar_ids=["b", "a"])) == user_key(
+        user(calendar_ids=["a", "b", "a"])
+    )
+    assert user_key(user(questionnaire=" I'm  a morning person ")) == user_key(user())
+    assert user_key(user(date="2024-10-15")) != user_key(user())
+
+
+def test_done_users_are_skipped(checkpoint, writes):
+    checkpoint.done("u", user_key(user()), {"written": 2})
+    stats = run([user()], checkpoint)
+    assert stats["skipped"] == 1 and stats[DONE] == 0
+    assert writes[0] == []
+
+
+def test_stored_plans_are_written_back(checkpoint, writes):
+    key = user_key(user())
+    checkpoint.optimized("u", key, PLAN)
+    stats = run([user()], checkpoint)
+    assert stats[DONE] == 1 and writes[0] == ["a", "b"]
+    progress = checkpoint.get("u", key)
+    assert progress["status"] == DONE
+    assert progress["result"] == {
+        "days": PLAN["days"],
+        "errors": {},
+        "written": 2,
+        "failed": 0,
+    }
+
+
+def test_users_with_failed_writes_are_retried(checkpoint, writes):
+    written, failing = writes
+    key = user_key(user())
+    checkpoint.optimized("u", key, PLAN)
+    failing.add("b")
+    stats = run([user()], checkpoint)
+    assert stats[FAILED] == 1 and stats[DONE] == 0
+    progress = checkpoint.get("u", key)
+    assert progress["status"] == FAILED and "1 of 2 writes failed" in progress["error"]
+    assert progress["plan"] == PLAN
+
+    failing.clear()
+    stats = run([user()], checkpoint)
+    assert stats[DONE] == 1 and stats["skipped"] == 0
+    assert written == ["a", "a", "b"]
+    assert checkpoint.get("u", key)["status"] == DONE
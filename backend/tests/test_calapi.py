@@ -0,0 +1,39 @@
+from benchmarks.fakes import FakeCalendarService
+from calapi import update_or_create_event
+
+EVENT = {
+    "calendar_id": "cal",
+    "summary": "Focus",
+    "start": "2024-10-14T09:00:00-07:00",
+    "end": "2024-10-14T10:00:00-07:00",
+}
+
+
+def test_creating_an_event_twice_does_not_duplicate_it():
+    service = FakeCalendarService({"cal": []})
+    first = update_or_create_event(service, dict(EVENT))
+    second = update_or_create_event(service, dict(EVENT))
+    assert first["id"] == second["id"]
+    assert len(service.calendars["cal"]) == 1
+
+
+def test_recreating_a_deleted_event_twice_does_not_duplicate_it():
+    service = FakeCalendarService({"cal": []})
+    # The event was deleted since it was fetched; a retried write-back
+    # recreates it under the same ID.
+    missing = {**EVENT, "id": "deleted"}
+    first = update_or_create_event(service, dict(missing))
+    moved = {**missing, "start": "2024-10-14T11:00:00-07:00"}
+    second = update_or_create_event(service, moved)
+    assert first["id"] == second["id"] != "deleted"
+    assert len(service.calendars["cal"]) == 1
+    assert service.calendars["cal"][0]["start"]["dateTime"] == moved["start"]
+
+
+def test_existing_events_are_updated_in_place():
+    service = FakeCalendarService({"cal": []})
+    created = update_or_create_event(service, dict(EVENT))
+    update_or_create_event(
+        service, {**EVENT, "id": created["id"], "summary": "Deep work"}
+    )
+    assert [e["summary"] for e in service.calendars["cal"]] == ["Deep work"]
@@ -0,0 +1,61 @@
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+import divine
+from benchmarks.fakes import FakeCalendarService
+from divine import check_dates
+
+
+@pytest.mark.parametrize(
+    "date, start_date, end_date",
+    [
+        ("2024-10-14", None, None),
+        (None, "2024-10-14", "2024-10-14"),
+        (None, "2024-10-01", "2024-10-31"),
+    ],
+)
+def test_valid_dates_pass(date, start_date, end_date):
+    check_dates(date, start_date, end_date)
+
+
+@pytest.mark.parametrize(
+    "date, start_date, end_date",
+    [
+        ("tomorrow", None, None),
+        ("2024-13-01", None, None),
+        ("20241014", None, None),
+        ("", None, None),
+        (None, None, None),
+        (None, "2024-10-14", None),
+        (None, "2024-10-14", "10/20/2024"),
+        (None, "2024-10-20", "2024-10-14"),
+        (None, "2024-10-01", "2024-11-01"),
+    ],
+)
+def test_invalid_dates_are_rejected(date, start_date, end_date):
+    with pytest.raises(HTTPException) as info:
+        check_dates(date, start_date, end_date)
+    assert info.value.status_code == 422
+
+
+@pytest.fixture
+def client():
+    overrides = {
+        divine.get_calendar_service: lambda: FakeCalendarService(),
+        divine.get_calendar_processor: lambda: None,
+    }
+    divine.app.dependency_overrides.update(overrides)
+    yield TestClient(divine.app)
+    for dependency in overrides:
+        divine.app.dependency_overrides.pop(dependency)
+
+
+def test_malformed_single_dates_get_a_422(client):
+    response = client.post(
+        "/process_calendar_events",
+        json={"calendar_ids": ["cal"], "questionnaire": "", "date": "10/14/2024"},
+        headers={"X-User-Id": "u"},
+    )
+    assert response.status_code == 422
+    assert response.json()["detail"] == "Dates must be YYYY-MM-DD"
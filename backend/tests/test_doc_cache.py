@@ -0,0 +1,57 @@
+from types import SimpleNamespace
+
+from doc_cache import indexed_pages, list_files, stale_documents
+
+
+class FakeIndex:
+    def __init__(self, paths: dict[str, int]):
+        self.ref_doc_info = {
+            f"{path}#{n}": SimpleNamespace(metadata={"file_path": path})
+            for path, pages in paths.items()
+            for n in range(pages)
+        }
+
+
+def pages(path: str, count: int) -> list:
+    return [SimpleNamespace(id_=f"{path}#{n}") for n in range(count)]
+
+
+def test_indexed_pages_groups_documents_by_file():
+    index = FakeIndex({"a.pdf": 2, "b.pdf": 1})
+    index.ref_doc_info["legacy"] = SimpleNamespace(metadata={"file_path": "c.pdf"})
+    assert indexed_pages(index) == {
+        "a.pdf": {"a.pdf#0", "a.pdf#1"},
+        "b.pdf": {"b.pdf#0"},
+        "c.pdf": {"legacy"},
+    }
+
+
+def test_every_page_of_a_removed_file_is_stale():
+    indexed = indexed_pages(FakeIndex({"a.pdf": 3, "b.pdf": 1}))
+    assert stale_documents(indexed, [], ["a.pdf"]) == ["a.pdf#0", "a.pdf#1", "a.pdf#2"]
+
+
+def test_pages_a_shorter_file_no_longer_has_are_stale():
+    indexed = indexed_pages(FakeIndex({"a.pdf": 3, "b.pdf": 2}))
+    assert stale_documents(indexed, pages("a.pdf", 1), ["a.pdf"]) == [
+        "a.pdf#1",
+        "a.pdf#2",
+    ]
+    # New and longer files leave nothing behind.
+    assert (
+        stale_documents(
+            indexed, pages("b.pdf", 4) + pages("c.pdf", 1), ["b.pdf", "c.pdf"]
+        )
+        == []
+    )
+
+
+def test_list_files_skips_hidden_files(tmp_path):
+    (tmp_path / "sub").mkdir()
+    (tmp_path / ".git").mkdir()
+    for name in ("b.pdf", ".hidden", "sub/a.pdf", ".git/config"):
+        (tmp_path / name).write_text("x")
+    assert list_files(str(tmp_path)) == [
+        str(tmp_path / "b.pdf"),
+        str(tmp_path / "sub" / "a.pdf"),
+    ]
@@ -0,0 +1,116 @@
+from datetime import datetime
+
+import pytest
+
+from energy_profile import BASELINE, ProfileStore, parse_questionnaire
+
+
+def changed(questionnaire: str) -> dict[int, float]:
+    """Returns the hours whose energy differs from the typical day."""
+    curve = parse_questionnaire(questionnaire).curve
+    return {h: curve[h] - BASELINE[h] for h in range(24) if curve[h] != BASELINE[h]}
+
+
+def test_energy_cues_raise_and_lower_the_hours_they_name():
+    profile = parse_questionnaire(
+        "I do my best focused work before lunch. My energy dips after 2pm."
+    )
+    assert profile.notes == []
+    delta = changed("I do my best focused work before lunch")
+    assert set(delta) == {9, 10, 11} and min(delta.values()) > 0
+    delta = changed("My energy dips after 2pm")
+    assert set(delta) == set(range(14, 24)) and max(delta.values()) < 0
+    assert profile.peak_hours() == [9, 10, 11]
+
+
+@pytest.mark.parametrize(
+    "questionnaire",
+    [
+        "I am not productive in the morning",
+        "I'm not productive in the morning",
+        "I’m never focused in the morning",
+        "I don't feel sharp in the morning",
+    ],
+)
+def test_negated_energy_cues_lower_the_hours(questionnaire):
+    delta = changed(questionnaire)
+    assert set(delta) == set(range(6, 12))
+    assert all(level < 0 for level in delta.values())
+
+
+def test_never_focused_after_8pm_lowers_the_evening():
+    delta = changed("I never feel focused after 8pm")
+    assert set(delta) == set(range(20, 24))
+    assert all(level < 0 for level in delta.values())
+
+
+@pytest.mark.parametrize(
+    "questionnaire, period",
+    [
+        ("I'm not a morning person", range(6, 12)),
+        ("I am not a night owl", range(19, 24)),
+    ],
+)
+def test_negated_chronotypes_lower_their_period(questionnaire, period):
+    delta = changed(questionnaire)
+    assert set(delta) == set(period) - {h for h in period if BASELINE[h] == 0}
+    assert all(level < 0 for level in delta.values())
+
+
+def test_chronotypes_shift_the_curve():
+    delta = changed("I'm a night owl")
+    assert all(delta[h] > 0 for h in range(19, 24))
+    assert all(delta[h] < 0 for h in range(6, 19))
+
+
+def test_negated_low_cues_are_kept_as_notes():
+    profile = parse_questionnaire("My energy doesn't dip after lunch")
+    assert profile.curve == BASELINE
+    assert profile.notes == ["My energy doesn't dip after lunch"]
+
+
+@pytest.mark.parametrize(
+    "questionnaire, hours",
+    [
+        ("focused 10-12", {10, 11}),
+        ("most productive 2-4 most days", {14, 15}),
+        ("sharp between 9 and 11am", {9, 10}),
+        ("alert from 7:30 to 9", {7, 8}),
+        ("focused 9 to 11pm", {21, 22}),
+    ],
+)
+def test_time_ranges(questionnaire, hours):
+    assert set(changed(questionnaire)) == hours
+
+
+@pytest.mark.parametrize(
+    "questionnaire", ["Most productive with 2-3 meetings", "best with 2 to 3 calls"]
+)
+def test_counts_are_not_read_as_hours(questionnaire):
+    profile = parse_questionnaire(questionnaire)
+    assert profile.curve == BASELINE and profile.notes == [questionnaire]
+
+
+def test_other_clauses_are_kept_as_notes():
+    profile = parse_questionnaire(
+        "I prefer meetings in the afternoon, and no meetings on Fridays"
+    )
+    assert profile.curve == BASELINE
+    assert profile.notes == [
+        "I prefer meetings in the afternoon",
+        "no meetings on Fridays",
+    ]
+
+
+def test_mean_energy_weights_by_minutes():
+    profile = parse_questionnaire("")
+    start, end = datetime(2024, 10, 14, 9, 30), datetime(2024, 10, 14, 13, 0)
+    expected = (0.7 * 30 + 0.7 * 60 + 0.7 * 60 + 0.6 * 60) / 210
+    assert profile.mean_energy(start, end) == pytest.approx(expected)
+
+
+def test_store_parses_again_only_when_the_questionnaire_changes(tmp_path):
+    store = ProfileStore(str(tmp_path / "profiles.sqlite3"))
+    first = store.get("u", "I'm a morning person")
+    assert store.get("u", "I'm  a morning   person") == first
+    assert store.get("u", "I'm not a morning person") != first
@@ -0,0 +1,89 @@
+import pytest
+
+import event_cache
+from event_cache import MemoryEventCache, SQLiteEventCache, make_cache_key
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(event_cache, "time", clock)
+    return clock
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_cache(request, tmp_path, clock):
+    def make(ttl=60.0, max_bytes=1000):
+        if request.param == "memory":
+            return MemoryEventCache(ttl=ttl, max_bytes=max_bytes)
+        return SQLiteEventCache(str(tmp_path / "cache.sqlite3"), ttl, max_bytes)
+
+    return make
+
+
+def value(size: int) -> list:
+    # json.dumps(["x..."]) is 4 characters longer than the string.
+    return ["x" * (size - 4)]
+
+
+def test_cache_keys_ignore_calendar_order_and_duplicates():
+    key = make_cache_key("u", ["b", "a"], "2024-10-14", "2024-10-14")
+    assert key == make_cache_key("u", ["a", "b", "a"], "2024-10-14", "2024-10-14")
+    assert key != make_cache_key("v", ["a", "b"], "2024-10-14", "2024-10-14")
+    assert key != make_cache_key("u", ["a", "b"], "2024-10-14", "2024-10-15")
+
+
+def test_entries_expire_after_the_ttl(make_cache, clock):
+    cache = make_cache(ttl=60.0)
+    cache.set("k", "u", [{"id": "a"}])
+    clock.now += 60
+    assert cache.get("k") == [{"id": "a"}]
+    clock.now += 1
+    assert cache.get("k") is None
+
+
+def test_least_recently_used_entries_are_evicted(make_cache, clock):
+    cache = make_cache(max_bytes=300)
+    for key in ("a", "b", "c"):
+        cache.set(key, "u", value(100))
+        clock.now += 1
+    assert cache.get("a") is not None
+    clock.now += 1
+    cache.set("d", "u", value(100))
+    assert [key for key in "abcd" if cache.get(key) is not None] == ["a", "c", "d"]
+
+
+def test_values_larger_than_the_bound_are_not_cached(make_cache):
+    cache = make_cache(max_bytes=100)
+    cache.set("small", "u", value(50))
+    cache.set("big", "u", value(101))
+    assert cache.get("big") is None and cache.get("small") is not None
+
+
+def test_replacing_an_entry_frees_its_old_size(make_cache):
+    cache = make_cache(max_bytes=200)
+    cache.set("a", "u", value(100))
+    cache.set("b", "u", value(50))
+    cache.set("b", "u", value(100))
+    assert cache.get("a") is not None and cache.get("b") == value(100)
+
+
+def test_invalidate_user_drops_only_their_entries(make_cache):
+    cache = make_cache()
+    cache.set("a", "u", [1])
+    cache.set("b", "v", [2])
+    cache.invalidate_user("u")
+    assert cache.get("a") is None and cache.get("b") == [2]
+
+
+def test_create_event_cache_rejects_unknown_backends(tmp_path):
+    with pytest.raises(ValueError):
+        event_cache.create_event_cache("redis", str(tmp_path / "x"), 1.0, 1)
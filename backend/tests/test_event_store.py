@@ -0,0 +1,111 @@
+import time
+
+import pytest
+
+from benchmarks.fakes import FakeCalendarService
+from calapi import sync_calendar_events, update_or_create_event
+from event_store import EventStore
+from event_table import parse_time
+
+DAY = 86400
+T0 = int(parse_time("2024-10-14T00:00:00Z").timestamp())
+
+
+def event(event_id: str, start: str, end: str, calendar_id: str = "cal") -> dict:
+    return {
+        "id": event_id,
+        "calendar_id": calendar_id,
+        "calendar_name": "Me",
+        "summary": event_id,
+        "description": "",
+        "start": f"2024-10-14T{start}:00Z",
+        "end": f"2024-10-14T{end}:00Z",
+        "status": "confirmed",
+    }
+
+
+@pytest.fixture
+def store(tmp_path):
+    return EventStore(str(tmp_path / "events.sqlite3"), max_window_days=10)
+
+
+def ids(events) -> list[str]:
+    return [e["id"] for e in events]
+
+
+def test_query_returns_events_overlapping_the_window_by_start(store):
+    store.replace(
+        "u",
+        "cal",
+        T0,
+        T0 + DAY,
+        [event("b", "10:00", "11:00"), event("a", "09:00", "10:00")],
+        "x",
+    )
+    assert ids(store.query("u", ["cal"], T0, T0 + DAY)) == ["a", "b"]
+    # An event ending exactly at time_min is not in the window.
+    ten = T0 + 10 * 3600
+    assert ids(store.query("u", ["cal"], ten, T0 + DAY)) == ["b"]
+    assert store.query("other", ["cal"], T0, T0 + DAY) == []
+
+
+def test_deltas_update_move_and_delete_events(store):
+    store.replace(
+        "u",
+        "cal",
+        T0,
+        T0 + DAY,
+        [event("a", "09:00", "10:00"), event("b", "10:00", "11:00")],
+        "first",
+    )
+    store.apply_changes("u", "cal", [event("a", "15:00", "16:00")], ["b"], "second")
+    [moved] = store.query("u", ["cal"], T0, T0 + DAY)
+    assert moved["start"] == "2024-10-14T15:00:00Z"
+    assert store.sync_state("u", "cal")["updated_min"] == "second"
+
+
+def test_overlapping_windows_are_merged(store):
+    store.replace("u", "cal", T0, T0 + DAY, [event("a", "09:00", "10:00")], "2")
+    store.replace("u", "cal", T0 + DAY // 2, T0 + 2 * DAY, [], "3")
+    state = store.sync_state("u", "cal")
+    assert (state["time_min"], state["time_max"]) == (T0, T0 + 2 * DAY)
+    # The earliest updated_min covers the whole merged window.
+    assert state["updated_min"] == "2"
+    assert ids(store.query("u", ["cal"], T0, T0 + 2 * DAY)) == ["a"]
+
+
+def test_distant_windows_replace_the_stored_one(store):
+    store.replace("u", "cal", T0, T0 + DAY, [event("a", "09:00", "10:00")], "1")
+    store.replace("u", "cal", T0 + 30 * DAY, T0 + 31 * DAY, [], "2")
+    state = store.sync_state("u", "cal")
+    assert state["time_min"] == T0 + 30 * DAY
+    assert store.query("u", ["cal"], T0, T0 + DAY) == []
+
+
+def test_mark_stale_forces_the_next_read_to_sync(store):
+    store.replace("u", "cal", T0, T0 + DAY, [], "1")
+    assert store.sync_state("u", "cal")["synced"] > 0
+    store.mark_stale("u")
+    assert store.sync_state("u", "cal")["synced"] == 0
+
+
+def test_sync_fetches_in_full_then_serves_locally_then_syncs_deltas(store):
+    service = FakeCalendarService.with_events(["cal"], "2024-10-14", 4)
+
+    def sync():
+        return sync_calendar_events(
+            service, store, "u", ["cal"], "2024-10-14", "2024-10-14", sync_interval=60
+        )
+
+    first = sync()
+    assert len(first) == 4 and service.calls["list"] == 1
+    assert ids(sync()) == ids(first) and service.calls["list"] == 1
+
+    moved = {**first[0], "summary": "Moved"}
+    update_or_create_event(service, moved)
+    store.mark_stale("u")
+    # Deltas are asked for from the last sync minus a margin, so the
+    # update is picked up even within the same second.
+    third = sync()
+    assert service.calls["list"] == 2
+    assert [e["summary"] for e in third if e["id"] == moved["id"]] == ["Moved"]
@@ -0,0 +1,69 @@
+from datetime import timedelta, timezone
+
+import numpy as np
+
+from event_table import EventList, EventTable, format_time, parse_time, table_of
+
+
+def event(event_id: str, start: str, end: str, calendar_id: str = "cal") -> dict:
+    return {"id": event_id, "calendar_id": calendar_id, "start": start, "end": end}
+
+
+EVENTS = [
+    event("late", "2024-10-14T23:30:00-07:00", "2024-10-15T00:30:00-07:00"),
+    event("morning", "2024-10-15T09:00:00-07:00", "2024-10-15T10:00:00-07:00", "b"),
+    event("early", "2024-10-14T08:00:00-07:00", "2024-10-14T09:00:00-07:00"),
+    event("holiday", "2024-10-15", "2024-10-16"),
+]
+
+
+def test_parse_time_reads_offsets_z_and_dates():
+    assert parse_time("2024-10-14T09:00:00Z").utcoffset() == timedelta(0)
+    pacific = timezone(timedelta(hours=-7))
+    assert parse_time("2024-10-14T09:00:00", pacific).tzinfo == pacific
+    assert parse_time("2024-10-14", pacific).hour == 0
+
+
+def test_format_time_keeps_the_offset():
+    epoch = int(parse_time("2024-10-14T09:00:00-07:00").timestamp())
+    assert format_time(epoch, -7 * 3600) == "2024-10-14T09:00:00-07:00"
+
+
+def test_table_parses_times_and_interns_calendars():
+    table = EventTable.from_events(EVENTS)
+    assert table.calendars == ["cal", "b"]
+    assert table.rows["calendar"].tolist() == [0, 1, 0, 0]
+    assert table.all_day.tolist() == [False, False, False, True]
+    assert (table.end - table.start)[:3].tolist() == [3600, 3600, 3600]
+    assert table.index("early") == 2 and table.index("missing") is None
+
+
+def test_split_by_day_uses_each_events_local_day():
+    # "late" starts on the 15th in UTC, but on the 14th where it happens.
+    days = EventTable.from_events(EVENTS).split_by_day()
+    assert list(days) == ["2024-10-14", "2024-10-15"]
+    assert [e["id"] for e in days["2024-10-14"]] == ["late", "early"]
+    assert [e["id"] for e in days["2024-10-15"]] == ["morning", "holiday"]
+    for day_events in days.values():
+        assert isinstance(day_events, EventList)
+        assert day_events.table.ids == [e["id"] for e in day_events]
+
+
+def test_day_end_is_local_midnight():
+    table = EventTable.from_events(EVENTS[:1])
+    midnight = parse_time("2024-10-15T00:00:00-07:00").timestamp()
+    assert table.day_end.tolist() == [midnight]
+
+
+def test_take_keeps_the_given_order():
+    table = EventTable.from_events(EVENTS).take(np.array([2, 0]))
+    assert table.ids == ["early", "late"]
+    assert [e["id"] for e in table.events] == table.ids
+
+
+def test_table_of_reuses_a_current_table():
+    events = EventList(EVENTS)
+    assert table_of(events) is events.table
+    events.append(event("new", "2024-10-16T09:00:00Z", "2024-10-16T10:00:00Z"))
+    assert len(table_of(events)) == 5
+    assert table_of(list(EVENTS)).ids == [e["id"] for e in EVENTS]
@@ -0,0 +1,101 @@
+import json
+import threading
+import time
+
+import pytest
+
+from ai_calendar_processor import AICalendarProcessor
+
+
+def event(event_id: str) -> dict:
+    return {
+        "id": event_id,
+        "calendar_id": "cal",
+        "summary": event_id,
+        "start": "2024-10-14T09:00:00-07:00",
+        "end": "2024-10-14T10:00:00-07:00",
+    }
+
+
+class FakeStream:
+    """
+    A backend's answer, streamed one event per chunk.
+
+    Attributes:
+        started (threading.Event): Set when the backend is called.
+        closed (threading.Event): Set when its stream is closed.
+    """
+
+    def __init__(self, ids, first_delay=0.0, delay=0.0, error=None):
+        self.ids = ids
+        self.first_delay = first_delay
+        self.delay = delay
+        self.error = error
+        self.started = threading.Event()
+        self.closed = threading.Event()
+
+    def __call__(self, prompt: str):
+        self.started.set()
+        try:
+            time.sleep(self.first_delay)
+            yield '{"events": ['
+            for n, event_id in enumerate(self.ids):
+                if n:
+                    time.sleep(self.delay)
+                yield ("," if n else "") + json.dumps(event(event_id))
+            if self.error is not None:
+                raise self.error
+            yield "]}"
+        finally:
+            self.closed.set()
+
+
+def hedged(local: FakeStream, claude: FakeStream, delay: float = 0.1) -> list[str]:
+    processor = AICalendarProcessor(model=object())
+    processor._stream_local = local
+    processor._stream_claude = claude
+    items = processor._hedged_events("prompt", "local", "claude", delay)
+    return [item["id"] for item in items]
+
+
+def test_a_fast_primary_wins_without_hedging():
+    local, claude = FakeStream(["a", "b"]), FakeStream(["x"])
+    assert hedged(local, claude, delay=1.0) == ["a", "b"]
+    assert not claude.started.is_set()
+
+
+def test_a_slow_primary_is_hedged_and_cancelled():
+    local = FakeStream(["a", "b", "c"], first_delay=0.3, delay=0.05)
+    claude = FakeStream(["x", "y"])
+    assert hedged(local, claude) == ["x", "y"]
+    # The loser stops at its next chunk.
+    assert local.closed.wait(timeout=2)
+
+
+def test_the_loser_is_cancelled_when_the_secondary_is_slower():
+    local = FakeStream(["a", "b"], first_delay=0.15, delay=0.05)
+    claude = FakeStream(["x", "y"], first_delay=0.5, delay=0.05)
+    assert hedged(local, claude) == ["a", "b"]
+    assert claude.started.is_set() and claude.closed.wait(timeout=2)
+
+
+def test_a_failing_primary_fails_over_immediately():
+    local = FakeStream([], error=RuntimeError("overloaded"))
+    claude = FakeStream(["x"])
+    start = time.perf_counter()
+    assert hedged(local, claude, delay=5.0) == ["x"]
+    assert time.perf_counter() - start < 2
+
+
+def test_errors_are_raised_when_both_backends_fail():
+    local = FakeStream([], error=RuntimeError("local failed"))
+    claude = FakeStream([], error=RuntimeError("claude failed"))
+    with pytest.raises(RuntimeError, match="failed"):
+        hedged(local, claude)
+
+
+def test_errors_of_the_winner_after_winning_are_raised():
+    local = FakeStream(["a"], error=RuntimeError("cut off"))
+    claude = FakeStream(["x"], first_delay=1.0)
+    with pytest.raises(RuntimeError, match="cut off"):
+        hedged(local, claude, delay=1.0)
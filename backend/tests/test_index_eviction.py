@@ -0,0 +1,81 @@
+import threading
+from collections import OrderedDict
+
+import pytest
+
+pytest.importorskip("llama_index.core")
+
+from ai_enlightened_chatbot import RAGAgent, index_size  # noqa: E402
+
+
+class FakeIndex:
+    def __init__(self, agent_type: str):
+        self.agent_type = agent_type
+
+
+def make_agent(tmp_path, budget, sizes: dict[str, int]) -> RAGAgent:
+    """
+    Returns an agent whose indices are persisted with the given sizes,
+    without loading any model.
+    """
+    for agent_type, size in sizes.items():
+        persist_dir = tmp_path / "storage" / agent_type
+        persist_dir.mkdir(parents=True)
+        (persist_dir / "vectors.json").write_bytes(b"x" * size)
+
+    agent = RAGAgent.__new__(RAGAgent)
+    agent.agent_types = list(sizes)
+    agent.directory = str(tmp_path / "texts")
+    agent.storage_dir = str(tmp_path / "storage")
+    agent.memory_budget = budget
+    agent.indices = OrderedDict()
+    agent._index_sizes = {}
+    agent._updated = set()
+    agent._indices_lock = threading.Lock()
+    agent._load_locks = {agent_type: threading.Lock() for agent_type in sizes}
+    agent.loads = []
+
+    def load(directory, persist_dir):
+        agent.loads.append(persist_dir.rsplit("/", 1)[-1])
+        return FakeIndex(agent.loads[-1]), {}
+
+    agent._load_or_create_index = load
+    agent._update_index = lambda index, *args: index
+    return agent
+
+
+def test_index_size_sums_the_persisted_files(tmp_path):
+    (tmp_path / "a").write_bytes(b"x" * 10)
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "sub" / "b").write_bytes(b"x" * 5)
+    assert index_size(str(tmp_path)) == 15
+
+
+def test_least_recently_used_indices_are_evicted(tmp_path):
+    agent = make_agent(tmp_path, 250, {"monk": 100, "lawyer": 100, "philosopher": 100})
+    agent.get_index("monk")
+    agent.get_index("lawyer")
+    agent.get_index("monk")
+    agent.get_index("philosopher")
+    assert list(agent.indices) == ["monk", "philosopher"]
+    assert set(agent._index_sizes) == {"monk", "philosopher"}
+    # An evicted index is loaded again when queried.
+    agent.get_index("lawyer")
+    assert agent.loads == ["monk", "lawyer", "philosopher", "lawyer"]
+    assert list(agent.indices) == ["philosopher", "lawyer"]
+
+
+def test_the_most_recent_index_is_kept_over_budget(tmp_path):
+    agent = make_agent(tmp_path, 50, {"monk": 100, "lawyer": 100})
+    agent.get_index("monk")
+    agent.get_index("lawyer")
+    assert list(agent.indices) == ["lawyer"]
+
+
+def test_without_a_budget_nothing_is_evicted(tmp_path):
+    agent = make_agent(tmp_path, None, {"monk": 100, "lawyer": 100})
+    agent.get_index("monk")
+    agent.get_index("lawyer")
+    assert list(agent.indices) == ["monk", "lawyer"]
+    # Documents are checked for changes once per process.
+    assert agent._updated == {"monk", "lawyer"}
@@ -0,0 +1,120 @@
+import asyncio
+import time
+
+import pytest
+
+from jobs import FAILED, QUEUED, RUNNING, SUCCEEDED, JobQueue, JobQueueFull, JobStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(str(tmp_path / "jobs.sqlite3"))
+
+
+def test_a_job_is_claimed_once(store):
+    job = store.create("user", "kind", {"x": 1})
+    assert job["status"] == QUEUED and job["payload"] == {"x": 1}
+    assert store.claim(job["id"])
+    assert not store.claim(job["id"])
+    assert store.get(job["id"])["status"] == RUNNING
+
+
+def test_only_expired_leases_are_requeued(store):
+    stale, fresh = store.create("u", "k", {}), store.create("u", "k", {})
+    store.claim(stale["id"])
+    store.claim(fresh["id"])
+    store._connection().execute(
+        "UPDATE jobs SET heartbeat = ? WHERE id = ?", (time.time() - 120, stale["id"])
+    )
+    assert store.requeue_expired(60.0) == [stale["id"]]
+    assert store.get(stale["id"])["status"] == QUEUED
+    assert store.get(fresh["id"])["status"] == RUNNING
+
+
+def test_renewed_jobs_are_not_requeued(store):
+    job = store.create("u", "k", {})
+    store.claim(job["id"])
+    store._connection().execute(
+        "UPDATE jobs SET heartbeat = ? WHERE id = ?", (time.time() - 120, job["id"])
+    )
+    store.renew([job["id"]])
+    assert store.requeue_expired(60.0) == []
+
+
+def test_purge_keeps_unfinished_and_recent_jobs(store):
+    old, running = store.create("u", "k", {}), store.create("u", "k", {})
+    store.update(old["id"], status=SUCCEEDED)
+    store.claim(running["id"])
+    store._connection().execute("UPDATE jobs SET updated = 0")
+    store.purge(60.0)
+    assert store.get(old["id"]) is None
+    assert store.get(running["id"]) is not None
+
+
+def run_queue(store, handler, submit, **kwargs):
+    async def main():
+        queue = JobQueue(store, handler, **kwargs)
+        jobs = submit(queue)
+        updates = [job async for job in queue.watch(jobs[-1]["id"], heartbeat=1.0)]
+        await queue.stop()
+        return jobs, updates
+
+    return asyncio.run(main())
+
+
+def test_jobs_record_their_progress_and_result(store):
+    async def handler(job, report):
+        report({"days_done": 1})
+        return {"echo": job["payload"]}
+
+    jobs, updates = run_queue(
+        store, handler, lambda queue: [queue.submit("u", "k", {"a": 1})]
+    )
+    final = updates[-1]
+    assert final["status"] == SUCCEEDED
+    assert final["result"] == {"echo": {"a": 1}}
+    assert final["progress"] == {"days_done": 1}
+
+
+def test_failed_jobs_record_their_error(store):
+    async def handler(job, report):
+        raise RuntimeError("boom")
+
+    _, updates = run_queue(store, handler, lambda queue: [queue.submit("u", "k", {})])
+    assert updates[-1]["status"] == FAILED
+    assert updates[-1]["error"] == "boom"
+
+
+def test_submit_refuses_jobs_beyond_the_queue_bound(store):
+    async def main():
+        queue = JobQueue(store, None, workers=0, max_queued=2)
+        queue.submit("u", "k", {})
+        queue.submit("u", "k", {})
+        with pytest.raises(JobQueueFull):
+            queue.submit("u", "k", {})
+        await queue.stop()
+
+    asyncio.run(main())
+
+
+def test_abandoned_jobs_run_again(store):
+    job = store.create("u", "k", {})
+    store.claim(job["id"])
+    store._connection().execute("UPDATE jobs SET heartbeat = 0")
+
+    async def main():
+        runs = []
+
+        async def handler(job, report):
+            runs.append(job["id"])
+            return None
+
+        queue = JobQueue(store, handler, lease=0.3)
+        queue.start()
+        updates = [j async for j in queue.watch(job["id"], heartbeat=0.1) if j]
+        await queue.stop()
+        return runs, updates
+
+    runs, updates = asyncio.run(main())
+    assert runs == [job["id"]]
+    assert updates[-1]["status"] == SUCCEEDED
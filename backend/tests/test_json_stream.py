@@ -0,0 +1,59 @@
+import json
+
+import pytest
+
+from json_stream import EventStreamParser
+
+EVENTS = [
+    {"id": "a", "summary": "Standup", "start": "2024-10-14T09:00:00-07:00"},
+    {"id": "b", "summary": 'Quote " and brace } in text', "tags": ["x", "]"]},
+    {"id": "c", "nested": {"deep": [1, {"x": "{"}]}},
+]
+RESPONSE = 'Here is your schedule:\n{"events": ' + json.dumps(EVENTS) + "}\nDone."
+
+
+def feed_all(parser: EventStreamParser, chunks) -> list[dict]:
+    items = []
+    for chunk in chunks:
+        items.extend(parser.feed(chunk))
+    return items
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 64, len(RESPONSE)])
+def test_any_chunking_yields_the_same_events(size):
+    parser = EventStreamParser()
+    chunks = [RESPONSE[i : i + size] for i in range(0, len(RESPONSE), size)]
+    assert feed_all(parser, chunks) == EVENTS
+    assert parser.done
+
+
+def test_events_are_returned_as_soon_as_they_close():
+    parser = EventStreamParser()
+    first = json.dumps(EVENTS[0])
+    assert parser.feed('{"events": [' + first[:-1]) == []
+    assert parser.feed("}") == [EVENTS[0]]
+    assert not parser.done
+
+
+def test_key_split_across_chunks():
+    parser = EventStreamParser()
+    assert feed_all(parser, ['prose {"eve', 'nts": [{"id": 1}]}']) == [{"id": 1}]
+
+
+def test_malformed_and_non_object_elements_are_skipped():
+    parser = EventStreamParser()
+    response = '{"events": [{"id": 1}, {"id": }, 5, "x", {"id": 2}]}'
+    assert parser.feed(response) == [{"id": 1}, {"id": 2}]
+
+
+def test_nothing_is_returned_after_the_array_closes():
+    parser = EventStreamParser()
+    parser.feed('{"events": []}')
+    assert parser.done
+    assert parser.feed('{"events": [{"id": 1}]}') == []
+
+
+def test_other_keys_are_ignored():
+    parser = EventStreamParser(key="events")
+    response = '{"notes": [{"id": 0}], "events": [{"id": 1}]}'
+    assert parser.feed(response) == [{"id": 1}]
@@ -0,0 +1,50 @@
+import threading
+
+from model_registry import SharedLlama, context_size
+
+
+class FakeLlama:
+    def __init__(self, n_ctx: int = 4096):
+        self._n_ctx = n_ctx
+        self.closed = False
+
+    def n_ctx(self) -> int:
+        return self._n_ctx
+
+    def tokenize(self, text: bytes, add_bos: bool = False) -> list[int]:
+        return list(range(len(text.split())))
+
+    def close(self):
+        self.closed = True
+
+
+def test_context_size_rounds_up_to_a_power_of_two():
+    assert context_size(100, 4096, 65536) == 4096
+    assert context_size(5000, 4096, 65536) == 8192
+    assert context_size(10**6, 4096, 65536) == 65536
+
+
+def test_tokenize_does_not_wait_for_a_borrower():
+    model = SharedLlama.wrap(FakeLlama())
+    counted = []
+    with model.borrow():
+        thread = threading.Thread(target=lambda: counted.append(model.tokenize("a b")))
+        thread.start()
+        thread.join(timeout=2)
+        assert counted == [[0, 1]]
+
+
+def test_fit_reloads_with_a_larger_context():
+    loaded = []
+
+    def loader(n_ctx):
+        loaded.append(n_ctx)
+        return FakeLlama(n_ctx)
+
+    first = FakeLlama(4096)
+    model = SharedLlama(first, loader=loader, max_context=16384)
+    with model.borrow():
+        assert model.fit("word " * 10, 100) is first
+        llama = model.fit("word " * 5000, 1000)
+    assert loaded == [8192] and llama.n_ctx() == 8192 and first.closed
+    assert model.tokenize("a b c") == [0, 1, 2]
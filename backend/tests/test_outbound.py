@@ -0,0 +1,132 @@
+import time
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from googleapiclient.errors import HttpError
+from httplib2 import Response
+
+from outbound import (
+    AdaptiveLimit,
+    OutboundService,
+    TokenBucket,
+    Verdict,
+    classify_google_error,
+    parse_retry_after,
+)
+
+
+def http_error(status: int, retry_after=None) -> HttpError:
+    headers = {"status": status}
+    if retry_after is not None:
+        headers["retry-after"] = retry_after
+    return HttpError(Response(headers), b"{}")
+
+
+def test_parse_retry_after():
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("garbage") is None
+    assert parse_retry_after("2.5") == 2.5
+    assert parse_retry_after("-1") == 0.0
+    later = datetime.now(timezone.utc) + timedelta(seconds=30)
+    assert 28 <= parse_retry_after(format_datetime(later, usegmt=True)) <= 30
+
+
+def test_classify_google_error():
+    assert classify_google_error(http_error(429, "3")) == Verdict(True, True, 3.0)
+    assert classify_google_error(http_error(503)).overload
+    assert classify_google_error(http_error(500)) == Verdict(True)
+    assert not classify_google_error(http_error(404)).retry
+    assert classify_google_error(ConnectionError()).retry
+    assert not classify_google_error(ValueError()).retry
+
+
+def test_backoff_is_jittered_within_the_window_and_honours_retry_after():
+    service = OutboundService(
+        "test", classify_google_error, base_delay=1.0, max_delay=8.0
+    )
+    for attempt, window in ((1, 1.0), (2, 2.0), (3, 4.0), (10, 8.0)):
+        delays = [service.backoff(attempt) for _ in range(200)]
+        assert all(0 <= delay <= window for delay in delays)
+    assert all(service.backoff(1, retry_after=5.0) >= 5.0 for _ in range(50))
+    # Retry-After is capped by max_delay.
+    assert service.backoff(1, retry_after=60.0) == 8.0
+
+
+def test_token_bucket_allows_a_burst_then_paces_at_the_rate():
+    bucket = TokenBucket(rate=50.0, burst=5)
+    assert sum(bucket.acquire() for _ in range(5)) == 0.0
+    start = time.monotonic()
+    for _ in range(5):
+        bucket.acquire()
+    assert time.monotonic() - start == pytest.approx(0.1, abs=0.05)
+
+
+def test_adaptive_limit_halves_once_per_cooldown_and_grows_back():
+    limit = AdaptiveLimit(initial=8, minimum=1, maximum=16, cooldown=60.0)
+    limit.on_overload()
+    limit.on_overload()
+    assert limit.limit == 4
+    # About one round of successes at the current limit adds one.
+    for _ in range(5):
+        limit.on_success()
+    assert limit.limit == 5
+    for _ in range(1000):
+        limit.on_success()
+    assert limit.limit == 16
+
+
+def test_adaptive_limit_never_drops_below_its_minimum():
+    limit = AdaptiveLimit(initial=2, minimum=1, cooldown=0.0)
+    for _ in range(5):
+        limit.on_overload()
+    assert limit.limit == 1
+
+
+def failing(errors, result="ok"):
+    calls = []
+
+    def func():
+        calls.append(1)
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return result
+
+    return func, calls
+
+
+def service(**kwargs) -> OutboundService:
+    return OutboundService(
+        "test", classify_google_error, rate=1e6, base_delay=0.001, **kwargs
+    )
+
+
+def test_transient_failures_are_retried():
+    func, calls = failing([http_error(500), http_error(503)])
+    assert service().call(func) == "ok"
+    assert len(calls) == 3
+
+
+def test_permanent_failures_are_raised_at_once():
+    func, calls = failing([http_error(404)])
+    with pytest.raises(HttpError):
+        service().call(func)
+    assert len(calls) == 1
+
+
+def test_calls_give_up_after_max_attempts():
+    func, calls = failing([http_error(500)] * 10)
+    with pytest.raises(HttpError):
+        service(max_attempts=3).call(func)
+    assert len(calls) == 3
+
+
+def test_non_idempotent_calls_are_only_retried_when_rejected():
+    func, calls = failing([http_error(500)])
+    with pytest.raises(HttpError):
+        service().call(func, idempotent=False)
+    assert len(calls) == 1
+
+    func, calls = failing([http_error(429)])
+    assert service().call(func, idempotent=False) == "ok"
+    assert len(calls) == 2
@@ -0,0 +1,90 @@
+import asyncio
+import os
+import time
+
+from profiling import ProfilingMiddleware, Sampler
+
+
+def busy(seconds: float):
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        pass
+
+
+async def streaming_app(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    for _ in range(4):
+        await asyncio.to_thread(busy, 0.05)
+        await send({"type": "http.response.body", "body": b"x", "more_body": True})
+    await send({"type": "http.response.body", "body": b""})
+
+
+def request(middleware, headers=()):
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "path": "/jobs/1/events",
+        "headers": list(headers),
+    }
+    sent = []
+
+    async def receive():
+        return {"type": "http.request"}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(middleware(scope, receive, send))
+    return sent
+
+
+def test_sampler_records_busy_threads():
+    sampler = Sampler(interval=0.002)
+    sampler.start()
+    busy(0.05)
+    sampler.stop()
+    assert sampler.samples > 0 and not sampler.truncated
+    assert any("busy (test_profiling.py)" in stack for stack in sampler.stacks)
+
+
+def test_sampler_stops_after_max_duration():
+    sampler = Sampler(interval=0.002, max_duration=0.02)
+    sampler.start()
+    time.sleep(0.1)
+    samples = sampler.samples
+    time.sleep(0.05)
+    assert sampler.truncated and sampler.samples == samples
+    sampler.stop()
+
+
+def test_profiled_requests_name_their_profile(tmp_path):
+    middleware = ProfilingMiddleware(
+        streaming_app, directory=str(tmp_path), token="secret", interval=0.002
+    )
+    [start, *_] = request(middleware, [(b"x-profile", b"secret")])
+    name = dict(start["headers"])[b"x-profile"].decode()
+    assert os.listdir(tmp_path) == [name]
+    assert "busy (test_profiling.py)" in (tmp_path / name).read_text()
+
+
+def test_streams_are_sampled_up_to_max_duration(tmp_path):
+    middleware = ProfilingMiddleware(
+        streaming_app,
+        directory=str(tmp_path),
+        sample_rate=1.0,
+        interval=0.002,
+        max_duration=0.05,
+    )
+    request(middleware)
+    [profile] = tmp_path.iterdir()
+    samples = sum(int(line.rsplit(" ", 1)[1]) for line in profile.open())
+    # Four 50ms chunks, sampled for the first 50ms only.
+    assert 0 < samples < 60
+
+
+def test_other_requests_are_not_profiled(tmp_path):
+    middleware = ProfilingMiddleware(
+        streaming_app, directory=str(tmp_path), token="secret"
+    )
+    [start, *_] = request(middleware, [(b"x-profile", b"wrong")])
+    assert start["headers"] == [] and not os.listdir(tmp_path)
@@ -0,0 +1,180 @@
+import time
+from datetime import date, datetime, timezone
+
+import pytest
+
+from calapi import sync_calendar_events
+from event_store import EventStore
+from recurrence import expand, instance_id, occurrences
+
+LA = "America/Los_Angeles"
+AFTER = datetime(2024, 10, 28, tzinfo=timezone.utc)
+BEFORE = datetime(2024, 11, 11, tzinfo=timezone.utc)
+
+
+@pytest.fixture(autouse=True)
+def pacific_time(monkeypatch):
+    # All-day events cover local days.
+    monkeypatch.setenv("TZ", LA)
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def standup(**changes) -> dict:
+    return {
+        "id": "standup",
+        "status": "confirmed",
+        "summary": "Standup",
+        "organizer": {"displayName": "Me"},
+        "updated": "2024-10-01T00:00:00.000Z",
+        "start": {"dateTime": "2024-10-28T09:00:00-07:00", "timeZone": LA},
+        "end": {"dateTime": "2024-10-28T09:15:00-07:00", "timeZone": LA},
+        "recurrence": ["RRULE:FREQ=DAILY;COUNT=14"],
+        **changes,
+    }
+
+
+def exception(original: str, **changes) -> dict:
+    return {
+        "id": f"standup_{original}",
+        "recurringEventId": "standup",
+        "status": "confirmed",
+        "summary": "Standup",
+        "organizer": {"displayName": "Me"},
+        "updated": "2024-10-01T00:00:00.000Z",
+        "originalStartTime": {
+            "dateTime": datetime.strptime(original, "%Y%m%dT%H%M%SZ")
+            .replace(tzinfo=timezone.utc)
+            .isoformat(),
+            "timeZone": LA,
+        },
+        **changes,
+    }
+
+
+def test_instance_ids_match_google():
+    start = datetime(2024, 10, 28, 9, tzinfo=timezone.utc)
+    assert instance_id("abc", start) == "abc_20241028T090000Z"
+    assert instance_id("abc", date(2024, 10, 28)) == "abc_20241028"
+
+
+def test_occurrences_keep_local_time_across_dst():
+    instances = expand(standup(), [], AFTER, BEFORE)
+    assert len(instances) == 14
+    assert {i["start"]["dateTime"][11:19] for i in instances} == {"09:00:00"}
+    # Clocks go back on November 3rd: 16:00 UTC before, 17:00 UTC after.
+    assert instances[0]["id"] == "standup_20241028T160000Z"
+    assert instances[-1]["id"] == "standup_20241110T170000Z"
+    assert all(i["recurringEventId"] == "standup" for i in instances)
+    assert instances[0]["end"]["dateTime"] == "2024-10-28T09:15:00-07:00"
+
+
+def test_exdate_removes_an_occurrence():
+    master = standup(
+        recurrence=[
+            "RRULE:FREQ=DAILY;COUNT=14",
+            f"EXDATE;TZID={LA}:20241030T090000",
+        ]
+    )
+    ids = {i["id"] for i in expand(master, [], AFTER, BEFORE)}
+    assert len(ids) == 13 and "standup_20241030T160000Z" not in ids
+
+
+def test_exceptions_replace_or_cancel_their_occurrence():
+    moved = exception(
+        "20241031T160000Z",
+        summary="Standup (late)",
+        start={"dateTime": "2024-10-31T10:00:00-07:00"},
+        end={"dateTime": "2024-10-31T10:15:00-07:00"},
+    )
+    cancelled = exception("20241101T160000Z", status="cancelled")
+    instances = expand(standup(), [moved, cancelled], AFTER, BEFORE)
+    by_id = {i["id"]: i for i in instances}
+    assert len(instances) == 13
+    assert by_id["standup_20241031T160000Z"]["summary"] == "Standup (late)"
+    assert "standup_20241101T160000Z" not in by_id
+
+
+def test_exceptions_moved_out_of_the_window_are_left_out():
+    moved = exception(
+        "20241029T160000Z",
+        start={"dateTime": "2024-12-01T09:00:00-08:00"},
+        end={"dateTime": "2024-12-01T09:15:00-08:00"},
+    )
+    ids = {i["id"] for i in expand(standup(), [moved], AFTER, BEFORE)}
+    assert len(ids) == 13 and moved["id"] not in ids
+
+
+def test_window_bounds_the_occurrences():
+    after = datetime(2024, 10, 30, 16, 10, tzinfo=timezone.utc)
+    before = datetime(2024, 11, 1, 16, tzinfo=timezone.utc)
+    starts = occurrences(standup(), after, before)
+    # The 30th is still running at `after`, the 1st starts at `before`.
+    assert [s.day for s in starts] == [30, 31]
+
+
+def test_all_day_until_is_inclusive():
+    review = {
+        "id": "review",
+        "status": "confirmed",
+        "start": {"date": "2024-10-28"},
+        "end": {"date": "2024-10-29"},
+        "recurrence": ["RRULE:FREQ=WEEKLY;UNTIL=20241104"],
+    }
+    instances = expand(review, [], AFTER, BEFORE)
+    assert [i["id"] for i in instances] == ["review_20241028", "review_20241104"]
+    assert instances[1]["start"] == {"date": "2024-11-04"}
+
+
+def test_cancelled_master_has_no_instances():
+    assert expand(standup(status="cancelled"), [], AFTER, BEFORE) == []
+
+
+class FakeSeriesService:
+    """Lists series items, like `singleEvents=False`."""
+
+    def __init__(self, items):
+        self.items = items
+
+    def events(self):
+        return self
+
+    def list(self, calendarId, updatedMin=None, singleEvents=True, **kwargs):
+        assert singleEvents is False
+        items = [
+            dict(item)
+            for item in self.items
+            if updatedMin is None or item["updated"] >= updatedMin
+        ]
+        return type("Request", (), {"execute": lambda self: {"items": items}})()
+
+
+def test_sync_expands_locally_and_drops_cancelled_series(tmp_path):
+    service = FakeSeriesService(
+        [standup(), exception("20241101T160000Z", status="cancelled")]
+    )
+    store = EventStore(str(tmp_path / "events.sqlite3"))
+
+    def sync():
+        return sync_calendar_events(
+            service,
+            store,
+            "u",
+            ["cal"],
+            "2024-10-28",
+            "2024-11-03",
+            expansion="local",
+            sync_interval=0,
+        )
+
+    # The fetch window reaches a day past each end; callers split by day.
+    days = sorted(e["start"][:10] for e in sync())
+    assert [day[-2:] for day in days] == ["28", "29", "30", "31", "02", "03", "04"]
+
+    service.items = [
+        {"id": "standup", "status": "cancelled", "updated": "2099-01-01T00:00:00Z"}
+    ]
+    assert sync() == []
+    assert store.load_series("u", "cal", {"standup"}) == {}
@@ -0,0 +1,153 @@
+import random
+
+import numpy as np
+import pytest
+
+from schedule_validator import (
+    ScheduleValidationError,
+    ScheduleValidator,
+    find_overlaps,
+)
+
+DAY = "2024-10-14"
+
+
+def event(event_id: str, start: str, end: str) -> dict:
+    return {
+        "id": event_id,
+        "calendar_id": "cal",
+        "summary": event_id,
+        "start": f"{DAY}T{start}:00-07:00",
+        "end": f"{DAY}T{end}:00-07:00",
+    }
+
+
+def brute_force_overlaps(start, end, moved) -> set:
+    pairs = set()
+    for i in range(len(start)):
+        for j in range(i + 1, len(start)):
+            if (moved[i] or moved[j]) and start[i] < end[j] and start[j] < end[i]:
+                pairs.add(frozenset((i, j)))
+    return pairs
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_find_overlaps_reports_every_overlapping_interval(seed):
+    rng = random.Random(seed)
+    n = rng.randint(1, 30)
+    start = np.array([rng.randrange(0, 100) for _ in range(n)], dtype=np.int64)
+    end = start + np.array([rng.randrange(1, 20) for _ in range(n)])
+    moved = np.array([rng.random() < 0.5 for _ in range(n)])
+
+    expected = brute_force_overlaps(start, end, moved)
+    found = find_overlaps(start, end, moved)
+    for i, j in found:
+        assert frozenset((i, j)) in expected
+    # Every interval overlapping one that sorts before it is reported.
+    order = list(np.lexsort((end, start)))
+    later = {max(pair, key=order.index) for pair in expected}
+    assert later == {j for _, j in found}
+
+
+def test_find_overlaps_ignores_overlaps_between_unmoved_events():
+    start = np.array([0, 5], dtype=np.int64)
+    end = np.array([10, 15], dtype=np.int64)
+    assert find_overlaps(start, end, np.array([False, False])) == []
+    assert find_overlaps(start, end, np.array([True, False])) == [(0, 1)]
+
+
+def test_free_slot_is_returned_immediately():
+    validator = ScheduleValidator([event("a", "09:00", "10:00")])
+    [moved] = validator.submit(event("a", "11:00", "12:00"))
+    assert moved["start"] == f"{DAY}T11:00:00-07:00"
+    assert validator.finish() == []
+
+
+def test_unchanged_events_are_not_written():
+    original = [event("a", "09:00", "10:00")]
+    validator = ScheduleValidator(original)
+    assert validator.submit(event("a", "09:00", "10:00")) == []
+    assert [e["id"] for e in validator.unchanged] == ["a"]
+
+
+def test_swapped_events_are_placed_at_finish():
+    original = [event("a", "09:00", "10:00"), event("b", "10:00", "11:00")]
+    validator = ScheduleValidator(original)
+    assert validator.submit(event("a", "10:00", "11:00")) == []
+    assert validator.submit(event("b", "09:00", "10:00")) == []
+    placed = {e["id"]: e["start"] for e in validator.finish()}
+    assert placed == {"a": f"{DAY}T10:00:00-07:00", "b": f"{DAY}T09:00:00-07:00"}
+
+
+def test_repair_restores_duration_and_shifts_past_conflicts():
+    original = [event("a", "09:00", "10:00"), event("b", "13:00", "14:00")]
+    validator = ScheduleValidator(original)
+    # Half an hour too short, and on top of b.
+    assert validator.submit(event("a", "13:30", "14:00")) == []
+    [placed] = validator.finish()
+    assert placed["start"] == f"{DAY}T14:00:00-07:00"
+    assert placed["end"] == f"{DAY}T15:00:00-07:00"
+
+
+def test_events_moved_to_another_day_are_dropped():
+    validator = ScheduleValidator([event("a", "09:00", "10:00")])
+    moved = {**event("a", "09:00", "10:00"), "start": "2024-10-15T09:00:00-07:00"}
+    assert validator.submit(moved) == []
+    assert "another day" in validator.violations[0]
+
+
+def test_unknown_and_repeated_events_are_dropped():
+    validator = ScheduleValidator([event("a", "09:00", "10:00")])
+    assert validator.submit(event("x", "11:00", "12:00")) == []
+    assert validator.submit(event("a", "11:00", "12:00")) != []
+    assert validator.submit(event("a", "12:00", "13:00")) == []
+    assert len(validator.violations) == 2
+
+
+def test_strict_mode_raises_on_the_first_violation():
+    validator = ScheduleValidator([event("a", "09:00", "10:00")], mode="strict")
+    with pytest.raises(ScheduleValidationError):
+        validator.submit(event("a", "11:00", "11:30"))
+
+
+@pytest.mark.parametrize("mode", ["strict", "repair"])
+def test_unchanged_overnight_events_are_kept(mode):
+    overnight = {**event("late", "23:00", "23:00"), "end": "2024-10-15T01:00:00-07:00"}
+    validator = ScheduleValidator([event("a", "09:00", "10:00"), overnight], mode=mode)
+    assert validator.validate([event("a", "10:00", "11:00"), dict(overnight)]) != []
+    assert [e["id"] for e in validator.unchanged] == ["late"]
+    assert validator.violations == []
+
+
+def test_moved_overnight_events_may_end_at_their_original_end():
+    overnight = {**event("late", "22:00", "22:00"), "end": "2024-10-15T01:00:00-07:00"}
+    validator = ScheduleValidator([overnight])
+    moved = {**event("late", "22:30", "22:30"), "end": "2024-10-15T01:30:00-07:00"}
+    assert validator.submit(moved) == []
+    assert "past the end of its day" in validator.violations[0]
+    validator = ScheduleValidator([overnight])
+    moved = {**event("late", "21:30", "21:30"), "end": "2024-10-15T00:30:00-07:00"}
+    [written] = validator.submit(moved)
+    assert written["end"] == "2024-10-15T00:30:00-07:00"
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_repaired_schedules_never_overlap(seed):
+    rng = random.Random(seed)
+    original = [
+        event(f"e{i}", f"{8 + i}:00".zfill(5), f"{8 + i}:30".zfill(5))
+        for i in range(10)
+    ]
+    returned = []
+    for e in original:
+        hour = rng.randrange(8, 20)
+        returned.append(
+            {
+                **e,
+                "start": f"{DAY}T{hour:02d}:00:00-07:00",
+                "end": f"{DAY}T{hour:02d}:30:00-07:00",
+            }
+        )
+    rng.shuffle(returned)
+    # `validate` raises if the final schedule has an overlap.
+    ScheduleValidator(original).validate(returned)
@@ -0,0 +1,80 @@
+import asyncio
+
+import pytest
+
+from singleflight import SingleFlight, normalize_text, request_key
+
+
+def test_request_key_ignores_whitespace_and_field_order():
+    assert request_key("a", normalize_text(" x  y\n")) == request_key("a", "x y")
+    assert request_key({"b": 1, "a": 2}) == request_key({"a": 2, "b": 1})
+    assert request_key("a", "user1") != request_key("a", "user2")
+
+
+def test_concurrent_calls_share_one_computation():
+    async def main():
+        flight, calls = SingleFlight(), 0
+
+        async def compute():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return calls
+
+        results = await asyncio.gather(*(flight.do("k", compute) for _ in range(5)))
+        return results, calls, flight
+
+    results, calls, flight = asyncio.run(main())
+    assert results == [1] * 5
+    assert calls == 1
+    assert flight.coalesced == 4
+    assert flight.in_flight() == 0
+
+
+def test_key_is_released_once_the_computation_finishes():
+    async def main():
+        flight, calls = SingleFlight(), 0
+
+        async def compute():
+            nonlocal calls
+            calls += 1
+            return calls
+
+        return [await flight.do("k", compute), await flight.do("k", compute)]
+
+    assert asyncio.run(main()) == [1, 2]
+
+
+def test_exceptions_reach_every_caller():
+    async def main():
+        flight = SingleFlight()
+
+        async def compute():
+            await asyncio.sleep(0.01)
+            raise ValueError("boom")
+
+        return await asyncio.gather(
+            flight.do("k", compute), flight.do("k", compute), return_exceptions=True
+        )
+
+    results = asyncio.run(main())
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+def test_cancelled_caller_does_not_cancel_the_others():
+    async def main():
+        flight = SingleFlight()
+
+        async def compute():
+            await asyncio.sleep(0.05)
+            return "done"
+
+        first = asyncio.ensure_future(flight.do("k", compute))
+        second = asyncio.ensure_future(flight.do("k", compute))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(main()) == "done"
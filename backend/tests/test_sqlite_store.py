@@ -0,0 +1,41 @@
+import threading
+
+import pytest
+
+from sqlite_store import SQLiteStore
+
+
+class Counters(SQLiteStore):
+    SCHEMA = ("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, n INT)",)
+
+
+def count(store: SQLiteStore) -> int:
+    return store._connection().execute("SELECT COUNT(*) FROM counters").fetchone()[0]
+
+
+def test_schema_and_directory_are_created(tmp_path):
+    store = Counters(str(tmp_path / "sub" / "counters.sqlite3"))
+    assert count(store) == 0
+    mode = store._connection().execute("PRAGMA journal_mode").fetchone()[0]
+    assert mode == "wal"
+
+
+def test_transactions_commit_or_roll_back(tmp_path):
+    store = Counters(str(tmp_path / "counters.sqlite3"))
+    with store._transaction() as conn:
+        conn.execute("INSERT INTO counters VALUES ('a', 1)")
+    with pytest.raises(RuntimeError):
+        with store._transaction() as conn:
+            conn.execute("INSERT INTO counters VALUES ('b', 1)")
+            raise RuntimeError
+    assert count(store) == 1 and not store._connection().in_transaction
+
+
+def test_each_thread_has_its_own_connection(tmp_path):
+    store = Counters(str(tmp_path / "counters.sqlite3"))
+    other = []
+    thread = threading.Thread(target=lambda: other.append(store._connection()))
+    thread.start()
+    thread.join()
+    assert other[0] is not store._connection()
+    assert store._connection() is store._connection()